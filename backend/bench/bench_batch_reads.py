@@ -0,0 +1,100 @@
+"""
+Benchmark: projected batch reads vs whole-tree 'global_batches' downloads.
+
+Seeds --batches batches (default 500) with --days days (default 60) of feed,
+mortality, vitamin and weight logs plus expenses and sales, then times the
+reads the batch list and the active-batch check used to make against the
+projected ones. The byte column is the JSON payload the read returns, which
+is what the RTDB would send over the wire for it.
+
+    python bench/bench_batch_reads.py [--batches 500] [--days 60]
+"""
+import argparse
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from benchutil import AUTH, fmt_ms, load_app, print_table, timeit
+
+
+def synthetic_batch(main, i: int, days: int) -> dict:
+    start = datetime(2024, 1, 1) + timedelta(days=i)
+    dates = [(start + timedelta(days=d)).strftime("%Y-%m-%d") for d in range(days)]
+    population = random.randint(800, 5000)
+    feed, _ = main.compute_forecast(population)
+    return {
+        "batchName": f"Batch {i}",
+        "dateCreated": dates[0],
+        "expectedCompleteDate": (start + timedelta(days=30)).strftime("%Y-%m-%d"),
+        "startingPopulation": population,
+        "status": "completed",
+        "feedForecast": feed,
+        "feed_logs": {d: {"am": 12.5, "pm": 13.0, "timestamp": 1} for d in dates},
+        "mortality_logs": {d: {"am": random.randint(0, 3), "pm": random.randint(0, 3)} for d in dates},
+        "daily_vitamin_logs": {d: {"am_amount": 10, "pm_amount": 5} for d in dates},
+        "weight_logs": {d: {"averageWeight": 40 + 30 * n, "day": n + 1} for n, d in enumerate(dates[::3])},
+        "expenses": {main.generate_push_id(): {"category": "Feed", "amount": 1500.0, "quantity": 2,
+                                               "unit": "sack", "date": dates[0]} for _ in range(days // 2)},
+        "sales": {main.generate_push_id(): {"buyerName": "Buyer", "quantity": 100, "pricePerChicken": 180,
+                                            "dateOfPurchase": dates[-1]} for _ in range(5)},
+    }
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=500)
+    parser.add_argument("--days", type=int, default=60)
+    args = parser.parse_args()
+
+    main = load_app()
+    random.seed(7)
+    updates = {}
+    for i in range(args.batches):
+        bid = main.generate_push_id()
+        batch = synthetic_batch(main, i, args.days)
+        if i == args.batches - 1:
+            batch["status"] = "active"
+        updates[f"global_batches/{bid}"] = batch
+        updates[f"batch_index/{bid}"] = main.batch_summary(batch)
+    main.db_ref("/").update(updates)
+    del updates
+
+    client = TestClient(main.app)
+
+    def run(coro_fn):
+        return lambda: asyncio.run(coro_fn())
+
+    async def whole_tree_active():
+        batches = await main.db_get("global_batches")
+        return [b for b, v in batches.items() if v.get("status") == "active"]
+
+    async def indexed_active():
+        return list((await main.get_batches_by_status("active")).keys())
+
+    cases = [
+        ("active check: whole tree", run(whole_tree_active), lambda: main.db_ref("global_batches").get()),
+        ("active check: status index", run(indexed_active),
+         lambda: main.db_ref("batch_index").order_by_child("status").equal_to("active").get()),
+        ("batch ids: shallow", run(lambda: main.db_get("global_batches", shallow=True)),
+         lambda: main.db_ref("global_batches").get(shallow=True)),
+        ("GET /get-batches", lambda: client.get("/get-batches", headers=AUTH), None),
+        ("GET /get-batches?fields=batchName,status", lambda: client.get("/get-batches?fields=batchName,status", headers=AUTH),
+         lambda: main.db_ref("batch_index").get()),
+    ]
+    assert run(whole_tree_active)() == run(indexed_active)()
+
+    rows = []
+    for name, fn, payload in cases:
+        result = timeit(fn, repeat=3)
+        size = main.payload_size(payload()) if payload else len(fn().content)
+        rows.append([name, fmt_ms(result["best"]), fmt_ms(result["median"]), f"{size / 1024:,.1f} KiB"])
+    client.close()
+    main.db_executor.shutdown(wait=False)
+
+    print_table(f"{args.batches} batches x {args.days} days of logs", ["read", "best", "median", "payload"], rows)
+
+
+if __name__ == "__main__":
+    main_()
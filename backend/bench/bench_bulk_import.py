@@ -0,0 +1,83 @@
+"""
+Throughput benchmark: bulk import endpoints vs one request per row.
+
+Posts --rows expenses (default 200) to one batch, first one /add-expense
+request per row (what the frontend used to do, sequentially), then as a
+single /bulk-add-expenses request, and the same for daily logs
+(/add-daily-log vs /bulk-add-daily-logs). Every store call pays an
+artificial round trip (--latency-ms, default 20) so the number of database
+calls shows, not just local CPU.
+
+    python bench/bench_bulk_import.py [--rows 200] [--latency-ms 20]
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+
+from bench_db_load import SlowReference
+from benchutil import AUTH, load_app, print_table
+
+
+def expense_rows(batch_id: str, rows: int) -> list:
+    return [{"batchId": batch_id, "category": "Feed", "itemName": f"Sack {i}", "amount": 1500.0,
+             "quantity": 1, "unit": "sack", "date": "2026-01-02"} for i in range(rows)]
+
+
+def log_rows(batch_id: str, rows: int) -> list:
+    start = date(2026, 1, 1)
+    return [{"batchId": batch_id, "kind": ("feed_logs", "mortality_logs")[i % 2],
+             "date": (start + timedelta(days=i // 2 % 300)).isoformat(), "am": 3, "pm": 2} for i in range(rows)]
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    main = load_app()
+    plain_ref = main.db_ref
+    main.db_ref = lambda path: SlowReference(plain_ref(path), args.latency_ms / 1000)
+    client = TestClient(main.app)
+
+    def new_batch(name: str) -> str:
+        client.post("/create-batch", headers=AUTH, json={"batchName": name, "dateCreated": "2026-01-01",
+                                                         "expectedCompleteDate": "2026-12-31", "startingPopulation": 1000})
+        return next(b["id"] for b in client.get("/get-batches?fields=batchName", headers=AUTH).json() if b["batchName"] == name)
+
+    def timed(fn) -> tuple:
+        calls = sum(op["count"] for op in main.db_metrics["ops"].values())
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start, sum(op["count"] for op in main.db_metrics["ops"].values()) - calls
+
+    cases = [
+        ("expenses", "/add-expense", "/bulk-add-expenses", expense_rows),
+        ("daily logs", "/add-daily-log", "/bulk-add-daily-logs", log_rows),
+    ]
+    rows = []
+    for label, single, bulk, make_rows in cases:
+        per_row_batch, bulk_batch = new_batch(f"{label} per row"), new_batch(f"{label} bulk")
+
+        def per_row():
+            for row in make_rows(per_row_batch, args.rows):
+                assert client.post(single, headers=AUTH, json=row).status_code == 200
+
+        def one_request():
+            body = client.post(bulk, headers=AUTH, json={"rows": make_rows(bulk_batch, args.rows)}).json()
+            assert body["counts"].get("error", 0) == 0, body["counts"]
+
+        slow, slow_calls = timed(per_row)
+        fast, fast_calls = timed(one_request)
+        rows.append([label, "per row", f"{slow:.2f} s", f"{args.rows / slow:,.0f}", slow_calls, "1.0x"])
+        rows.append([label, "bulk", f"{fast:.2f} s", f"{args.rows / fast:,.0f}", fast_calls, f"{slow / fast:.0f}x"])
+    client.close()
+    main.db_executor.shutdown(wait=False)
+
+    print_table(f"{args.rows} rows, {args.latency_ms:g} ms per DB call", ["rows", "path", "time", "rows/s", "DB calls", "speed-up"], rows)
+
+
+if __name__ == "__main__":
+    main_()
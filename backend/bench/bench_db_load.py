@@ -0,0 +1,121 @@
+"""
+Load benchmark for the non-blocking DB layer (run_db + db_executor).
+
+The app runs on the local SQLite store with an artificial round-trip delay on
+every database call (--latency-ms, default 20, roughly a Firebase REST call
+from the farm's host). A mix of dashboard reads is fired at increasing
+concurrency through the ASGI app, once through the thread pool and once with
+the calls made inline on the event loop (how every handler used to call
+firebase_admin). Inline throughput stays flat as concurrency grows; the pool
+scales until DB_MAX_WORKERS is saturated.
+
+    python bench/bench_db_load.py [--latency-ms 20] [--requests 400] [--batches 50]
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from benchutil import AUTH, load_app, print_table
+
+
+QUERY_BUILDERS = ("order_by", "start", "end", "equal", "limit")
+
+
+class SlowReference:
+    """Delays every call of a store reference by the configured round trip."""
+
+    def __init__(self, ref, latency: float):
+        self.ref = ref
+        self.latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self.ref, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            # query builders (order_by_child(...).equal_to(...)) only delay their final get()
+            if name.startswith(QUERY_BUILDERS):
+                return SlowReference(attr(*args, **kwargs), self.latency)
+            time.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return call
+
+
+def seed(main, batches: int) -> list:
+    ids = []
+    for i in range(batches):
+        bid = main.generate_push_id()
+        main.db_ref(f"global_batches/{bid}").set({
+            "batchName": f"Batch {i}", "status": "inactive", "dateCreated": "2026-01-01",
+            "startingPopulation": 1000,
+            "expenses": {main.generate_push_id(): {"category": "Feed", "itemName": "Starter", "amount": 1500.0,
+                                                   "quantity": 2, "unit": "sack", "date": "2026-01-02"}
+                         for _ in range(20)}
+        })
+        main.db_ref(f"batch_index/{bid}").set({"batchName": f"Batch {i}", "status": "inactive", "dateCreated": "2026-01-01"})
+        ids.append(bid)
+    return ids
+
+
+async def run_load(app, paths: list, concurrency: int, total: int) -> dict:
+    latencies = []
+    queue = list(range(total))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def worker():
+            while queue:
+                i = queue.pop()
+                start = time.perf_counter()
+                response = await client.get(paths[i % len(paths)], headers=AUTH)
+                assert response.status_code == 200, response.text
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {"rps": total / elapsed, "p50": latencies[len(latencies) // 2],
+            "p95": latencies[int(len(latencies) * 0.95) - 1]}
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--batches", type=int, default=50)
+    args = parser.parse_args()
+
+    main = load_app()
+    ids = seed(main, args.batches)
+    paths = ["/get-batches?fields=batchName,status"] + [f"/get-expenses/{bid}" for bid in ids[:10]] \
+        + [f"/batch-summary/{bid}" for bid in ids[:10]]
+
+    plain_ref = main.db_ref
+    main.db_ref = lambda path: SlowReference(plain_ref(path), args.latency_ms / 1000)
+    pooled_run_db = main.run_db
+
+    async def inline_run_db(op, fn, *a, **kw):
+        return fn(*a, **kw)
+
+    rows = []
+    for concurrency in (1, 8, 32, 64):
+        for mode, run_db in (("inline", inline_run_db), ("pool", pooled_run_db)):
+            main.run_db = run_db
+            main.db_metrics["max_queue_depth"] = 0
+            result = asyncio.run(run_load(main.app, paths, concurrency, args.requests))
+            rows.append([mode, concurrency, f"{result['rps']:.0f}", f"{result['p50'] * 1000:.1f}",
+                         f"{result['p95'] * 1000:.1f}", main.db_metrics["max_queue_depth"] if mode == "pool" else "-"])
+    main.run_db = pooled_run_db
+    main.db_executor.shutdown(wait=False)
+
+    print_table(f"{args.requests} dashboard reads, {args.latency_ms:g} ms per DB call, "
+                f"{main.DB_MAX_WORKERS} pool workers",
+                ["mode", "concurrency", "req/s", "p50 ms", "p95 ms", "max queue"], rows)
+
+
+if __name__ == "__main__":
+    main_()
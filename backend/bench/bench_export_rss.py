@@ -0,0 +1,108 @@
+"""
+Peak-memory check for the streaming exports on a synthetic 1M-row dataset.
+
+The parent process seeds one batch with --rows expenses (default 1,000,000)
+into a SQLite store, then runs each export in a fresh child process so the
+peak RSS it reports (ru_maxrss) belongs to the export alone:
+
+  stream   /export-expenses/{id} as NDJSON, body consumed chunk by chunk
+  list     the old shape: the whole node read into memory and encoded at once
+
+The stream child fails (exit 1) when its peak RSS grows by more than
+--max-rss-mb over its own RSS before the export started.
+
+    python bench/bench_export_rss.py [--rows 1000000] [--max-rss-mb 64]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from benchutil import load_app
+
+BATCH_ID = "bench-export"
+SEED_CHUNK = 20_000
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+
+
+def seed(main, rows: int):
+    for start in range(0, rows, SEED_CHUNK):
+        main.db_ref(f"global_batches/{BATCH_ID}/expenses").update({
+            f"e{i:08d}": {"category": "Feed", "itemName": "Starter", "amount": 1500.0 + i % 100,
+                          "quantity": 2.0, "unit": "sack", "date": "2026-01-02"}
+            for i in range(start, min(start + SEED_CHUNK, rows))
+        })
+
+
+def run_child(mode: str, main) -> dict:
+    async def stream():
+        response = main.export_response(main.iter_children_with_id(f"global_batches/{BATCH_ID}/expenses"),
+                                         main.EXPENSE_COLUMNS, "ndjson", "expenses")
+        rows = size = 0
+        async for chunk in response.body_iterator:
+            rows += chunk.count("\n")
+            size += len(chunk)
+        return rows, size
+
+    async def as_list():
+        expenses = await main.db_get(f"global_batches/{BATCH_ID}/expenses")
+        body = main.dump_json([{"id": k, **v} for k, v in expenses.items()])
+        return len(expenses), len(body)
+
+    baseline = rss_mb()
+    start = time.perf_counter()
+    rows, size = asyncio.run(stream() if mode == "stream" else as_list())
+    return {"mode": mode, "rows": rows, "bytes": size, "seconds": round(time.perf_counter() - start, 1),
+            "baselineMb": round(baseline, 1), "peakMb": round(peak_rss_mb(), 1)}
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--max-rss-mb", type=float, default=64.0)
+    parser.add_argument("--child", choices=["stream", "list"])
+    parser.add_argument("--store")
+    args = parser.parse_args()
+
+    if args.child:
+        main = load_app(SQLITE_PATH=args.store)
+        result = run_child(args.child, main)
+        main.db_executor.shutdown(wait=False)
+        print(json.dumps(result))
+        return
+
+    main = load_app()
+    store = os.environ["SQLITE_PATH"]
+    start = time.perf_counter()
+    seed(main, args.rows)
+    print(f"Seeded {args.rows:,} expense rows in {time.perf_counter() - start:.0f} s")
+    main.db_executor.shutdown(wait=False)
+
+    failed = False
+    for mode in ("stream", "list"):
+        out = subprocess.run([sys.executable, __file__, "--child", mode, "--store", store],
+                             capture_output=True, text=True, check=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        growth = result["peakMb"] - result["baselineMb"]
+        print(f"{mode:>6}: {result['rows']:,} rows, {result['bytes'] / 2 ** 20:,.0f} MiB in {result['seconds']} s, "
+              f"peak RSS {result['peakMb']:,.0f} MiB (+{growth:,.0f} MiB over the idle app)")
+        if mode == "stream" and growth > args.max_rss_mb:
+            print(f"FAIL: streaming export grew RSS by {growth:.0f} MiB (budget {args.max_rss_mb:g} MiB)")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main_()
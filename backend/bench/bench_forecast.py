@@ -0,0 +1,63 @@
+"""
+Benchmark: vectorised forecast engine vs the scalar reference functions.
+
+Forecasts --batches populations (default 10,000) three ways:
+
+  scalar loop     generate_forecast_data + generate_weight_forecast per batch
+  compute         compute_forecast per batch (same output, vectorised inside)
+  batched arrays  one forecast_batches call for every batch at once
+  batched rows    the same call plus forecast_rows for every batch
+
+and checks that every batch's rows equal the scalar loop's before timing.
+
+    python bench/bench_forecast.py [--batches 10000]
+"""
+import argparse
+import random
+
+from benchutil import fmt_ms, load_app, print_table, timeit
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=10_000)
+    args = parser.parse_args()
+
+    main = load_app()
+    rng = random.Random(11)
+    populations = [rng.randint(100, 20_000) for _ in range(args.batches)]
+    start_weights = [round(rng.uniform(35, 60), 1) for _ in range(args.batches)]
+
+    def scalar():
+        out = []
+        for population, start_weight in zip(populations, start_weights):
+            feed = main.generate_forecast_data(population)
+            out.append((feed, main.generate_weight_forecast(start_weight, population, feed)))
+        return out
+
+    def per_batch():
+        return [main.compute_forecast(p, w) for p, w in zip(populations, start_weights)]
+
+    def batched():
+        return main.forecast_batches(populations, start_weights)
+
+    def batched_rows():
+        forecast = main.forecast_batches(populations, start_weights)
+        return [main.forecast_rows(forecast, i) for i in range(args.batches)]
+
+    assert batched_rows() == scalar(), "vectorised forecast differs from the reference loop"
+
+    results = [(name, timeit(fn, repeat=3)) for name, fn in (
+        ("scalar loop", scalar), ("compute_forecast", per_batch),
+        ("batched arrays", batched), ("batched rows", batched_rows))]
+    reference = results[0][1]["best"]
+    main.db_executor.shutdown(wait=False)
+
+    print_table(f"{args.batches:,} batch forecasts (30-day cycle), outputs identical", ["engine", "best", "median", "per batch", "speed-up"], [
+        [name, fmt_ms(r["best"]), fmt_ms(r["median"]), f"{r['best'] / args.batches * 1e6:.2f} us",
+         f"{reference / r['best']:.1f}x"] for name, r in results
+    ])
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,64 @@
+"""
+Serialization microbenchmark on realistic response payloads.
+
+Payloads:
+  batches   /get-batches body for --batches synthetic batches (60 days of logs each)
+  records   /get-all-records body with --records rows
+
+Encoders:
+  fastapi default   jsonable_encoder + json.dumps (JSONResponse), what the app used before
+  json.dumps only   JSONResponse without jsonable_encoder
+  FastJSONResponse  the app's response class (orjson when installed)
+
+    python bench/bench_serialization.py [--batches 200] [--records 50000]
+"""
+import argparse
+import json
+import random
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from bench_batch_reads import synthetic_batch
+from benchutil import fmt_ms, load_app, print_table, timeit
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=200)
+    parser.add_argument("--records", type=int, default=50_000)
+    args = parser.parse_args()
+
+    main = load_app()
+    random.seed(5)
+    batches = [{**synthetic_batch(main, i, 60), "id": main.generate_push_id()} for i in range(args.batches)]
+    kinds = ["mortality_logs", "feed_logs", "daily_vitamin_logs", "weight_logs"]
+    records = [
+        main.build_log_record(kinds[i % 4], "b1", "Batch 1", f"2026-01-{i % 28 + 1:02d}",
+                              {"am": 3, "pm": 2, "am_amount": 1, "averageWeight": 900, "timestamp": 1_700_000_000_000 + i})
+        for i in range(args.records)
+    ]
+
+    encoders = [
+        ("fastapi default", lambda p: JSONResponse(jsonable_encoder(p)).body),
+        ("json.dumps only", lambda p: JSONResponse(p).body),
+        ("FastJSONResponse", lambda p: main.FastJSONResponse(p).body),
+    ]
+    rows = []
+    for label, payload in (("batches", batches), ("records", records)):
+        assert json.loads(main.FastJSONResponse(payload).body) == json.loads(JSONResponse(jsonable_encoder(payload)).body)
+        size = len(main.FastJSONResponse(payload).body)
+        baseline = None
+        for name, encode in encoders:
+            result = timeit(lambda: encode(payload), repeat=5)
+            baseline = baseline or result["best"]
+            rows.append([label, f"{size / 2 ** 20:.1f} MiB", name, fmt_ms(result["best"]), fmt_ms(result["median"]),
+                         f"{baseline / result['best']:.1f}x"])
+    main.db_executor.shutdown(wait=False)
+
+    engine = "orjson" if main.ORJSON_AVAILABLE else "stdlib json (orjson not installed)"
+    print_table(f"Response encoding, FastJSONResponse on {engine}", ["payload", "size", "encoder", "best", "median", "speed-up"], rows)
+
+
+if __name__ == "__main__":
+    main_()
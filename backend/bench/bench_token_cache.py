@@ -0,0 +1,97 @@
+"""
+Microbenchmark: cached ID token verification vs verifying on every request.
+
+Tokens are real RS256 JWTs signed with a throwaway key, and every miss goes
+through google.oauth2.id_token.verify_token, the same call firebase_admin makes
+to check the signature and the claims. The signing certificates are served
+from memory, like firebase_admin's warm certificate cache, so the numbers are
+the per-request CPU cost only. A real verification that has to refetch the
+certificates also pays a network round trip on top.
+
+    python bench/bench_token_cache.py [--calls 2000] [--users 50]
+"""
+import argparse
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.auth import crypt, jwt
+from google.oauth2 import id_token
+
+from benchutil import fmt_ms, load_app, print_table
+
+PROJECT = "bench-project"
+CERTS_URL = "https://bench.invalid/certs"
+KEY_ID = "bench-key"
+
+
+class CertRequest:
+    """google.auth transport Request that answers the certificate URL from memory."""
+
+    def __init__(self, certs: dict):
+        self.body = json.dumps(certs).encode("utf-8")
+
+    def __call__(self, url, method="GET", **kwargs):
+        return SimpleNamespace(status=200, data=self.body, headers={})
+
+
+def make_signer():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+    public_pem = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                               serialization.PublicFormat.SubjectPublicKeyInfo)
+    return crypt.RSASigner.from_string(private_pem, key_id=KEY_ID), {KEY_ID: public_pem.decode("ascii")}
+
+
+def make_token(signer, uid: str) -> str:
+    now = int(time.time())
+    payload = {"iss": f"https://securetoken.google.com/{PROJECT}", "aud": PROJECT, "sub": uid,
+               "uid": uid, "iat": now, "exp": now + 3600, "auth_time": now}
+    return jwt.encode(signer, payload).decode("ascii")
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    main = load_app()
+    main.app.dependency_overrides.clear()
+    signer, certs = make_signer()
+    request = CertRequest(certs)
+    auth = SimpleNamespace(verify_id_token=lambda token: id_token.verify_token(
+        token, request, audience=PROJECT, certs_url=CERTS_URL))
+    main.get_firebase = lambda: SimpleNamespace(auth=auth)
+    headers = [f"Bearer {make_token(signer, f'user-{i}')}" for i in range(args.users)]
+
+    async def run(cached: bool) -> float:
+        start = time.perf_counter()
+        for i in range(args.calls):
+            if not cached:
+                main.token_cache.clear()
+            claims = await main.verify_token(headers[i % len(headers)])
+            assert claims["uid"] == f"user-{i % len(headers)}"
+        return (time.perf_counter() - start) / args.calls
+
+    main.token_cache.clear()
+    uncached = asyncio.run(run(cached=False))
+    main.token_cache.clear()
+    main.token_cache_stats.update(hits=0, misses=0)
+    cached = asyncio.run(run(cached=True))
+    stats = main.get_token_cache_metrics()
+    main.db_executor.shutdown(wait=False)
+
+    print_table(f"verify_token, {args.calls} calls over {args.users} users", ["path", "per call", "calls/s", "speed-up"], [
+        ["verify every request", fmt_ms(uncached), f"{1 / uncached:,.0f}", "1.0x"],
+        ["cached", fmt_ms(cached), f"{1 / cached:,.0f}", f"{uncached / cached:.1f}x"],
+    ])
+    print(f"\ncache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} entries")
+
+
+if __name__ == "__main__":
+    main_()
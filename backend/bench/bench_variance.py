@@ -0,0 +1,66 @@
+"""
+Benchmark: actual-vs-forecast variance cost per batch-day.
+
+Builds --batches synthetic active batches of --days logged days (feed every
+day, mortality, a weigh-in every third day) as BatchSeries and times:
+
+  full pass      compute_variance over every batch at once (the /variance/active path)
+  one batch      compute_variance for a single batch
+  incremental    refresh_batch_variance after one log lands (one batch, from its series node)
+
+    python bench/bench_variance.py [--batches 200] [--days 45]
+"""
+import argparse
+
+import numpy as np
+
+from benchutil import load_app, print_table, timeit
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=200)
+    parser.add_argument("--days", type=int, default=45)
+    args = parser.parse_args()
+
+    main = load_app()
+    rng = np.random.default_rng(17)
+    summaries, series, nodes = [], [], []
+    for i in range(args.batches):
+        population = int(rng.integers(800, 5000))
+        feed = main.forecast_batches([population], [50.0], args.days)["targetKilos"][0] * rng.uniform(0.9, 1.1, args.days)
+        weight = np.zeros(args.days)
+        weight[2::3] = main.forecast_batches([population], [50.0], args.days)["avgWeight"][0, 2::3] * rng.uniform(0.95, 1.05)
+        node = {"startDate": "2026-01-01", "days": args.days, "feedKg": feed.round(2).tolist(),
+                "mortality": rng.integers(0, 4, args.days).tolist(), "vitamins": [0] * args.days,
+                "weight": weight.round(1).tolist()}
+        bid = f"b{i:05d}"
+        summaries.append({"batchName": f"Batch {i}", "status": "active", "startingPopulation": population,
+                          "averageChickWeight": 50.0})
+        series.append(main.BatchSeries.from_node(bid, node))
+        nodes.append((bid, node))
+
+    # refresh_batch_variance recomputes a batch that is already cached, and re-caches it
+    main.store_variance(summaries[0], main.compute_variance(summaries[:1], series[:1])[0])
+
+    def incremental():
+        main.refresh_batch_variance(*nodes[0])
+        assert nodes[0][0] in main.variance_cache
+
+    batch_days = args.batches * args.days
+    cases = [
+        ("full pass", lambda: main.compute_variance(summaries, series), batch_days),
+        ("one batch", lambda: main.compute_variance(summaries[:1], series[:1]), args.days),
+        ("incremental", incremental, args.days),
+    ]
+    rows = []
+    for name, fn, days in cases:
+        result = timeit(fn, repeat=5)
+        rows.append([name, days, f"{result['best'] * 1000:.2f} ms", f"{result['best'] / days * 1e6:.1f} us"])
+    main.db_executor.shutdown(wait=False)
+
+    print_table(f"variance over {args.batches} batches x {args.days} days", ["case", "batch-days", "best", "per batch-day"], rows)
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,51 @@
+"""
+Shared setup for the benchmark scripts in this directory.
+
+Every benchmark runs the app in-process on the SQLite store in a temporary
+directory (no Firebase project needed), with verify_token answering for a
+fixed admin user. Run them from backend/, e.g. `python bench/bench_db_load.py`.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_UID = "bench-admin"
+AUTH = {"Authorization": "Bearer bench-token"}
+
+
+def load_app(**env):
+    """Imports main on a fresh SQLite store and returns the module."""
+    data_dir = tempfile.mkdtemp(prefix="cnalon-bench-")
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = os.path.join(data_dir, "bench.sqlite3")
+    os.environ.setdefault("SLOW_REQUEST_MS", "0")
+    os.environ.update({k: str(v) for k, v in env.items()})
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import main
+    main.app.dependency_overrides[main.verify_token] = lambda: {"uid": BENCH_UID, "exp": 9999999999}
+    main.db_ref(f"users/{BENCH_UID}").set({"role": "admin", "status": "online"})
+    return main
+
+
+def timeit(fn, repeat: int = 5, number: int = 1) -> dict:
+    """Best and median wall time of `number` calls of fn, over `repeat` rounds (seconds per call)."""
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number)
+    return {"best": min(rounds), "median": statistics.median(rounds)}
+
+
+def fmt_ms(seconds: float) -> str:
+    return f"{seconds * 1000:9.3f} ms"
+
+
+def print_table(title: str, header: list, rows: list):
+    print(f"\n{title}")
+    widths = [max(len(str(v)) for v in column) for column in zip(header, *rows)]
+    for line in [header, ["-" * w for w in widths], *rows]:
+        print("  ".join(str(v).rjust(w) for v, w in zip(line, widths)))
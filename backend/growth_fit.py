@@ -0,0 +1,69 @@
+"""
+Growth model calibration from completed batches.
+
+fit_growth_model is a pure function over plain numpy arrays so main.py can run
+it in a worker process; importing this module pulls in nothing but numpy.
+
+Model:
+  weight   ln(W(t) / W0) = scale * (1 - exp(-rate * t))      (Gompertz)
+           For every rate on a log-spaced grid the best scale is a closed-form
+           least-squares fit; the grid point with the lowest error wins.
+  intake   median grams of feed per live bird per day across the batches,
+           the feed template's grams where no batch logged that day
+  fcr(t)   intake(t) / (W(t) - W(t - 1)), clipped to FCR_BOUNDS
+"""
+import numpy as np
+
+GOMPERTZ_RATES = np.geomspace(0.005, 0.5, 400)
+FCR_BOUNDS = (0.8, 4.0)
+
+
+def fit_gompertz(days: np.ndarray, ratios: np.ndarray) -> dict:
+    """Fits ln(ratio) = scale * (1 - exp(-rate * day)) over pooled observations."""
+    y = np.log(ratios)
+    basis = 1.0 - np.exp(-np.outer(GOMPERTZ_RATES, days))            # (rates, observations)
+    scales = (basis @ y) / np.einsum("ij,ij->i", basis, basis)
+    errors = ((basis * scales[:, None] - y) ** 2).mean(axis=1)
+    best = int(np.argmin(errors))
+    return {"rate": float(GOMPERTZ_RATES[best]), "scale": float(scales[best]), "rmse": float(np.sqrt(errors[best]))}
+
+
+def gompertz_weight(curve: dict, start_weight: float, days: np.ndarray) -> np.ndarray:
+    return start_weight * np.exp(curve["scale"] * (1.0 - np.exp(-curve["rate"] * days)))
+
+
+def fit_growth_model(batches: list, template_grams: np.ndarray) -> dict:
+    """
+    batches: [{"startWeight": g, "feedGrams": per-bird grams by day, "weights": average g by day (0 = not weighed)}]
+    template_grams: planned grams per bird for days 1..N (N = length of the returned curves)
+    """
+    cycle_days = len(template_grams)
+    obs_days, obs_ratios = [], []
+    intake = np.full((len(batches), cycle_days), np.nan)
+    for i, batch in enumerate(batches):
+        weights = np.asarray(batch["weights"], dtype=np.float64)[:cycle_days]
+        weighed = np.flatnonzero(weights > batch["startWeight"])
+        obs_days.append(weighed + 1.0)
+        obs_ratios.append(weights[weighed] / batch["startWeight"])
+        grams = np.asarray(batch["feedGrams"], dtype=np.float64)[:cycle_days]
+        intake[i, :grams.size] = np.where(grams > 0, grams, np.nan)
+
+    days = np.concatenate(obs_days)
+    curve = fit_gompertz(days, np.concatenate(obs_ratios))
+    start_weight = float(np.median([b["startWeight"] for b in batches]))
+
+    logged = ~np.all(np.isnan(intake), axis=0)
+    daily_intake = np.asarray(template_grams, dtype=np.float64).copy()
+    daily_intake[logged] = np.nanmedian(intake[:, logged], axis=0)
+
+    weight = gompertz_weight(curve, start_weight, np.arange(0, cycle_days + 1, dtype=np.float64))
+    gain = np.diff(weight)
+    fcr = np.clip(np.divide(daily_intake, gain, out=np.full(cycle_days, FCR_BOUNDS[1]), where=gain > 0), *FCR_BOUNDS)
+    return {
+        "fcr": np.round(fcr, 4).tolist(),
+        "intakeGrams": np.round(daily_intake, 2).tolist(),
+        "weight": np.round(weight[1:], 1).tolist(),
+        "gompertz": {**curve, "startWeight": start_weight},
+        "batches": len(batches),
+        "observations": int(days.size)
+    }
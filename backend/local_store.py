@@ -0,0 +1,468 @@
+"""
+Local SQLite storage backend for the paths main.py keeps in the Firebase RTDB.
+
+LocalStore.reference(path) returns an object with the same surface as
+firebase_admin.db.reference (get/set/update/push/delete/transaction, ordered
+queries and listen), so the db_* helpers in main.py run unchanged on top of it.
+
+Storage layout (SQLite in WAL mode):
+  nodes(path, value)       one row per leaf; path segments are joined with
+                           SEP (\x01) instead of "/" so byte order == key order
+                           and a node's subtree is one contiguous range
+  child_index(parent, child, key, value)
+                           the ".indexOn" entries declared in RTDB_INDEXES,
+                           kept up to date on every write (batch_index by
+                           status/date, records_index by timestamp/batch id)
+  outbox(seq, path, value) with outbox=True (hybrid mode), every write is also
+                           appended here in the same transaction, to be
+                           replayed to Firebase by main.py's sync worker
+"""
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+SEP = "\x01"
+SEP_END = "\x02"  # first character after SEP: prefix + SEP_END bounds a subtree
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    path TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS child_index (
+    parent TEXT NOT NULL,
+    child TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value,
+    PRIMARY KEY (parent, child, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS child_index_by_value ON child_index (parent, child, value, key);
+CREATE TABLE IF NOT EXISTS child_index_meta (
+    parent TEXT NOT NULL,
+    child TEXT NOT NULL,
+    PRIMARY KEY (parent, child)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class IndexNotDefinedError(Exception):
+    pass
+
+
+def split_path(path: str) -> list:
+    return [p for p in (path or "").strip("/").split("/") if p]
+
+
+def encode(segments: list) -> str:
+    return SEP.join(segments)
+
+
+def flatten(value, prefix: list, rows: list):
+    """Appends (encoded path, json) for every leaf of value. Lists are stored like RTDB does: index keys."""
+    if value is None:
+        return
+    if isinstance(value, dict):
+        for k, v in value.items():
+            flatten(v, prefix + [str(k)], rows)
+    elif isinstance(value, (list, tuple)):
+        for i, v in enumerate(value):
+            flatten(v, prefix + [str(i)], rows)
+    else:
+        rows.append((encode(prefix), json.dumps(value)))
+
+
+def arrayify(node):
+    """RTDB returns objects whose keys are mostly-dense integers as lists."""
+    if not isinstance(node, dict):
+        return node
+    for k in node:
+        node[k] = arrayify(node[k])
+    if node and all(k.isdigit() and (k == "0" or not k.startswith("0")) for k in node):
+        top = max(int(k) for k in node)
+        if len(node) * 2 > top + 1:
+            return [node.get(str(i)) for i in range(top + 1)]
+    return node
+
+
+def sub_value(value, segments: list):
+    for seg in segments:
+        if isinstance(value, dict):
+            value = value.get(seg)
+        elif isinstance(value, list) and seg.isdigit() and int(seg) < len(value):
+            value = value[int(seg)]
+        else:
+            return None
+    return value
+
+
+class LocalEvent:
+    def __init__(self, event_type: str, path: str, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class ListenerRegistration:
+    def __init__(self, store, entry):
+        self.store = store
+        self.entry = entry
+
+    def close(self):
+        with self.store.listeners_lock:
+            if self.entry in self.store.listeners:
+                self.store.listeners.remove(self.entry)
+
+
+class LocalStore:
+    def __init__(self, filename: str, indexes: dict, push_id, outbox: bool = False):
+        self.filename = filename
+        self.indexes = indexes        # parent path -> [child, ...] (shared with main.RTDB_INDEXES)
+        self.push_id = push_id
+        self.outbox = outbox
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self.listeners = []           # (segments, callback)
+        self.listeners_lock = threading.Lock()
+        self.connection().executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self.local.conn = conn
+        return conn
+
+    def reference(self, path: str = "/") -> "LocalReference":
+        return LocalReference(self, split_path(path))
+
+    # --- reads ---
+    def read(self, conn, segments: list):
+        base = encode(segments)
+        if segments:
+            rows = conn.execute(
+                "SELECT path, value FROM nodes WHERE path = ? OR (path > ? AND path < ?) ORDER BY path",
+                (base, base + SEP, base + SEP_END)).fetchall()
+        else:
+            rows = conn.execute("SELECT path, value FROM nodes ORDER BY path").fetchall()
+        if not rows:
+            return None
+        if rows[0][0] == base and segments:
+            return json.loads(rows[0][1])
+        skip = len(base) + 1 if segments else 0
+        tree = {}
+        for path, value in rows:
+            parts = path[skip:].split(SEP)
+            node = tree
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node[parts[-1]] = json.loads(value)
+        return arrayify(tree)
+
+    def child_keys(self, conn, segments: list, start=None, end=None, reverse=False, limit=None) -> list:
+        """Ordered child keys by skip-scanning the path index (one lookup per child, never the whole subtree)."""
+        prefix = encode(segments) + SEP if segments else ""
+        lo = prefix + (start or "")
+        hi = prefix + end + SEP_END if end is not None else (prefix[:-1] + SEP_END if segments else None)
+        keys = []
+        while limit is None or len(keys) < limit:
+            sql, args = "SELECT path, value FROM nodes WHERE path >= ?", [lo]
+            if hi is not None:
+                sql += " AND path < ?"
+                args.append(hi)
+            row = conn.execute(sql + (" ORDER BY path DESC" if reverse else " ORDER BY path") + " LIMIT 1", args).fetchone()
+            if row is None:
+                break
+            rest = row[0][len(prefix):]
+            key = rest.split(SEP, 1)[0]
+            keys.append((key, json.loads(row[1]) if SEP not in rest else True))
+            if reverse:
+                hi = prefix + key
+            else:
+                lo = prefix + key + SEP_END
+        return keys
+
+    def get(self, segments: list, shallow: bool = False):
+        conn = self.connection()
+        if not shallow:
+            return self.read(conn, segments)
+        conn.execute("BEGIN")
+        try:
+            leaf = conn.execute("SELECT value FROM nodes WHERE path = ?", (encode(segments),)).fetchone() if segments else None
+            if leaf is not None:
+                return json.loads(leaf[0])
+            return dict(self.child_keys(conn, segments)) or None
+        finally:
+            conn.execute("COMMIT")
+
+    # --- writes ---
+    def write_node(self, conn, segments: list, value):
+        base = encode(segments)
+        if segments:
+            conn.execute("DELETE FROM nodes WHERE path = ? OR (path > ? AND path < ?)", (base, base + SEP, base + SEP_END))
+            # A scalar stored at an ancestor is replaced by the new object
+            conn.executemany("DELETE FROM nodes WHERE path = ?", [(encode(segments[:i]),) for i in range(1, len(segments))])
+        else:
+            conn.execute("DELETE FROM nodes")
+        rows = []
+        flatten(value, segments, rows)
+        conn.executemany("INSERT INTO nodes (path, value) VALUES (?, ?)", rows)
+        self.refresh_indexes(conn, segments)
+
+    def record_outbox(self, conn, writes: list):
+        if self.outbox:
+            conn.executemany("INSERT INTO outbox (path, value) VALUES (?, ?)",
+                             [("/".join(segments), json.dumps(value)) for segments, value in writes])
+
+    def write(self, writes: list):
+        """Applies [(segments, value)] atomically, then notifies listeners."""
+        conn = self.connection()
+        with self.write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for segments, value in writes:
+                    self.write_node(conn, segments, value)
+                self.record_outbox(conn, writes)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self.notify(writes)
+
+    def transaction(self, segments: list, update_fn):
+        conn = self.connection()
+        with self.write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                new_value = update_fn(self.read(conn, segments))
+                self.write_node(conn, segments, new_value)
+                self.record_outbox(conn, [(segments, new_value)])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self.notify([(segments, new_value)])
+        return new_value
+
+    # --- outbox (hybrid mode) ---
+    def outbox_peek(self, limit: int) -> list:
+        """Oldest pending writes as [(seq, path, value)]."""
+        rows = self.connection().execute("SELECT seq, path, value FROM outbox ORDER BY seq LIMIT ?", (limit,)).fetchall()
+        return [(seq, path, json.loads(value)) for seq, path, value in rows]
+
+    def outbox_ack(self, seq: int):
+        with self.write_lock:
+            self.connection().execute("DELETE FROM outbox WHERE seq <= ?", (seq,))
+
+    def outbox_size(self) -> int:
+        return self.connection().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def meta_get(self, key: str):
+        row = self.connection().execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def meta_set(self, key: str, value):
+        with self.write_lock:
+            self.connection().execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def load(self, segments: list, value, after_seq: int = 0):
+        """Replaces a node with data pulled from upstream, then re-applies the outbox writes newer than after_seq."""
+        conn = self.connection()
+        with self.write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.write_node(conn, segments, value)
+                pending_rows = conn.execute("SELECT path, value FROM outbox WHERE seq > ? ORDER BY seq", (after_seq,)).fetchall()
+                for path, pending in pending_rows:
+                    pending_segments = split_path(path)
+                    if pending_segments[:len(segments)] == segments or segments[:len(pending_segments)] == pending_segments:
+                        self.write_node(conn, pending_segments, json.loads(pending))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self.notify([(segments, self.get(segments))])
+
+    # --- child indexes ---
+    def refresh_indexes(self, conn, segments: list):
+        for parent, children in list(self.indexes.items()):
+            p = split_path(parent)
+            if segments[:len(p)] == p and len(segments) > len(p):
+                self.index_child(conn, parent, children, segments[len(p)])
+            elif p[:len(segments)] == segments:
+                conn.execute("DELETE FROM child_index WHERE parent = ?", (parent,))
+                for key, _ in self.child_keys(conn, p):
+                    self.index_child(conn, parent, children, key)
+
+    def index_child(self, conn, parent: str, children: list, key: str):
+        conn.execute("DELETE FROM child_index WHERE parent = ? AND key = ?", (parent, key))
+        base = split_path(parent) + [key]
+        for child in children:
+            row = conn.execute("SELECT value FROM nodes WHERE path = ?", (encode(base + split_path(child)),)).fetchone()
+            if row is not None:
+                conn.execute("INSERT INTO child_index (parent, child, key, value) VALUES (?, ?, ?, ?)",
+                             (parent, child, key, json.loads(row[0])))
+
+    def ensure_index(self, conn, parent: str, child: str):
+        """Builds a newly declared index once from the existing data."""
+        if conn.execute("SELECT 1 FROM child_index_meta WHERE parent = ? AND child = ?", (parent, child)).fetchone():
+            return
+        with self.write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM child_index WHERE parent = ?", (parent,))
+                for key, _ in self.child_keys(conn, split_path(parent)):
+                    self.index_child(conn, parent, self.indexes[parent], key)
+                conn.executemany("INSERT OR IGNORE INTO child_index_meta (parent, child) VALUES (?, ?)",
+                                 [(parent, c) for c in self.indexes[parent]])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    # --- queries ---
+    def query(self, segments: list, order_by: str, equal_to=None, start_at=None, end_at=None,
+              limit_to_first=None, limit_to_last=None) -> OrderedDict:
+        conn = self.connection()
+        if equal_to is not None:
+            start_at = end_at = equal_to
+        if order_by != "$key":
+            parent = "/".join(segments)
+            if order_by not in self.indexes.get(parent, []):
+                raise IndexNotDefinedError(f'Index not defined, add ".indexOn": "{order_by}", for path "/{parent}"')
+            self.ensure_index(conn, parent, order_by)
+        conn.execute("BEGIN")
+        try:
+            if order_by == "$key":
+                keys = [k for k, _ in self.child_keys(conn, segments, start_at, end_at,
+                                                      reverse=limit_to_last is not None,
+                                                      limit=limit_to_last if limit_to_last is not None else limit_to_first)]
+            else:
+                sql, args = "SELECT key FROM child_index WHERE parent = ? AND child = ?", [parent, order_by]
+                if start_at is not None:
+                    sql += " AND value >= ?"
+                    args.append(start_at)
+                if end_at is not None:
+                    sql += " AND value <= ?"
+                    args.append(end_at)
+                if limit_to_last is not None:
+                    sql += " ORDER BY value DESC, key DESC LIMIT ?"
+                    args.append(limit_to_last)
+                else:
+                    sql += " ORDER BY value, key"
+                    if limit_to_first is not None:
+                        sql += " LIMIT ?"
+                        args.append(limit_to_first)
+                keys = [row[0] for row in conn.execute(sql, args)]
+            if limit_to_last is not None:
+                keys.reverse()
+            return OrderedDict((k, self.read(conn, segments + [k])) for k in keys)
+        finally:
+            conn.execute("COMMIT")
+
+    # --- listeners ---
+    def listen(self, segments: list, callback) -> ListenerRegistration:
+        entry = (segments, callback)
+        with self.listeners_lock:
+            self.listeners.append(entry)
+        callback(LocalEvent("put", "/", self.get(segments)))
+        return ListenerRegistration(self, entry)
+
+    def notify(self, writes: list):
+        with self.listeners_lock:
+            listeners = list(self.listeners)
+        for segments, callback in listeners:
+            for path, value in writes:
+                if path[:len(segments)] == segments:
+                    event = LocalEvent("put", "/" + "/".join(path[len(segments):]), value)
+                elif segments[:len(path)] == path:
+                    event = LocalEvent("put", "/", sub_value(value, segments[len(path):]))
+                else:
+                    continue
+                try:
+                    callback(event)
+                except Exception as e:
+                    print(f"Local store listener on /{'/'.join(segments)} failed: {e}")
+
+
+class LocalQuery:
+    def __init__(self, ref: "LocalReference", order_by: str):
+        self.ref = ref
+        self.params = {"order_by": order_by}
+
+    def equal_to(self, value):
+        self.params["equal_to"] = value
+        return self
+
+    def start_at(self, value):
+        self.params["start_at"] = value
+        return self
+
+    def end_at(self, value):
+        self.params["end_at"] = value
+        return self
+
+    def limit_to_first(self, limit: int):
+        self.params["limit_to_first"] = limit
+        return self
+
+    def limit_to_last(self, limit: int):
+        self.params["limit_to_last"] = limit
+        return self
+
+    def get(self):
+        return self.ref.store.query(self.ref.segments, **self.params)
+
+
+class LocalReference:
+    def __init__(self, store: LocalStore, segments: list):
+        self.store = store
+        self.segments = segments
+        self.key = segments[-1] if segments else None
+        self.path = "/" + "/".join(segments)
+
+    def child(self, path: str) -> "LocalReference":
+        return LocalReference(self.store, self.segments + split_path(path))
+
+    def get(self, etag=False, shallow=False):
+        return self.store.get(self.segments, shallow)
+
+    def set(self, value):
+        self.store.write([(self.segments, value)])
+
+    def update(self, value: dict):
+        if not value:
+            raise ValueError("Dictionary must not be empty")
+        self.store.write([(self.segments + split_path(k), v) for k, v in value.items()])
+
+    def push(self, value=""):
+        ref = self.child(self.store.push_id())
+        ref.set(value)
+        return ref
+
+    def delete(self):
+        self.store.write([(self.segments, None)])
+
+    def transaction(self, transaction_update):
+        return self.store.transaction(self.segments, transaction_update)
+
+    def order_by_child(self, path: str) -> LocalQuery:
+        return LocalQuery(self, path)
+
+    def order_by_key(self) -> LocalQuery:
+        return LocalQuery(self, "$key")
+
+    def listen(self, callback) -> ListenerRegistration:
+        return self.store.listen(self.segments, callback)
@@ -1,25 +1,82 @@
-import firebase_admin
-from firebase_admin import credentials, auth, db
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Header, Depends, Request
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, List, Dict, Any
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from typing import Optional, List, Dict, Any, Literal
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
+from types import SimpleNamespace
+import asyncio
+import base64
+import contextvars
+import csv
+import hashlib
+import hmac
+import importlib.util
+import io
+import itertools
+import json
+import random
+import urllib.parse
+import os
+import threading
 import time
-import httpx
 import math
+import multiprocessing
+import numpy as np
 from datetime import datetime, timedelta, timezone
+from local_store import LocalStore
+from series_store import BatchSeries, align
+from growth_fit import fit_growth_model
 
 # ---------------------------------------------------------
 # 1. SETUP & INITIALIZATION
 # ---------------------------------------------------------
-cred = credentials.Certificate("serviceAccountKey.json")
+# firebase_admin (and the google client libraries behind it) is imported and
+# initialised on first use, or by the warm-up task started at startup (see 13).
+# Importing this module therefore needs neither the credentials file nor a
+# network round-trip, and the server starts accepting requests immediately.
+FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS", "serviceAccountKey.json")
+FIREBASE_DATABASE_URL = os.getenv("FIREBASE_DATABASE_URL", "https://final-future-d1547-default-rtdb.firebaseio.com/")
+
+firebase_lock = threading.Lock()
+firebase = None  # SimpleNamespace(auth=..., db=...) once initialised
+
+def get_firebase() -> SimpleNamespace:
+    """Imports and initialises firebase_admin once (thread-safe); call it from the DB thread pool."""
+    global firebase
+    if firebase is None:
+        with firebase_lock:
+            if firebase is None:
+                import firebase_admin
+                from firebase_admin import credentials, auth, db
+                if not firebase_admin._apps:
+                    firebase_admin.initialize_app(credentials.Certificate(FIREBASE_CREDENTIALS), {
+                        'databaseURL': FIREBASE_DATABASE_URL
+                    })
+                firebase = SimpleNamespace(auth=auth, db=db, app=firebase_admin.get_app())
+    return firebase
 
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(cred, {
-        'databaseURL': 'https://final-future-d1547-default-rtdb.firebaseio.com/' 
-    })
+# JSON encoding: orjson when installed (several times faster than json.dumps
+# on the big batch/record lists), the stdlib otherwise. Handlers that return
+# a FastJSONResponse themselves (see etag_json) also skip jsonable_encoder.
+ORJSON_AVAILABLE = importlib.util.find_spec("orjson") is not None
+if ORJSON_AVAILABLE:
+    import orjson
+
+def dump_json(value, default=str) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(value, separators=(",", ":"), default=default).encode("utf-8")
 
-app = FastAPI()
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dump_json(content, default=jsonable_encoder)
+
+app = FastAPI(default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,6 +86,567 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large JSON bodies (list endpoints, exports); brotli when brotli-asgi is installed
+if importlib.util.find_spec("brotli_asgi") is not None:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=1024)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# ---------------------------------------------------------
+# 1.1 NON-BLOCKING DATABASE ACCESS
+# ---------------------------------------------------------
+# firebase_admin.db is synchronous (one HTTP round-trip per call), so every
+# call runs on a bounded thread pool instead of the uvicorn event loop.
+#
+# STORAGE_BACKEND=sqlite keeps the same paths in a local SQLite file instead
+# (see local_store.py); every helper below goes through db_ref(), so the
+# endpoints don't know which backend they run on. Auth stays on Firebase.
+# STORAGE_BACKEND=hybrid serves everything from SQLite and replays the writes
+# to Firebase in the background (see 1.2).
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firebase")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "cnalon.sqlite3")
+local_store = None  # created in 1.4 once the indexes are declared
+
+def db_ref(path: str):
+    return local_store.reference(path) if local_store is not None else get_firebase().db.reference(path)
+
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "16"))
+db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="rtdb")
+
+db_metrics_lock = threading.Lock()
+db_metrics = {
+    "queued": 0,          # submitted, waiting for a free worker
+    "in_flight": 0,       # currently running on a worker
+    "max_queue_depth": 0,
+    "ops": {}             # op name -> count / errors / total_ms / max_ms
+}
+
+def record_db_call(op: str, elapsed_ms: float, ok: bool):
+    with db_metrics_lock:
+        stats = db_metrics["ops"].setdefault(op, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        if not ok:
+            stats["errors"] += 1
+
+async def run_db(op: str, fn, *args, **kwargs):
+    """Runs a blocking Firebase call on the DB thread pool and records its latency."""
+    with db_metrics_lock:
+        db_metrics["queued"] += 1
+        db_metrics["max_queue_depth"] = max(db_metrics["max_queue_depth"], db_metrics["queued"])
+
+    def task():
+        with db_metrics_lock:
+            db_metrics["queued"] -= 1
+            db_metrics["in_flight"] += 1
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            with db_metrics_lock:
+                db_metrics["in_flight"] -= 1
+            record_db_call(op, (time.perf_counter() - start) * 1000, ok)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, task)
+
+# Reads/writes/bytes of the current request, for the metrics middleware (13).
+# Payload sizes are the compact JSON size, measured on the worker thread. The
+# SDK hands back parsed values, so measuring means encoding them again: only
+# one call in PAYLOAD_SIZE_SAMPLE_EVERY is measured, and counted that many
+# times, which keeps the totals right on average (1 measures every call).
+request_db_stats = contextvars.ContextVar("request_db_stats", default=None)
+db_bytes = {"read": 0, "written": 0}
+PAYLOAD_SIZE_SAMPLE_EVERY = max(1, int(os.getenv("PAYLOAD_SIZE_SAMPLE_EVERY", "20")))
+payload_calls = itertools.count()
+
+def payload_size(value) -> int:
+    if value is None or next(payload_calls) % PAYLOAD_SIZE_SAMPLE_EVERY:
+        return 0
+    try:
+        return len(dump_json(value)) * PAYLOAD_SIZE_SAMPLE_EVERY
+    except (TypeError, ValueError):
+        return 0
+
+def with_size(value) -> tuple:
+    return value, payload_size(value)
+
+def track_db_call(path: str, read_bytes: int = 0, written_bytes: int = 0, write: bool = False):
+    with db_metrics_lock:
+        db_bytes["read"] += read_bytes
+        db_bytes["written"] += written_bytes
+    stats = request_db_stats.get()
+    if stats is None:
+        return
+    stats["writes" if write else "reads"] += 1
+    stats["bytes_read"] += read_bytes
+    stats["bytes_written"] += written_bytes
+    path = "/" + path.strip("/")
+    stats["paths"][path] = stats["paths"].get(path, 0) + 1
+
+# --- Conditional GETs ---
+# List endpoints answer "If-None-Match" from a hash of the encoded body, so a
+# 304 is only ever sent for bytes the client already has, whoever wrote the
+# data (the dashboard writes daily logs and user status straight to Firebase,
+# and other workers have their own memory). The read still happens; the
+# saving is the transfer and the client's re-render.
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    tags = [t.strip() for t in request.headers.get("if-none-match", "").split(",")]
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+def etag_json(request: Request, content) -> Response:
+    """Encodes content once and tags it with the body's hash; 304 when the client's copy matches."""
+    body = dump_json(content, default=jsonable_encoder)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    return not_modified(request, etag) or Response(
+        content=body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+async def db_get(path: str, shallow: bool = False):
+    """Reads a node. shallow=True returns only its child keys (values become True)."""
+    value, size = await run_db("get_shallow" if shallow else "get", lambda: with_size(db_ref(path).get(shallow=shallow)))
+    track_db_call(path, read_bytes=size)
+    return value
+
+async def db_set(path: str, value):
+    size = await run_db("set", lambda: (db_ref(path).set(value), payload_size(value))[1])
+    track_db_call(path, written_bytes=size, write=True)
+
+async def db_update(path: str, value: dict):
+    size = await run_db("update", lambda: (db_ref(path).update(value), payload_size(value))[1])
+    if path.strip("/"):
+        track_db_call(path, written_bytes=size, write=True)
+    else:
+        # Multi-path update: log the top-level nodes it touched
+        track_db_call(",".join(sorted({k.strip("/").split("/")[0] for k in value})), written_bytes=size, write=True)
+
+async def db_push(path: str, value) -> str:
+    """Pushes a new child under path and returns its generated key."""
+    key, size = await run_db("push", lambda: (db_ref(path).push(value).key, payload_size(value)))
+    track_db_call(path, written_bytes=size, write=True)
+    return key
+
+async def db_delete(path: str):
+    await run_db("delete", lambda: db_ref(path).delete())
+    track_db_call(path, write=True)
+
+async def db_transaction(path: str, update_fn):
+    """Atomic read-modify-write of one node; update_fn may be retried on contention."""
+    value, size = await run_db("transaction", lambda: with_size(db_ref(path).transaction(update_fn)))
+    track_db_call(path, read_bytes=size, written_bytes=size, write=True)
+    return value
+
+def get_db_metrics():
+    with db_metrics_lock:
+        ops = {
+            op: {**stats, "avg_ms": round(stats["total_ms"] / stats["count"], 2) if stats["count"] else 0}
+            for op, stats in db_metrics["ops"].items()
+        }
+        return {
+            "workers": DB_MAX_WORKERS,
+            "queued": db_metrics["queued"],
+            "in_flight": db_metrics["in_flight"],
+            "max_queue_depth": db_metrics["max_queue_depth"],
+            "bytes": dict(db_bytes),
+            "ops": ops
+        }
+
+@app.on_event("shutdown")
+def shutdown_db_executor():
+    db_executor.shutdown(wait=False)
+
+async def db_query(path: str, order_by: str, equal_to=None, start_at=None, end_at=None,
+                   limit_to_first: Optional[int] = None, limit_to_last: Optional[int] = None) -> dict:
+    """Runs an ordered query ('$key' orders by key). Falls back to a filtered full read if the index is missing."""
+    def query():
+        ref = db_ref(path)
+        q = ref.order_by_key() if order_by == '$key' else ref.order_by_child(order_by)
+        if equal_to is not None: q = q.equal_to(equal_to)
+        if start_at is not None: q = q.start_at(start_at)
+        if end_at is not None: q = q.end_at(end_at)
+        if limit_to_first is not None: q = q.limit_to_first(limit_to_first)
+        if limit_to_last is not None: q = q.limit_to_last(limit_to_last)
+        return with_size(q.get())
+    try:
+        value, size = await run_db("query", query)
+        track_db_call(f"{path}?orderBy={order_by}", read_bytes=size)
+        return dict(value or {})
+    except Exception as e:
+        print(f"Query on {path} by {order_by} failed ({e}), falling back to full read")
+    items = []
+    for key, val in ((await db_get(path)) or {}).items():
+        v = key if order_by == '$key' else val.get(order_by) if isinstance(val, dict) else None
+        if equal_to is not None and v != equal_to: continue
+        if start_at is not None and (v is None or v < start_at): continue
+        if end_at is not None and (v is None or v > end_at): continue
+        items.append((key, val))
+    if order_by == '$key':
+        items.sort(key=lambda kv: kv[0])
+    else:
+        items.sort(key=lambda kv: (kv[1].get(order_by) is None, str(kv[1].get(order_by))))
+    if limit_to_first is not None: items = items[:limit_to_first]
+    if limit_to_last is not None: items = items[-limit_to_last:]
+    return dict(items)
+
+async def db_get_fields(path: str, fields: list) -> dict:
+    """Field-level projection: reads only the listed children of a node, concurrently."""
+    values = await asyncio.gather(*(db_get(f"{path}/{f}") for f in fields))
+    return {f: v for f, v in zip(fields, values) if v is not None}
+
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+def generate_push_id() -> str:
+    """Client-side Firebase push ID (time ordered), so new children can join a multi-path update."""
+    now = int(time.time() * 1000)
+    time_chars = []
+    for _ in range(8):
+        time_chars.append(PUSH_CHARS[now % 64])
+        now //= 64
+    return "".join(reversed(time_chars)) + "".join(random.choice(PUSH_CHARS) for _ in range(12))
+
+# ---------------------------------------------------------
+# 1.2 WRITE-BEHIND SYNC (HYBRID STORAGE)
+# ---------------------------------------------------------
+# In hybrid mode an endpoint's write commits to SQLite (plus an outbox row in
+# the same transaction) and returns at local-disk latency. sync_worker() then
+# replays the outbox to Firebase: pending writes are coalesced per path into one
+# multi-path update, acknowledged only after Firebase accepted them, and retried
+# with exponential backoff while the connection is down, so an outage loses
+# nothing (the outbox survives restarts).
+#
+# Conflicts: records are created under push IDs, so replaying a create is
+# idempotent. If Firebase already holds a record under the same push ID with a
+# different timestamp, someone else wrote it since; the newer timestamp wins and
+# the losing side is overwritten (the remote copy is pulled into SQLite).
+#
+# Pull: once seeded, a Firebase listener on each of SYNC_PULL_PATHS applies
+# remote put/patch events to SQLite, with the still-pending outbox writes
+# re-applied on top, so changes made by the dashboard or another worker show up
+# locally. Firebase opens every stream (and every reconnect) with a full put of
+# the path, which also catches up on whatever changed while disconnected.
+SYNC_BATCH_ROWS = 500
+SYNC_IDLE_SECONDS = 1.0
+SYNC_BACKOFF_MAX_SECONDS = 300
+SYNC_PULL_PATHS = [p.strip().strip("/") for p in os.getenv("SYNC_PULL_PATHS", "/").split(",")]
+
+sync_task = None
+sync_listeners = []
+sync_stats = {"synced_writes": 0, "batches": 0, "failures": 0, "consecutive_failures": 0,
+              "conflicts": 0, "pulled_events": 0, "last_sync": None, "last_error": None, "seeded": False}
+
+def as_node(value) -> dict:
+    """A node's children as a dict; Firebase stores arrays as objects keyed by index."""
+    if isinstance(value, list):
+        return {str(i): v for i, v in enumerate(value) if v is not None}
+    return value if isinstance(value, dict) else {}
+
+def set_nested(target: dict, segments: list, value):
+    for seg in segments[:-1]:
+        target[seg] = as_node(target.get(seg))
+        target = target[seg]
+    if value is None:
+        target.pop(segments[-1], None)
+    else:
+        target[segments[-1]] = value
+
+def coalesce_outbox(rows: list) -> dict:
+    """Folds [(seq, path, value)] into one Firebase multi-path update (no path may contain another)."""
+    paths = {}
+    for _, path, value in rows:
+        segments = path.split("/") if path else []
+        ancestor = next((p for p in paths if p == "" or path == p or path.startswith(p + "/")), None)
+        if ancestor is not None and ancestor != path:
+            base = as_node(paths[ancestor])
+            set_nested(base, segments[len(ancestor.split("/")) if ancestor else 0:], value)
+            paths[ancestor] = base or None
+            continue
+        for p in [p for p in paths if path == "" or p.startswith(path + "/")]:
+            del paths[p]
+        paths[path] = value
+    return paths
+
+def is_push_id(key: str) -> bool:
+    return len(key) == 20 and all(c in PUSH_CHARS for c in key)
+
+async def resolve_sync_conflicts(paths: dict, last_seq: int):
+    """Checks records created under push IDs against Firebase; drops the writes that lost."""
+    candidates = [p for p, v in paths.items()
+                  if isinstance(v, dict) and "timestamp" in v and is_push_id(p.rsplit("/", 1)[-1])]
+    remote = await asyncio.gather(*(run_db("sync.check", lambda p=p: get_firebase().db.reference(f"{p}/timestamp").get())
+                                    for p in candidates))
+    for path, remote_ts in zip(candidates, remote):
+        local_ts = paths[path]["timestamp"]
+        if remote_ts is None or remote_ts == local_ts:
+            continue
+        sync_stats["conflicts"] += 1
+        if remote_ts > local_ts:
+            del paths[path]
+            remote_value = await run_db("sync.pull", lambda: get_firebase().db.reference(path).get())
+            await run_db("local.load", local_store.load, path.split("/"), remote_value, last_seq)
+            print(f"Sync conflict on {path}: kept the newer Firebase copy")
+        else:
+            print(f"Sync conflict on {path}: overwrote the older Firebase copy")
+
+async def flush_outbox() -> int:
+    rows = await run_db("outbox.peek", local_store.outbox_peek, SYNC_BATCH_ROWS)
+    if not rows:
+        return 0
+    paths = coalesce_outbox(rows)
+    await resolve_sync_conflicts(paths, rows[-1][0])
+    if "" in paths:
+        await run_db("sync.set", lambda: get_firebase().db.reference('/').set(paths.pop("")))
+    if paths:
+        await run_db("sync.update", lambda: get_firebase().db.reference('/').update(paths))
+    await run_db("outbox.ack", local_store.outbox_ack, rows[-1][0])
+    sync_stats["synced_writes"] += len(rows)
+    sync_stats["batches"] += 1
+    sync_stats["last_sync"] = get_ph_time()
+    return len(rows)
+
+async def seed_local_store():
+    """First start in hybrid mode: pull the Firebase tree once (pending local writes are re-applied on top)."""
+    if not await run_db("local.meta", local_store.meta_get, "seeded"):
+        tree = await run_db("sync.seed", lambda: get_firebase().db.reference('/').get())
+        await run_db("local.load", local_store.load, [], tree)
+        await run_db("local.meta", local_store.meta_set, "seeded", get_ph_time())
+        print("Hybrid storage: local store seeded from Firebase")
+    sync_stats["seeded"] = True
+
+def apply_remote_event(root: list, event):
+    """Firebase listener callback (listener thread): mirrors one remote change into SQLite."""
+    segments = root + [p for p in event.path.strip("/").split("/") if p]
+    try:
+        if event.event_type == "patch":
+            for child, value in (event.data or {}).items():
+                local_store.load(segments + [p for p in child.strip("/").split("/") if p], value)
+        else:
+            local_store.load(segments, event.data)
+        sync_stats["pulled_events"] += 1
+    except Exception as e:
+        print(f"Sync pull of /{'/'.join(segments)} failed: {e}")
+
+async def start_sync_listeners():
+    registrations = []
+    try:
+        for path in SYNC_PULL_PATHS:
+            root = [p for p in path.split("/") if p]
+            registrations.append(await run_db("sync.listen", lambda: get_firebase().db.reference(path or "/").listen(
+                lambda event, root=root: apply_remote_event(root, event))))
+    except Exception:
+        for registration in registrations:
+            registration.close()
+        raise
+    sync_listeners.extend(registrations)
+
+def storage_ready() -> bool:
+    """False while a hybrid store is still empty (startup backfills must not run against it)."""
+    return STORAGE_BACKEND != "hybrid" or sync_stats["seeded"]
+
+async def sync_worker():
+    while True:
+        try:
+            if not sync_stats["seeded"]:
+                await seed_local_store()
+            if not sync_listeners:
+                await start_sync_listeners()
+            synced = await flush_outbox()
+            sync_stats["consecutive_failures"] = 0
+            if synced < SYNC_BATCH_ROWS:
+                await asyncio.sleep(SYNC_IDLE_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            sync_stats["failures"] += 1
+            sync_stats["consecutive_failures"] += 1
+            sync_stats["last_error"] = str(e)
+            delay = min(SYNC_BACKOFF_MAX_SECONDS, 2 ** sync_stats["consecutive_failures"]) * random.uniform(0.5, 1.0)
+            print(f"Sync to Firebase failed ({e}); retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+
+def get_sync_metrics() -> dict:
+    if STORAGE_BACKEND != "hybrid":
+        return {"backend": STORAGE_BACKEND}
+    return {"backend": STORAGE_BACKEND, "pending": local_store.outbox_size(), **sync_stats}
+
+async def start_sync_worker():
+    global sync_task
+    if STORAGE_BACKEND != "hybrid":
+        return
+    try:
+        await seed_local_store()
+    except Exception as e:
+        print(f"Hybrid storage: could not seed from Firebase yet ({e}); the sync worker will retry")
+    sync_task = asyncio.create_task(sync_worker())
+
+@app.on_event("shutdown")
+async def stop_sync_worker():
+    # Whatever is still pending stays in the outbox and is replayed on the next start
+    if sync_task is not None:
+        sync_task.cancel()
+    for registration in sync_listeners:
+        registration.close()
+
+# ---------------------------------------------------------
+# 1.3 ID TOKEN VERIFICATION CACHE
+# ---------------------------------------------------------
+# The dashboard sends the same ID token on every call of a page load, so a
+# verified token is kept (keyed by its SHA-256, never the raw token) until its
+# own 'exp' claim passes. Least recently used entries are dropped past the cap.
+TOKEN_CACHE_MAX = int(os.getenv("TOKEN_CACHE_MAX", "1024"))
+
+token_cache_lock = threading.Lock()
+token_cache = OrderedDict()    # token hash -> decoded claims
+token_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "revoked": 0}
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def get_cached_token(key: str):
+    with token_cache_lock:
+        claims = token_cache.get(key)
+        if claims is None:
+            token_cache_stats["misses"] += 1
+            return None
+        if claims.get("exp", 0) <= time.time():
+            del token_cache[key]
+            token_cache_stats["evictions"] += 1
+            token_cache_stats["misses"] += 1
+            return None
+        token_cache.move_to_end(key)
+        token_cache_stats["hits"] += 1
+        return claims
+
+def put_cached_token(key: str, claims: dict):
+    with token_cache_lock:
+        token_cache[key] = claims
+        token_cache.move_to_end(key)
+        while len(token_cache) > TOKEN_CACHE_MAX:
+            token_cache.popitem(last=False)
+            token_cache_stats["evictions"] += 1
+
+def revoke_cached_token(token: str):
+    """Revocation hook: forget one token so its next use is verified again."""
+    with token_cache_lock:
+        if token_cache.pop(token_hash(token), None) is not None:
+            token_cache_stats["revoked"] += 1
+
+def revoke_cached_tokens_for_uid(uid: str):
+    """Revocation hook: forget every cached token of a user (deleted or disabled account)."""
+    with token_cache_lock:
+        for key in [k for k, claims in token_cache.items() if claims.get("uid") == uid]:
+            del token_cache[key]
+            token_cache_stats["revoked"] += 1
+
+def get_token_cache_metrics():
+    with token_cache_lock:
+        return {"size": len(token_cache), "max": TOKEN_CACHE_MAX, **token_cache_stats}
+
+async def verify_token(authorization: str = Header(None)) -> dict:
+    """Shared auth dependency: returns the decoded ID token or raises 401."""
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    token = authorization.split("Bearer ")[1]
+    key = token_hash(token)
+    claims = get_cached_token(key)
+    if claims is not None:
+        return claims
+    try:
+        claims = await run_db("auth.verify_id_token", lambda: get_firebase().auth.verify_id_token(token))
+    except Exception as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    put_cached_token(key, claims)
+    return claims
+
+def preload_token_certs():
+    """Fetches Google's token signing certificates once so the first login does not pay for it.
+
+    Verifies a well-formed but unsigned ID token for this project: the SDK downloads
+    (and HTTP-caches) the certificates before it rejects the unknown key id."""
+    fb = get_firebase()
+    project_id = fb.app.project_id
+    segments = [{"alg": "RS256", "kid": "preload", "typ": "JWT"},
+                {"aud": project_id, "iss": f"https://securetoken.google.com/{project_id}", "sub": "preload"}]
+    token = ".".join(base64.urlsafe_b64encode(dump_json(part)).rstrip(b"=").decode("ascii") for part in segments) + ".c2ln"
+    try:
+        fb.auth.verify_id_token(token)
+    except fb.auth.InvalidIdTokenError:
+        pass
+
+async def warm_token_certs():
+    try:
+        await run_db("auth.preload_certs", preload_token_certs)
+    except Exception as e:
+        print(f"Could not preload token certificates: {e}")
+
+# ---------------------------------------------------------
+# 1.4 BATCH INDEX (PROJECTED BATCH READS)
+# ---------------------------------------------------------
+# 'batch_index/{id}' mirrors the scalar fields of 'global_batches/{id}' so status
+# checks and batch lists never download expenses, sales or daily logs. The
+# queries below need this index declared in the database rules:
+#   "batch_index": { ".indexOn": ["status", "dateCreated"] }
+RTDB_INDEXES = {"batch_index": ["status", "dateCreated"]}
+
+if STORAGE_BACKEND in ("sqlite", "hybrid"):
+    # Maintains RTDB_INDEXES (including ones declared further down) as SQLite tables
+    local_store = LocalStore(SQLITE_PATH, RTDB_INDEXES, generate_push_id, outbox=STORAGE_BACKEND == "hybrid")
+elif STORAGE_BACKEND != "firebase":
+    raise RuntimeError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (use 'firebase', 'sqlite' or 'hybrid')")
+
+BATCH_SUMMARY_FIELDS = [
+    "batchName", "dateCreated", "expectedCompleteDate", "startingPopulation",
+    "vitaminBudget", "penCount", "averageChickWeight", "status"
+]
+
+def batch_summary(batch_data: dict) -> dict:
+    return {f: batch_data[f] for f in BATCH_SUMMARY_FIELDS if batch_data.get(f) is not None}
+
+def batch_write_paths(batch_id: str, updates: dict) -> dict:
+    """Multi-path update that writes batch fields and keeps batch_index in step."""
+    paths = {f"global_batches/{batch_id}/{k}": v for k, v in updates.items()}
+    for k, v in updates.items():
+        if k in BATCH_SUMMARY_FIELDS:
+            paths[f"batch_index/{batch_id}/{k}"] = v
+    return paths
+
+async def get_batch_index() -> dict:
+    return (await db_get('batch_index')) or {}
+
+async def get_batches_by_status(status: str) -> dict:
+    return await db_query('batch_index', 'status', equal_to=status)
+
+async def ensure_batch_index():
+    """Backfills index entries for batches created before the index existed (or outside the API)."""
+    # Index first: a batch created between the two reads then shows up as missing
+    # (and is re-projected) instead of looking like an orphaned index entry
+    indexed_ids = set(((await db_get('batch_index', shallow=True)) or {}).keys())
+    batch_ids = set(((await db_get('global_batches', shallow=True)) or {}).keys())
+    missing = batch_ids - indexed_ids
+    summaries = await asyncio.gather(*(db_get_fields(f'global_batches/{bid}', BATCH_SUMMARY_FIELDS) for bid in missing))
+    updates = {f'batch_index/{bid}': summary for bid, summary in zip(missing, summaries) if summary}
+    orphans = indexed_ids - batch_ids
+    for bid in orphans:
+        updates[f'batch_index/{bid}'] = None
+    if updates:
+        await db_update('/', updates)
+        print(f"Batch index backfilled: {len(updates) - len(orphans)} added, {len(orphans)} removed")
+
+async def warm_batch_index():
+    if not storage_ready():
+        print("Skipping batch index backfill until the local store is seeded")
+        return
+    try:
+        await ensure_batch_index()
+        await ensure_batch_meta()
+    except Exception as e:
+        print(f"Could not backfill batch index: {e}")
+
 # ---------------------------------------------------------
 # 2. UTILITY: PHILIPPINE TIME
 # ---------------------------------------------------------
@@ -81,6 +699,14 @@ class DeleteMessageSchema(BaseModel):
     targetUid: str
     messageId: str
 
+class MarkSeenSchema(BaseModel):
+    targetUid: str
+    upTo: str  # message id; everything up to and including it is marked seen
+
+class BroadcastMessageSchema(BaseModel):
+    text: str
+    recipientUids: Optional[List[str]] = None  # default: every non-admin user
+
 class SalesRecordSchema(BaseModel):
     batchId: str  
     buyerName: str
@@ -171,6 +797,20 @@ class VitaminForecastRequestSchema(BaseModel):
     batchId: str
     months: Optional[int] = 3  # Number of months to forecast
 
+class DailyLogSchema(BaseModel):
+    batchId: str
+    kind: str  # mortality_logs, feed_logs or daily_vitamin_logs (weight_logs rows use WeightLogSchema)
+    date: str
+    am: Optional[float] = None
+    pm: Optional[float] = None
+    am_amount: Optional[float] = None
+    pm_amount: Optional[float] = None
+    updatedBy: Optional[str] = "Unknown"
+    updaterName: Optional[str] = "Unknown"
+
+class BulkImportSchema(BaseModel):
+    rows: List[Dict[str, Any]]
+
 # ---------------------------------------------------------
 # 4. KNOWLEDGE BASE (FEED & VITAMIN LOGIC)
 # ---------------------------------------------------------
@@ -238,9 +878,9 @@ def get_estimated_fcr(day: int) -> float:
     if day <= 21: return 1.5
     return 1.7
 
+# --- Reference implementations (one batch, scalar). The engine below reproduces them. ---
 def generate_forecast_data(population: int):
     forecast_data = []
-    print(f"--- Recalculating Feed for Pop: {population} ---")
     for day in range(1, 31):
         f_match = next((item for item in FEED_LOGIC_TEMPLATE if day in item[0]), None)
         if f_match:
@@ -278,34 +918,171 @@ def generate_weight_forecast(start_weight: float, population: int, feed_forecast
                 })
     return weight_data
 
+# --- Vectorized forecast engine ---
+# Per-day lookup arrays are built once per (template contents, cycle length,
+# growth model): the default template is keyed by FORECAST_TEMPLATE_VERSION,
+# any other by a hash of its rows, so an edited template never reuses stale
+# tables. Index 0 is unused so arrays line up with day numbers. Cycles longer
+# than the template repeat its last stage; shorter cycles truncate it. A
+# calibrated growth model (10.6) replaces the get_estimated_fcr steps with its
+# fitted per-day FCR, repeating its last day past the fitted range.
+DEFAULT_CYCLE_DAYS = 30
+forecast_tables_cache = {}
+
+def get_forecast_tables(cycle_days: int = DEFAULT_CYCLE_DAYS, template=None, model: Optional[dict] = None) -> dict:
+    template_key = content_hash(template_rows(template)) if template else FORECAST_TEMPLATE_VERSION
+    template = template or FEED_LOGIC_TEMPLATE
+    key = (template_key, cycle_days, model["version"] if model else None)
+    if key not in forecast_tables_cache:
+        grams = np.zeros(cycle_days + 1)
+        feed_types = [None] * (cycle_days + 1)
+        last_grams, last_type, last_day = 0.0, None, 0
+        for days, grams_per_bird, feed_type in template:
+            for day in days:
+                if day <= cycle_days:
+                    grams[day] = grams_per_bird
+                    feed_types[day] = feed_type
+            if days.stop - 1 >= last_day:
+                last_grams, last_type, last_day = grams_per_bird, feed_type, days.stop - 1
+        for day in range(last_day + 1, cycle_days + 1):
+            grams[day] = last_grams
+            feed_types[day] = last_type
+        if model:
+            fitted = model["fcr"]
+            fcr = np.array([0.0] + [fitted[min(day, len(fitted)) - 1] for day in range(1, cycle_days + 1)])
+        else:
+            fcr = np.array([0.0] + [get_estimated_fcr(day) for day in range(1, cycle_days + 1)])
+        forecast_tables_cache[key] = {
+            "days": np.arange(1, cycle_days + 1),
+            "grams": grams[1:],
+            "feedTypes": feed_types[1:],
+            "fcr": fcr[1:],
+            "gain": grams[1:] / np.where(fcr[1:] > 0, fcr[1:], 1.0),
+            "weightDays": [1] + list(range(3, cycle_days + 1, 3))
+        }
+    return forecast_tables_cache[key]
+
+def forecast_batches(populations, start_weights, cycle_days: int = DEFAULT_CYCLE_DAYS, template=None,
+                     model: Optional[dict] = None) -> dict:
+    """Feed and weight curves for N batches in one call. Arrays are shaped (N, cycle_days)."""
+    tables = get_forecast_tables(cycle_days, template, model)
+    pops = np.asarray(populations, dtype=float).reshape(-1, 1)
+    starts = np.asarray(start_weights, dtype=float).reshape(-1, 1)
+    # cumsum runs left to right, so prepending the start weight keeps the
+    # additions in the same order as the scalar loop (identical floats)
+    gains = np.broadcast_to(tables["gain"], (pops.shape[0], tables["gain"].size))
+    avg_weight = np.cumsum(np.hstack([starts, gains]), axis=1)[:, 1:]
+    return {
+        "tables": tables,
+        "population": pops[:, 0],
+        "targetKilos": tables["grams"] * pops / 1000.0,
+        "avgWeight": avg_weight,
+        "flockWeightKg": avg_weight * pops / 1000.0
+    }
+
+def forecast_rows(forecast: dict, i: int):
+    """The i-th batch of a forecast_batches result as (feedForecast, weightForecast) lists."""
+    tables = forecast["tables"]
+    feed_rows = [
+        {
+            "day": int(day),
+            "feedType": tables["feedTypes"][d],
+            "targetKilos": round(float(forecast["targetKilos"][i, d]), 2),
+            "gramsPerBird": float(tables["grams"][d])
+        }
+        for d, day in enumerate(tables["days"]) if tables["feedTypes"][d]
+    ]
+    weight_rows = [
+        {
+            "day": f"Day {day}",
+            "weight": round(float(forecast["flockWeightKg"][i, day - 1]), 2),
+            "avgWeight": int(forecast["avgWeight"][i, day - 1]),
+            "fcr": float(tables["fcr"][day - 1]),
+            "unit": "kg"
+        }
+        for day in tables["weightDays"]
+    ]
+    return feed_rows, weight_rows
+
+def compute_forecast(population: int, start_weight: float = 50.0, cycle_days: int = DEFAULT_CYCLE_DAYS,
+                     model: Optional[dict] = None):
+    """Single-batch convenience wrapper: (feedForecast, weightForecast)."""
+    return forecast_rows(forecast_batches([population], [start_weight], cycle_days, model=model), 0)
+
+# --- Memoized forecasts ---
+# Results are cached per (population, start weight, template version). The
+# template version is a content hash of the feed template and FCR table, so
+# editing either invalidates every cached and stored forecast. While a
+# calibrated growth model is active its version (template version + fitted
+# FCR) takes the template version's place.
+FORECAST_CACHE_SIZE = int(os.getenv("FORECAST_CACHE_SIZE", "256"))
+
+def content_hash(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+def template_rows(template) -> list:
+    return [[d.start, d.stop, grams, feed_type] for d, grams, feed_type in template]
+
+def forecast_template_version(cycle_days: int = DEFAULT_CYCLE_DAYS) -> str:
+    template = template_rows(FEED_LOGIC_TEMPLATE)
+    fcr = [get_estimated_fcr(day) for day in range(1, cycle_days + 1)]
+    return content_hash({"template": template, "fcr": fcr, "cycle": cycle_days})
+
+FORECAST_TEMPLATE_VERSION = forecast_template_version()
+
+@lru_cache(maxsize=FORECAST_CACHE_SIZE)
+def cached_forecast(population: int, start_weight: float, template_version: str):
+    """(feedForecast, weightForecast, feedForecastHash). Callers must not mutate the lists."""
+    model = active_growth_model()
+    feed_rows, weight_rows = compute_forecast(population, start_weight,
+                                              model=model if model and model["version"] == template_version else None)
+    return feed_rows, weight_rows, content_hash({"version": template_version, "feed": feed_rows})
+
+def get_forecast(population: int, start_weight: float = 50.0):
+    model = active_growth_model()
+    return cached_forecast(int(population), float(start_weight), model["version"] if model else FORECAST_TEMPLATE_VERSION)
+
 # REMOVED: generate_vitamin_forecast function that used hardcoded schedule
 # Now vitamin forecasts will only come from actual expense data
 
+def batch_vitamin_usage(batch: dict) -> dict:
+    """Vitamin usage summary of one batch: {date, population, vitamins: {name: amount}}"""
+    batch_vitamins = {}
+    
+    # Get vitamin expenses
+    if batch.get('expenses'):
+        for exp_id, exp in batch.get('expenses').items():
+            if exp.get('category') in ['Vitamins', 'Medications']:
+                vitamin_name = exp.get('itemName', 'Others')
+                quantity = float(exp.get('quantity', 0)) * float(exp.get('purchaseCount', 1))
+                
+                if vitamin_name not in batch_vitamins:
+                    batch_vitamins[vitamin_name] = 0
+                batch_vitamins[vitamin_name] += quantity
+    
+    return {
+        "date": batch.get('dateCreated', ''),
+        "population": batch.get('startingPopulation', 1000),
+        "vitamins": batch_vitamins
+    }
+
 def calculate_vitamin_trends(batches: list):
     """Calculate vitamin usage trends from historical batches"""
+    return calculate_vitamin_trends_from_usage([batch_vitamin_usage(b) for b in batches])
+
+def calculate_vitamin_trends_from_usage(usages: list):
+    """Calculate vitamin usage trends from per-batch usage summaries (see batch_vitamin_usage)"""
     vitamin_data = {}
     
     # Sort batches by date
-    sorted_batches = sorted(batches, key=lambda x: x.get('dateCreated', ''))
+    sorted_usages = sorted(usages, key=lambda x: x.get('date', ''))
     
-    for batch in sorted_batches:
-        batch_date = batch.get('dateCreated', '')
-        batch_pop = batch.get('startingPopulation', 1000)
-        batch_vitamins = {}
-        
-        # Get vitamin expenses
-        if batch.get('expenses'):
-            for exp_id, exp in batch.get('expenses').items():
-                if exp.get('category') in ['Vitamins', 'Medications']:
-                    vitamin_name = exp.get('itemName', 'Others')
-                    quantity = float(exp.get('quantity', 0)) * float(exp.get('purchaseCount', 1))
-                    
-                    if vitamin_name not in batch_vitamins:
-                        batch_vitamins[vitamin_name] = 0
-                    batch_vitamins[vitamin_name] += quantity
+    for usage in sorted_usages:
+        batch_date = usage.get('date', '')
+        batch_pop = usage.get('population') or 1000
         
         # Calculate per-bird rates
-        for vit_name, amount in batch_vitamins.items():
+        for vit_name, amount in (usage.get('vitamins') or {}).items():
             if vit_name not in vitamin_data:
                 vitamin_data[vit_name] = []
             
@@ -342,60 +1119,237 @@ def calculate_vitamin_trends(batches: list):
     
     return trends
 
-# --- HELPER 1: DEACTIVATE OTHERS ---
-def deactivate_other_active_batches(current_batch_id=None):
-    """If we make a batch active, turn off all others."""
-    try:
-        ref = db.reference('global_batches')
-        snapshot = ref.get()
-        if snapshot:
-            for bid, bdata in snapshot.items():
-                if bdata.get('status') == 'active' and bid != current_batch_id:
-                    ref.child(bid).update({"status": "inactive"})
-                    print(f"Deactivated batch: {bid}")
-    except Exception as e:
-        print(f"Error deactivating batches: {e}")
-
-# --- HELPER 2: AUTO-ACTIVATE NEXT INACTIVE BATCH ---
-def activate_next_inactive_batch():
-    """Finds the oldest 'inactive' batch and turns it 'active'."""
-    try:
-        ref = db.reference('global_batches')
-        snapshot = ref.get()
-        if snapshot:
-            # Filter for inactive batches
-            inactive_batches = [
-                (bid, bdata) for bid, bdata in snapshot.items()
-                if bdata.get('status') == 'inactive'
-            ]
-            
-            # Sort by dateCreated (oldest first)
-            inactive_batches.sort(key=lambda x: x[1].get('dateCreated', '9999-99-99'))
-            
-            if inactive_batches:
-                next_id = inactive_batches[0][0]
-                next_name = inactive_batches[0][1].get('batchName')
-                ref.child(next_id).update({"status": "active"})
-                print(f"Auto-Activated next batch: {next_name}")
-                return True
-    except Exception as e:
-        print(f"Error auto-activating next batch: {e}")
-    return False
+HOLT_ALPHA = 0.5
+HOLT_BETA = 0.3
+
+TrendModel = Literal["delta", "linear", "holt"]
+
+def monthly_trend(totals: list, model: TrendModel = "delta"):
+    """Returns (level, growth per month) of a monthly series for the chosen model."""
+    if model == "linear":
+        slope, intercept = np.polyfit(np.arange(len(totals)), np.asarray(totals, dtype=float), 1)
+        return float(intercept + slope * (len(totals) - 1)), float(slope)
+    if model == "holt":
+        level, trend = totals[0], totals[1] - totals[0]
+        for value in totals[1:]:
+            prev_level = level
+            level = HOLT_ALPHA * value + (1 - HOLT_ALPHA) * (level + trend)
+            trend = HOLT_BETA * (level - prev_level) + (1 - HOLT_BETA) * trend
+        return level, trend
+    if model != "delta":
+        raise ValueError(f"Unknown trend model: {model}")
+    # 'delta': average change between the first and last month (original behaviour)
+    first_total, last_total = totals[0], totals[-1]
+    growth_rate = (last_total - first_total) / len(totals) if first_total > 0 else 0
+    return last_total, growth_rate
+
+# --- HELPER: ACTIVE BATCH POINTER ---
+# 'batch_meta' holds the single source of truth for activation:
+#   {"active_batch": {"id", "dateCreated"}, "inactive_queue": {batch_id: dateCreated}}
+# Every status change goes through one transaction on this small node, followed
+# by one multi-path write of the affected batches' status fields. If that write
+# fails the pointer move is rolled back, so batch_meta never names a batch that
+# was not written. batch_transition_lock only orders transitions within this
+# process; across workers the batch_meta transaction is the only guard.
+batch_transition_lock = asyncio.Lock()
+
+def next_queued_batch(queue: dict):
+    """Oldest inactive batch by dateCreated."""
+    if not queue:
+        return None
+    return min(queue.items(), key=lambda kv: (kv[1] or '9999-99-99', kv[0]))[0]
+
+def apply_batch_transition(meta, batch_id: str, new_status, date_created=None):
+    """Pure transition on batch_meta. Returns (new_meta, {batch_id: status} changes)."""
+    meta = dict(meta or {})
+    active = meta.get('active_batch')
+    queue = dict(meta.get('inactive_queue') or {})
+    was_active = bool(active) and active.get('id') == batch_id
+    was_queued = batch_id in queue
+    if date_created is None:
+        date_created = active.get('dateCreated') if was_active else queue.get(batch_id)
+    changes = {}
+
+    if new_status == 'auto':
+        new_status = 'inactive' if active and not was_active else 'active'
+
+    if new_status is None:
+        # Only the date changed; keep the queue ordering correct
+        if was_queued: queue[batch_id] = date_created
+        if was_active: active = {'id': batch_id, 'dateCreated': date_created}
+    elif new_status == 'active':
+        queue.pop(batch_id, None)
+        if active and not was_active:
+            queue[active['id']] = active.get('dateCreated')
+            changes[active['id']] = 'inactive'
+        active = {'id': batch_id, 'dateCreated': date_created}
+        changes[batch_id] = 'active'
+    elif new_status == 'inactive':
+        if was_active: active = None
+        queue[batch_id] = date_created
+        changes[batch_id] = 'inactive'
+    else:
+        # 'completed', 'deleted' or any other terminal status leaves the rotation
+        queue.pop(batch_id, None)
+        if was_active: active = None
+        if new_status != 'deleted':
+            changes[batch_id] = new_status
+        if active is None:
+            next_id = next_queued_batch(queue)
+            if next_id:
+                active = {'id': next_id, 'dateCreated': queue.pop(next_id)}
+                changes[next_id] = 'active'
+
+    meta['active_batch'] = active
+    meta['inactive_queue'] = queue
+    return meta, changes
+
+def add_status_paths(updates: dict, batch_id: str, status: str):
+    """Adds one batch's status writes to a multi-path update. RTDB rejects overlapping
+    paths, so when the update already writes the whole batch node the status goes inside it."""
+    for root in ('global_batches', 'batch_index'):
+        node = f'{root}/{batch_id}'
+        if node in updates:
+            if updates[node] is not None:
+                updates[node] = {**updates[node], "status": status}
+        else:
+            updates[f'{node}/status'] = status
+
+def stored_meta(meta) -> dict:
+    """batch_meta as the RTDB stores it (null and empty children dropped), for comparisons."""
+    return {k: v for k, v in (meta or {}).items() if v not in (None, {})}
+
+async def transition_batch(batch_id: str, new_status, date_created=None, extra_updates: Optional[dict] = None) -> dict:
+    """Moves the batch_meta pointer in a transaction, then writes the affected batches (and
+    extra_updates) in one multi-path update; the pointer is restored if that update fails."""
+    async with batch_transition_lock:
+        result = {}
+
+        def update(meta):
+            new_meta, result["changes"] = apply_batch_transition(meta, batch_id, new_status, date_created)
+            result["previous"], result["meta"] = meta, new_meta
+            return new_meta
+
+        await db_transaction('batch_meta', update)
+        changes = result["changes"]
+
+        # Batches whose rollup month / eligibility changes move their vitamin totals
+        rollup_moves = []
+        usage_refresh = []
+        for bid in set(changes) | {batch_id}:
+            old_summary = await db_get(f'batch_index/{bid}')
+            if bid == batch_id and new_status == 'deleted':
+                new_summary = None
+            else:
+                new_summary = {
+                    **(old_summary or {}),
+                    "status": changes.get(bid, (old_summary or {}).get('status')),
+                    "dateCreated": (date_created if bid == batch_id and date_created else (old_summary or {}).get('dateCreated'))
+                }
+            if 'completed' in ((old_summary or {}).get('status'), (new_summary or {}).get('status')):
+                usage_refresh.append(bid)
+            old_month, new_month = rollup_month(old_summary), rollup_month(new_summary)
+            if old_month != new_month:
+                rollup_moves.append((bid, old_month, new_month, await db_get(f'batch_aggregates/{bid}')))
+
+        updates = dict(extra_updates or {})
+        for bid, status in changes.items():
+            add_status_paths(updates, bid, status)
+        if updates:
+            try:
+                await db_update('/', updates)
+            except Exception:
+                # Only undo our own move: a later transition may already have changed the pointer
+                await db_transaction('batch_meta', lambda meta: result["previous"]
+                                     if stored_meta(meta) == stored_meta(result["meta"]) else meta)
+                raise
+        for bid, old_month, new_month, agg in rollup_moves:
+            await apply_rollup_deltas({
+                old_month: rollup_contribution(bid, agg, -1),
+                new_month: rollup_contribution(bid, agg, 1)
+            })
+        for bid in usage_refresh:
+            await refresh_vitamin_usage(bid)
+        if usage_refresh:
+            schedule_growth_refit()
+        for bid, status in changes.items():
+            if bid != batch_id and status == 'active':
+                print(f"Auto-Activated next batch: {bid}")
+            elif bid != batch_id:
+                print(f"Deactivated batch: {bid}")
+        return changes
+
+async def save_batch_updates(batch_id: str, updates: dict, new_status: Optional[str] = None):
+    """Writes batch field updates, routing status and date changes through the pointer."""
+    paths = batch_write_paths(batch_id, updates)
+    if new_status is None and "dateCreated" not in updates:
+        if paths:
+            await db_update('/', paths)
+        if "startingPopulation" in updates:
+            await refresh_vitamin_usage(batch_id)
+        return
+    date_created = updates.get("dateCreated") or await db_get(f'batch_index/{batch_id}/dateCreated')
+    await transition_batch(batch_id, new_status, date_created, paths)
+
+def build_batch_meta(index: dict, current: Optional[dict]):
+    """Initial batch_meta from batch_index, on top of whatever transitions already wrote
+    to an uninitialised pointer. Returns (meta, ids of extra active batches to demote)."""
+    current = current or {}
+    active = current.get('active_batch')
+    queue = dict(current.get('inactive_queue') or {})
+    demoted = []
+    ordered = sorted(index.items(), key=lambda kv: (kv[1].get('dateCreated') or '9999-99-99', kv[0]))
+    for bid, summary in ordered:
+        status = summary.get('status')
+        if status not in ('active', 'inactive') or bid == (active or {}).get('id') or bid in queue:
+            continue
+        if status == 'active' and active is None:
+            active = {'id': bid, 'dateCreated': summary.get('dateCreated')}
+            continue
+        queue[bid] = summary.get('dateCreated')
+        if status == 'active':
+            demoted.append(bid)
+    return {'initialized': True, 'active_batch': active, 'inactive_queue': queue}, demoted
+
+async def ensure_batch_meta():
+    """Builds batch_meta from batch_index for databases that predate the pointer."""
+    if await db_get('batch_meta/initialized'):
+        return
+    # The app already serves requests during warm-up: holding the transition lock keeps
+    # this process's transitions out, and the transaction only initialises a pointer
+    # that nobody (no other worker either) initialised in the meantime.
+    async with batch_transition_lock:
+        index = await get_batch_index()
+        result = {}
+
+        def init(current):
+            result.clear()
+            if (current or {}).get('initialized'):
+                return current
+            meta, result["demoted"] = build_batch_meta(index, current)
+            result["meta"] = meta
+            return meta
+
+        await db_transaction('batch_meta', init)
+        if not result:
+            return
+        demoted = {}
+        for bid in result["demoted"]:
+            demoted.update(batch_write_paths(bid, {"status": "inactive"}))
+        if demoted:
+            await db_update('/', demoted)
+        active = result["meta"]["active_batch"]
+        print(f"Batch pointer initialised: active={active and active['id']}, queued={len(result['meta']['inactive_queue'])}")
 
 # ---------------------------------------------------------
 # 6. API ENDPOINTS
 # ---------------------------------------------------------
 
 @app.post("/register-user")
-async def register_user(data: dict, authorization: str = Header(None)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Unauthorized")
-    token = authorization.split("Bearer ")[1]
+async def register_user(data: dict, user: dict = Depends(verify_token)):
     try:
-        decoded_token = auth.verify_id_token(token)
-        uid = decoded_token['uid']
-        user_ref = db.reference(f'users/{uid}')
-        user_ref.set({
+        uid = user['uid']
+        await db_set(f'users/{uid}', {
             "firstName": data.get("firstName"),
             "lastName": data.get("lastName"),
             "fullName": f"{data.get('firstName')} {data.get('lastName')}",
@@ -409,14 +1363,10 @@ async def register_user(data: dict, authorization: str = Header(None)):
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/verify-login")
-async def verify_login(authorization: str = Header(None)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Unauthorized")
-    token = authorization.split("Bearer ")[1]
+async def verify_login(user: dict = Depends(verify_token)):
     try:
-        decoded_token = auth.verify_id_token(token)
-        uid = decoded_token['uid']
-        user_data = db.reference(f'users/{uid}').get()
+        uid = user['uid']
+        user_data = await db_get(f'users/{uid}')
         if not user_data or user_data.get("role") != "admin":
             raise HTTPException(status_code=403, detail="Access denied")
         return {"status": "success", "user": user_data}
@@ -427,9 +1377,9 @@ async def verify_login(authorization: str = Header(None)):
 async def admin_create_user(data: UserRegisterSchema, authorization: str = Header(None)):
     try:
         email = f"{data.username}@poultry.com"
-        user_record = auth.create_user(email=email, password=data.password, display_name=data.username)
-        user_ref = db.reference(f'users/{user_record.uid}')
-        user_ref.set({
+        user_record = await run_db("auth.create_user", lambda: get_firebase().auth.create_user(
+            email=email, password=data.password, display_name=data.username))
+        await db_set(f'users/{user_record.uid}', {
             "firstName": data.firstName,
             "lastName": data.lastName,
             "fullName": f"{data.firstName} {data.lastName}",
@@ -443,55 +1393,34 @@ async def admin_create_user(data: UserRegisterSchema, authorization: str = Heade
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/get-users")
-async def get_users(authorization: str = Header(None)):
+async def get_users(request: Request, authorization: str = Header(None)):
     try:
-        ref_users = db.reference('users')
-        snapshot = ref_users.get()
+        snapshot = await db_get('users')
         users_list = []
         if snapshot:
             for uid, data in snapshot.items():
                 data['uid'] = uid
                 users_list.append(data)
-        return users_list
+        return etag_json(request, users_list)
     except Exception as e:
         return []
 
 @app.delete("/admin-delete-user/{target_uid}")
 async def admin_delete_user(target_uid: str, authorization: str = Header(None)):
     try:
-        auth.delete_user(target_uid)
-        db.reference(f'users/{target_uid}').delete()
+        await run_db("auth.delete_user", lambda: get_firebase().auth.delete_user(target_uid))
+        revoke_cached_tokens_for_uid(target_uid)
+        await db_delete(f'users/{target_uid}')
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 # --- UPDATED: CREATE BATCH (without hardcoded vitamin forecast) ---
 @app.post("/create-batch")
-async def create_batch(data: BatchSchema, authorization: str = Header(None)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Unauthorized")
-    token = authorization.split("Bearer ")[1]
+async def create_batch(data: BatchSchema, user: dict = Depends(verify_token)):
     try:
-        auth.verify_id_token(token)
-        
-        # 1. CHECK IF THERE IS ALREADY AN ACTIVE BATCH
-        ref_all = db.reference('global_batches')
-        snapshot = ref_all.get()
-        has_active_batch = False
-        if snapshot:
-            for _, val in snapshot.items():
-                if val.get('status') == 'active':
-                    has_active_batch = True
-                    break
-        
-        # 2. AUTO ASSIGN STATUS
-        final_status = "inactive" if has_active_batch else "active"
-
-        ref_batch = db.reference('global_batches')
-        new_batch_ref = ref_batch.push()
-        
         # Generate feed forecast only (no vitamin forecast)
-        feed_forecast = generate_forecast_data(data.startingPopulation)
+        feed_forecast, _, feed_hash = get_forecast(data.startingPopulation, data.averageChickWeight or 50.0)
         
         # Create batch WITHOUT vitamin forecast
         batch_data = {
@@ -502,88 +1431,87 @@ async def create_batch(data: BatchSchema, authorization: str = Header(None)):
             "vitaminBudget": data.vitaminBudget,
             "penCount": data.penCount,
             "averageChickWeight": data.averageChickWeight,
-            "status": final_status,
-            "feedForecast": feed_forecast
+            "feedForecast": feed_forecast,
+            "feedForecastHash": feed_hash
             # No vitaminForecast field
         }
         
-        new_batch_ref.set(batch_data)
+        # Status is auto-assigned by the pointer: 'active' only if no batch is active
+        batch_id = generate_push_id()
+        changes = await transition_batch(batch_id, 'auto', data.dateCreated, {
+            f'global_batches/{batch_id}': batch_data,
+            f'batch_index/{batch_id}': batch_summary(batch_data)
+        })
+        final_status = changes[batch_id]
         return {"status": "success", "message": f"Batch created as {final_status}"}
     except Exception as e:
         raise HTTPException(status_code=401, detail=str(e))
 
 @app.get("/get-batches")
-async def get_batches(authorization: str = Header(None)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Unauthorized")
-    token = authorization.split("Bearer ")[1]
+async def get_batches(request: Request, fields: Optional[str] = None, user: dict = Depends(verify_token)):
+    """Lists batches. ?fields=batchName,status returns only those fields (plus id)."""
     try:
-        auth.verify_id_token(token)
-        snapshot = db.reference('global_batches').get()
+        if fields:
+            wanted = [f.strip() for f in fields.split(",") if f.strip() and f.strip() != "id"]
+            if all(f in BATCH_SUMMARY_FIELDS for f in wanted):
+                # Served entirely from the small batch_index mirror
+                index = await get_batch_index()
+                return etag_json(request, [{"id": bid, **{f: summary.get(f) for f in wanted if f in summary}} for bid, summary in index.items()])
+            batch_ids = list(((await db_get('global_batches', shallow=True)) or {}).keys())
+            projected = await asyncio.gather(*(db_get_fields(f'global_batches/{bid}', wanted) for bid in batch_ids))
+            return etag_json(request, [{"id": bid, **vals} for bid, vals in zip(batch_ids, projected)])
+
+        snapshot = await db_get('global_batches')
         batches_list = []
         if snapshot:
             for key, val in snapshot.items():
                 val['id'] = key
                 batches_list.append(val)
-        return batches_list
+        return etag_json(request, batches_list)
     except Exception as e:
         raise HTTPException(status_code=401, detail=str(e))
 
 # --- UPDATED: UPDATE BATCH (without vitamin forecast) ---
 @app.put("/update-batch/{batch_id}")
-async def update_batch(batch_id: str, data: BatchUpdateSchema, authorization: str = Header(None)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Unauthorized")
-    token = authorization.split("Bearer ")[1]
+async def update_batch(batch_id: str, data: BatchUpdateSchema, user: dict = Depends(verify_token)):
     try:
-        auth.verify_id_token(token)
-        
-        # 1. If manually setting to 'active', pause others
-        if data.status == "active":
-            deactivate_other_active_batches(current_batch_id=batch_id)
-
-        ref_batch = db.reference(f'global_batches/{batch_id}')
-        
         updates = {}
         if data.batchName is not None: updates["batchName"] = data.batchName
         if data.dateCreated is not None: updates["dateCreated"] = data.dateCreated
         if data.expectedCompleteDate is not None: updates["expectedCompleteDate"] = data.expectedCompleteDate
-        if data.status is not None: updates["status"] = data.status
         if data.penCount is not None: updates["penCount"] = data.penCount
         if data.averageChickWeight is not None: updates["averageChickWeight"] = data.averageChickWeight
 
         if data.startingPopulation is not None:
             updates["startingPopulation"] = data.startingPopulation
             # Regenerate feed forecast only
-            new_feed_forecast = generate_forecast_data(data.startingPopulation)
+            new_feed_forecast, _, feed_hash = get_forecast(data.startingPopulation)
             updates["feedForecast"] = new_feed_forecast
+            updates["feedForecastHash"] = feed_hash
             # Remove any existing vitamin forecast
             updates["vitaminForecast"] = None
         
-        ref_batch.update(updates)
+        # Activating pauses the current active batch; completing promotes the oldest inactive one
+        await save_batch_updates(batch_id, updates, data.status)
 
-        # 2. AUTO-ACTIVATE NEXT BATCH if this one is COMPLETED
-        if data.status == "completed":
-            activate_next_inactive_batch()
+        # Record titles carry the batch name
+        if data.batchName is not None:
+            await index_batch_records(batch_id)
 
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=401, detail=str(e))
 
 @app.put("/update-batch-settings/{batch_id}")
-async def update_batch_settings(batch_id: str, data: BatchUpdateSchema, authorization: str = Header(None)):
+async def update_batch_settings(batch_id: str, data: BatchUpdateSchema, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        
-        batch_ref = db.reference(f'global_batches/{batch_id}')
-        
         updates = {}
         if data.startingPopulation is not None:
             updates["startingPopulation"] = data.startingPopulation
             # Regenerate feed forecast only
-            new_feed_forecast = generate_forecast_data(data.startingPopulation)
+            new_feed_forecast, _, feed_hash = get_forecast(data.startingPopulation)
             updates["feedForecast"] = new_feed_forecast
+            updates["feedForecastHash"] = feed_hash
             # Remove any existing vitamin forecast
             updates["vitaminForecast"] = None
             
@@ -591,22 +1519,22 @@ async def update_batch_settings(batch_id: str, data: BatchUpdateSchema, authoriz
             updates["penCount"] = data.penCount
         if data.averageChickWeight is not None:
             updates["averageChickWeight"] = data.averageChickWeight
-        if data.status is not None:
-            updates["status"] = data.status
             
-        batch_ref.update(updates)
+        await save_batch_updates(batch_id, updates, data.status)
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/delete-batch/{batch_id}")
-async def delete_batch(batch_id: str, authorization: str = Header(None)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Unauthorized")
-    token = authorization.split("Bearer ")[1]
+async def delete_batch(batch_id: str, user: dict = Depends(verify_token)):
     try:
-        auth.verify_id_token(token)
-        db.reference(f'global_batches/{batch_id}').delete()
+        await index_batch_records(batch_id, {})
+        await transition_batch(batch_id, 'deleted', extra_updates={
+            f'global_batches/{batch_id}': None,
+            f'batch_index/{batch_id}': None,
+            f'batch_aggregates/{batch_id}': None,
+            f'batch_series/{batch_id}': None
+        })
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=401, detail=str(e))
@@ -614,30 +1542,162 @@ async def delete_batch(batch_id: str, authorization: str = Header(None)):
 # ---------------------------------------------------------
 # 7. MESSAGING
 # ---------------------------------------------------------
+# --- Presence ---
+# 'presence' mirrors users/{uid}/status and role from one listener on 'users'
+# (started by the warm-up), so sending a message no longer reads the
+# recipient's profile. Until the listener's first snapshot has arrived, the
+# lookups fall back to reading the single field.
+presence = {}  # uid -> {"status", "role"}
+presence_state = {"listener": None, "primed": False, "events": 0}
+
+def set_presence(uid: str, user):
+    if isinstance(user, dict):
+        presence[uid] = {"status": user.get("status"), "role": user.get("role")}
+    else:
+        presence.pop(uid, None)
+
+def apply_presence_event(event_type: str, path: str, data):
+    """Runs on the event loop; applies one put/patch event of the 'users' listener."""
+    presence_state["events"] += 1
+    if event_type == 'patch':
+        for key, value in (data or {}).items():
+            apply_presence_event('put', f"{path.rstrip('/')}/{key}", value)
+        return
+    segments = [p for p in path.split('/') if p]
+    if not segments:
+        presence.clear()
+        for uid, user in (data or {}).items():
+            set_presence(uid, user)
+        presence_state["primed"] = True
+    elif len(segments) == 1:
+        set_presence(segments[0], data)
+    elif len(segments) == 2 and segments[1] in ("status", "role"):
+        presence.setdefault(segments[0], {"status": None, "role": None})[segments[1]] = data
+
+async def start_presence_listener():
+    loop = asyncio.get_running_loop()
+
+    def on_event(event):
+        # Called on the listener thread
+        loop.call_soon_threadsafe(apply_presence_event, event.event_type, event.path, event.data)
+
+    try:
+        presence_state["listener"] = await run_db("listen", lambda: db_ref('users').listen(on_event))
+    except Exception as e:
+        print(f"Could not start the presence listener: {e}")
+
+@app.on_event("shutdown")
+def stop_presence_listener():
+    if presence_state["listener"] is not None:
+        presence_state["listener"].close()
+
+async def user_field(uid: str, field: str):
+    """status / role of a user, from the presence map once it is primed."""
+    if presence_state["primed"]:
+        return (presence.get(uid) or {}).get(field)
+    return await db_get(f'users/{uid}/{field}')
+
+async def require_chat_access(user: dict, target_uid: str):
+    if target_uid != user.get('uid') and await user_field(user.get('uid'), 'role') != 'admin':
+        raise HTTPException(status_code=403, detail="Not allowed to access this chat")
+
+def admin_message(text: str, status: str) -> dict:
+    return {
+        "text": text,
+        "sender": "admin",
+        "timestamp": get_ph_time(),
+        "isEdited": False,
+        "status": status,
+        "seen": False
+    }
+
 @app.post("/admin-send-message")
 async def admin_send_message(data: MessageSchema, authorization: str = Header(None)):
     try:
-        recipient_data = db.reference(f'users/{data.recipientUid}').get()
         current_status = "sent"
-        if recipient_data and recipient_data.get("status") == "online":
+        if await user_field(data.recipientUid, 'status') == "online":
             current_status = "delivered"
-        db.reference(f'chats/{data.recipientUid}').push({
-            "text": data.text,
-            "sender": "admin",
-            "timestamp": get_ph_time(),
-            "isEdited": False,
-            "status": current_status,
-            "seen": False
-        })
+        await db_push(f'chats/{data.recipientUid}', admin_message(data.text, current_status))
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+BROADCAST_MAX_RECIPIENTS = 5000
+
+@app.post("/admin-broadcast-message")
+async def admin_broadcast_message(data: BroadcastMessageSchema, user: dict = Depends(verify_token)):
+    """Sends one message to many users with a single multi-path update."""
+    if await user_field(user.get('uid'), 'role') != 'admin':
+        raise HTTPException(status_code=403, detail="Admins only")
+    try:
+        # Roles and online status for every recipient from one read (or the primed presence map)
+        users = presence if presence_state["primed"] else ((await db_get('users')) or {})
+        recipients = data.recipientUids
+        if recipients is None:
+            recipients = [uid for uid, u in users.items() if (u or {}).get('role') != 'admin']
+        recipients = list(dict.fromkeys(recipients))
+        if len(recipients) > BROADCAST_MAX_RECIPIENTS:
+            raise ValueError(f"at most {BROADCAST_MAX_RECIPIENTS} recipients per broadcast")
+        updates = {}
+        for uid in recipients:
+            status = "delivered" if (users.get(uid) or {}).get('status') == "online" else "sent"
+            updates[f'chats/{uid}/{generate_push_id()}'] = admin_message(data.text, status)
+        if updates:
+            await db_update('/', updates)
+        return {"status": "success", "recipients": len(recipients)}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# --- Chat history & read receipts ---
+# Message ids are push IDs, which sort by creation time, so pages are plain
+# key-range queries (no index needed): newest first, the cursor being the
+# oldest id of the previous page. "Seen up to X" moves a per-reader watermark
+# in 'chat_receipts/{uid}/{admin|user}' and flags only the messages between
+# the old and new watermark, all in one multi-path update.
+CHAT_PAGE_MAX = 200
+
+@app.get("/chat-history/{target_uid}")
+async def get_chat_history(target_uid: str, limit: int = 50, before: Optional[str] = None,
+                           user: dict = Depends(verify_token)):
+    """A page of messages (oldest to newest) with ?before=<nextCursor> for older ones."""
+    await require_chat_access(user, target_uid)
+    try:
+        limit = max(1, min(limit, CHAT_PAGE_MAX))
+        entries = await db_query(f'chats/{target_uid}', '$key', end_at=before, limit_to_last=limit + (2 if before else 1))
+        keys = sorted(k for k in entries if k != before)
+        page = keys[-limit:]
+        messages = sorted(({"id": k, **entries[k]} for k in page),
+                          key=lambda m: (m.get('timestamp') or 0, m['id']))
+        return {"messages": messages, "nextCursor": page[0] if len(keys) > limit else None}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/mark-chat-seen")
+async def mark_chat_seen(data: MarkSeenSchema, user: dict = Depends(verify_token)):
+    """Marks the other side's messages up to data.upTo as seen (the admin reads user messages and vice versa)."""
+    await require_chat_access(user, data.targetUid)
+    try:
+        reader = 'user' if data.targetUid == user.get('uid') else 'admin'
+        receipt_path = f'chat_receipts/{data.targetUid}/{reader}'
+        watermark = await db_get(receipt_path)
+        if watermark and watermark >= data.upTo:
+            return {"status": "success", "marked": 0}
+        entries = await db_query(f'chats/{data.targetUid}', '$key', start_at=watermark, end_at=data.upTo)
+        updates = {receipt_path: data.upTo}
+        for msg_id, msg in entries.items():
+            from_admin = (msg or {}).get('sender') == 'admin'
+            if from_admin == (reader == 'user') and not msg.get('seen'):
+                updates[f'chats/{data.targetUid}/{msg_id}/seen'] = True
+                updates[f'chats/{data.targetUid}/{msg_id}/status'] = 'seen'
+        await db_update('/', updates)
+        return {"status": "success", "marked": (len(updates) - 1) // 2}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/admin-edit-message")
 async def admin_edit_message(data: EditMessageSchema, authorization: str = Header(None)):
     try:
-        ref_msg = db.reference(f'chats/{data.targetUid}/{data.messageId}')
-        ref_msg.update({"text": data.newText, "isEdited": True})
+        await db_update(f'chats/{data.targetUid}/{data.messageId}', {"text": data.newText, "isEdited": True})
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -645,7 +1705,7 @@ async def admin_edit_message(data: EditMessageSchema, authorization: str = Heade
 @app.post("/admin-delete-message")
 async def admin_delete_message(data: DeleteMessageSchema, authorization: str = Header(None)):
     try:
-        db.reference(f'chats/{data.targetUid}/{data.messageId}').delete()
+        await db_delete(f'chats/{data.targetUid}/{data.messageId}')
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -653,26 +1713,240 @@ async def admin_delete_message(data: DeleteMessageSchema, authorization: str = H
 # ---------------------------------------------------------
 # 8. EXPENSES & SALES
 # ---------------------------------------------------------
+
+# --- Per-batch aggregates ---
+# 'batch_aggregates/{batchId}' keeps running totals that the write endpoints
+# adjust with transactional deltas, so summaries never re-read the subtrees:
+#   expenseTotal, expenseCount, purchaseTotal (amount x purchaseCount),
+#   spendByCategory/{category}, vitaminQuantity/{itemName},
+#   salesRevenue, birdsSold, salesCount
+VITAMIN_CATEGORIES = ['Vitamins', 'Medications']
+RTDB_KEY_ESCAPES = {'%': '%25', '.': '%2E', '$': '%24', '#': '%23', '[': '%5B', ']': '%5D', '/': '%2F'}
+
+def encode_db_key(name) -> str:
+    """Makes a free-text name (e.g. 'Biotin/Niacin') usable as an RTDB key."""
+    name = str(name) if name not in (None, '') else 'Others'
+    return ''.join(RTDB_KEY_ESCAPES.get(ch, ch) for ch in name)
+
+def decode_db_key(key: str) -> str:
+    return urllib.parse.unquote(key)
+
+def to_number(value, default=0.0) -> float:
+    try:
+        return float(value if value not in (None, '') else default)
+    except (TypeError, ValueError):
+        return float(default)
+
+def expense_contribution(exp: dict, sign: int = 1) -> dict:
+    """Flat 'path -> delta' contribution of one expense to the batch aggregates."""
+    if not exp:
+        return {}
+    amount = to_number(exp.get('amount'))
+    count = to_number(exp.get('purchaseCount'), 1)
+    deltas = {
+        "expenseTotal": sign * amount,
+        "expenseCount": sign,
+        "purchaseTotal": sign * amount * count,
+        f"spendByCategory/{encode_db_key(exp.get('category'))}": sign * amount
+    }
+    if exp.get('category') in VITAMIN_CATEGORIES:
+        deltas[f"vitaminQuantity/{encode_db_key(exp.get('itemName'))}"] = sign * to_number(exp.get('quantity')) * count
+    return deltas
+
+def sale_contribution(sale: dict, sign: int = 1) -> dict:
+    if not sale:
+        return {}
+    quantity = to_number(sale.get('quantity'))
+    return {
+        "salesRevenue": sign * to_number(sale.get('totalAmount'), quantity * to_number(sale.get('pricePerChicken'))),
+        "birdsSold": sign * quantity,
+        "salesCount": sign
+    }
+
+def merge_deltas(*contributions) -> dict:
+    merged = {}
+    for contribution in contributions:
+        for path, delta in contribution.items():
+            merged[path] = merged.get(path, 0) + delta
+    return merged
+
+def apply_deltas(current, deltas: dict) -> dict:
+    """Adds flat deltas into a nested aggregates dict; totals that reach zero are dropped."""
+    result = json.loads(json.dumps(current or {}))
+    for path, delta in deltas.items():
+        node = result
+        *parents, leaf = path.split('/')
+        for part in parents:
+            node = node.setdefault(part, {})
+        value = round(node.get(leaf, 0) + delta, 6)
+        if abs(value) < 1e-9:
+            node.pop(leaf, None)
+        else:
+            node[leaf] = value
+    for key in [k for k, v in result.items() if v == {}]:
+        del result[key]
+    return result
+
+async def apply_aggregate_deltas(batch_id: str, deltas: dict):
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    new_agg = await db_transaction(f'batch_aggregates/{batch_id}', lambda current: apply_deltas(current, deltas))
+    # Expense changes also flow into the monthly vitamin rollup
+    if any(k == "expenseCount" or k.startswith("vitaminQuantity/") for k in deltas):
+        summary = await db_get(f'batch_index/{batch_id}')
+        if summary and summary.get('status') == 'completed' and any(k.startswith("vitaminQuantity/") for k in deltas):
+            await refresh_vitamin_usage(batch_id, summary, new_agg)
+        month = rollup_month(summary)
+        if month:
+            old_agg = apply_deltas(new_agg, {k: -v for k, v in deltas.items()})
+            await apply_rollup_deltas({month: merge_deltas(
+                rollup_contribution(batch_id, old_agg, -1), rollup_contribution(batch_id, new_agg, 1))})
+
+# --- Completed-batch vitamin usage & trend cache ---
+# 'vitamin_usage/{batchId}' is written once a batch is completed (and again only
+# if that completed batch is edited). 'vitamin_trends' caches the trend analysis
+# over those summaries; whenever one of them changes it is reset to a fresh
+# {"version"} in the same update, and a reader only stores its result while
+# that version is still current, so a slow reader can't bring back stale trends.
+async def refresh_vitamin_usage(batch_id: str, summary=None, agg=None):
+    """Recomputes (or removes) one batch's usage summary and invalidates the trend cache."""
+    if summary is None:
+        summary = await db_get(f'batch_index/{batch_id}')
+    usage = None
+    if summary and summary.get('status') == 'completed':
+        if agg is None:
+            agg = await db_get(f'batch_aggregates/{batch_id}')
+            if agg is None:
+                agg = (await reconcile_batch_aggregates(batch_id))["aggregates"]
+        usage = {
+            "date": summary.get('dateCreated', ''),
+            "population": summary.get('startingPopulation', 1000),
+            "vitamins": (agg or {}).get("vitaminQuantity") or {}
+        }
+    await db_update('/', {f'vitamin_usage/{batch_id}': usage, 'vitamin_trends': {"version": generate_push_id()}})
+
+async def get_vitamin_trends() -> dict:
+    cached = await db_get('vitamin_trends') or {}
+    if "json" in cached:
+        return json.loads(cached["json"])
+    if not await db_get('vitamin_usage_meta/built'):
+        # First run: summarize every already-completed batch once
+        for bid in await get_batches_by_status('completed'):
+            await refresh_vitamin_usage(bid)
+        await db_set('vitamin_usage_meta', {"built": True})
+        cached = await db_get('vitamin_trends') or {}
+    # Read before the usages: an invalidation after this point changes it
+    version = cached.get("version")
+    usages = await db_get('vitamin_usage') or {}
+    trends = calculate_vitamin_trends_from_usage([
+        {**u, "vitamins": {decode_db_key(k): v for k, v in (u.get("vitamins") or {}).items()}}
+        for u in usages.values()
+    ])
+    entry = {"version": version, "json": json.dumps(trends), "computed": get_ph_time()}
+    await db_transaction('vitamin_trends',
+                         lambda current: entry if (current or {}).get("version") == version else current)
+    return trends
+
+# --- Monthly vitamin rollup ---
+# 'vitamin_monthly/{YYYY-MM}' = {"vitamins": {name: quantity}, "batches": {batchId: 1}}
+# over active/completed batches with expenses, grouped by the batch's start
+# month. Kept current from expense writes and batch status/date transitions.
+ROLLUP_STATUSES = ['completed', 'active']
+
+def rollup_month(summary) -> Optional[str]:
+    if not summary or summary.get('status') not in ROLLUP_STATUSES or not summary.get('dateCreated'):
+        return None
+    return summary['dateCreated'][:7]
+
+def rollup_contribution(batch_id: str, agg, sign: int = 1) -> dict:
+    if not agg or agg.get("expenseCount", 0) <= 0:
+        return {}
+    deltas = {f"vitamins/{k}": sign * v for k, v in (agg.get("vitaminQuantity") or {}).items()}
+    deltas[f"batches/{batch_id}"] = sign
+    return deltas
+
+async def apply_rollup_deltas(per_month: dict):
+    for month, deltas in per_month.items():
+        deltas = {k: v for k, v in (deltas or {}).items() if v}
+        if month and deltas:
+            await db_transaction(f'vitamin_monthly/{month}', lambda current, d=deltas: apply_deltas(current, d))
+
+async def rebuild_vitamin_rollup() -> int:
+    """Rebuilds vitamin_monthly from batch_index and batch_aggregates. Returns the month count."""
+    index = await get_batch_index()
+    eligible = {bid: rollup_month(summary) for bid, summary in index.items() if rollup_month(summary)}
+    aggs = await asyncio.gather(*(db_get(f'batch_aggregates/{bid}') for bid in eligible))
+    per_month = {}
+    for (bid, month), agg in zip(eligible.items(), aggs):
+        if agg is None:
+            agg = (await reconcile_batch_aggregates(bid))["aggregates"]
+        per_month[month] = merge_deltas(per_month.get(month, {}), rollup_contribution(bid, agg))
+    rollup = {month: apply_deltas({}, deltas) for month, deltas in per_month.items()}
+    await db_update('/', {'vitamin_monthly': rollup or None, 'vitamin_monthly_meta': {"built": True, "rebuilt": get_ph_time()}})
+    return len(rollup)
+
+def compute_batch_aggregates(expenses: Optional[dict], sales: Optional[dict]) -> dict:
+    contributions = [expense_contribution(e) for e in (expenses or {}).values()]
+    contributions += [sale_contribution(s) for s in (sales or {}).values()]
+    return apply_deltas({}, merge_deltas(*contributions))
+
+def aggregate_drift(stored: dict, rebuilt: dict, prefix: str = "") -> dict:
+    """Flat 'path -> {stored, actual}' for every total that differs."""
+    drift = {}
+    for key in set(stored or {}) | set(rebuilt or {}):
+        a, b = (stored or {}).get(key), (rebuilt or {}).get(key)
+        if isinstance(a, dict) or isinstance(b, dict):
+            drift.update(aggregate_drift(a if isinstance(a, dict) else {}, b if isinstance(b, dict) else {}, f"{prefix}{key}/"))
+        elif abs((a or 0) - (b or 0)) > 1e-6:
+            drift[f"{prefix}{key}"] = {"stored": a or 0, "actual": b or 0}
+    return drift
+
+async def reconcile_batch_aggregates(batch_id: str) -> dict:
+    """Rebuilds one batch's aggregates from its expenses and sales and reports any drift."""
+    expenses, sales, stored = await asyncio.gather(
+        db_get(f'global_batches/{batch_id}/expenses'),
+        db_get(f'global_batches/{batch_id}/sales'),
+        db_get(f'batch_aggregates/{batch_id}')
+    )
+    rebuilt = compute_batch_aggregates(expenses, sales)
+    drift = aggregate_drift(stored, rebuilt)
+    if drift or stored is None:
+        await db_set(f'batch_aggregates/{batch_id}', rebuilt or None)
+    return {"aggregates": rebuilt, "drift": drift}
+
+def format_batch_summary(batch_id: str, agg: dict) -> dict:
+    revenue = agg.get("salesRevenue", 0)
+    expenses = agg.get("expenseTotal", 0)
+    return {
+        "batchId": batch_id,
+        "expenseTotal": round(expenses, 2),
+        "purchaseTotal": round(agg.get("purchaseTotal", 0), 2),
+        "expenseCount": int(agg.get("expenseCount", 0)),
+        "spendByCategory": {decode_db_key(k): round(v, 2) for k, v in (agg.get("spendByCategory") or {}).items()},
+        "vitaminQuantity": {decode_db_key(k): round(v, 2) for k, v in (agg.get("vitaminQuantity") or {}).items()},
+        "salesRevenue": round(revenue, 2),
+        "birdsSold": int(agg.get("birdsSold", 0)),
+        "salesCount": int(agg.get("salesCount", 0)),
+        "netProfit": round(revenue - expenses, 2)
+    }
+
 @app.post("/add-expense")
-async def add_expense(data: ExpenseSchema, authorization: str = Header(None)):
+async def add_expense(data: ExpenseSchema, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        db.reference(f'global_batches/{data.batchId}/expenses').push({
-            **data.dict(exclude={"batchId"}),
-            "timestamp": get_ph_time()
-        })
+        expense = {**data.dict(exclude={"batchId"}), "timestamp": get_ph_time()}
+        await db_push(f'global_batches/{data.batchId}/expenses', expense)
+        await apply_aggregate_deltas(data.batchId, expense_contribution(expense))
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.put("/edit-expense")
-async def edit_expense(data: EditExpenseSchema, authorization: str = Header(None)):
+async def edit_expense(data: EditExpenseSchema, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        ref_exp = db.reference(f'global_batches/{data.batchId}/expenses/{data.expenseId}')
-        ref_exp.update({
+        expense_path = f'global_batches/{data.batchId}/expenses/{data.expenseId}'
+        old = await db_get(expense_path)
+        changes = {
             "category": data.category,
             "feedType": data.feedType,
             "itemName": data.itemName,
@@ -683,123 +1957,142 @@ async def edit_expense(data: EditExpenseSchema, authorization: str = Header(None
             "remaining": data.remaining,
             "unit": data.unit,
             "date": data.date
-        })
+        }
+        await db_update(expense_path, changes)
+        await apply_aggregate_deltas(data.batchId, merge_deltas(
+            expense_contribution(old, -1), expense_contribution({**(old or {}), **changes})))
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/delete-expense/{batch_id}/{expense_id}")
-async def delete_expense(batch_id: str, expense_id: str, authorization: str = Header(None)):
+async def delete_expense(batch_id: str, expense_id: str, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        db.reference(f'global_batches/{batch_id}/expenses/{expense_id}').delete()
+        expense_path = f'global_batches/{batch_id}/expenses/{expense_id}'
+        old = await db_get(expense_path)
+        await db_delete(expense_path)
+        await apply_aggregate_deltas(batch_id, expense_contribution(old, -1))
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/get-expenses/{batch_id}")
-async def get_expenses(batch_id: str, authorization: str = Header(None)):
+async def get_expenses(batch_id: str, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        snapshot = db.reference(f'global_batches/{batch_id}/expenses').get()
+        snapshot = await db_get(f'global_batches/{batch_id}/expenses')
         return [{"id": k, **v} for k, v in snapshot.items()] if snapshot else []
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.patch("/update-expense-category")
-async def update_expense_category(data: UpdateFeedCategorySchema, authorization: str = Header(None)):
+async def update_expense_category(data: UpdateFeedCategorySchema, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        ref_exp = db.reference(f'global_batches/{data.batchId}/expenses/{data.expenseId}')
-        ref_exp.update({"category": data.category, "feedType": data.feedType})
+        expense_path = f'global_batches/{data.batchId}/expenses/{data.expenseId}'
+        old = await db_get(expense_path)
+        changes = {"category": data.category, "feedType": data.feedType}
+        await db_update(expense_path, changes)
+        await apply_aggregate_deltas(data.batchId, merge_deltas(
+            expense_contribution(old, -1), expense_contribution({**(old or {}), **changes})))
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/add-sale")
-async def add_sale(data: SalesRecordSchema, authorization: str = Header(None)):
+async def add_sale(data: SalesRecordSchema, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        db.reference(f'global_batches/{data.batchId}/sales').push({
+        sale = {
             **data.dict(exclude={"batchId"}),
             "totalAmount": data.quantity * data.pricePerChicken,
             "timestamp": get_ph_time()
-        })
+        }
+        await db_push(f'global_batches/{data.batchId}/sales', sale)
+        await apply_aggregate_deltas(data.batchId, sale_contribution(sale))
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.put("/edit-sale")
-async def edit_sale(data: EditSalesRecordSchema, authorization: str = Header(None)):
+async def edit_sale(data: EditSalesRecordSchema, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        ref_sale = db.reference(f'global_batches/{data.batchId}/sales/{data.saleId}')
-        ref_sale.update({
+        sale_path = f'global_batches/{data.batchId}/sales/{data.saleId}'
+        old = await db_get(sale_path)
+        changes = {
             "buyerName": data.buyerName,
             "address": data.address,
             "quantity": data.quantity,
             "pricePerChicken": data.pricePerChicken,
             "totalAmount": data.quantity * data.pricePerChicken,
             "dateOfPurchase": data.dateOfPurchase
-        })
+        }
+        await db_update(sale_path, changes)
+        await apply_aggregate_deltas(data.batchId, merge_deltas(
+            sale_contribution(old, -1), sale_contribution({**(old or {}), **changes})))
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/delete-sale/{batch_id}/{sale_id}")
-async def delete_sale(batch_id: str, sale_id: str, authorization: str = Header(None)):
+async def delete_sale(batch_id: str, sale_id: str, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        db.reference(f'global_batches/{batch_id}/sales/{sale_id}').delete()
+        sale_path = f'global_batches/{batch_id}/sales/{sale_id}'
+        old = await db_get(sale_path)
+        await db_delete(sale_path)
+        await apply_aggregate_deltas(batch_id, sale_contribution(old, -1))
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/get-sales/{batch_id}")
-async def get_sales(batch_id: str, authorization: str = Header(None)):
+async def get_sales(batch_id: str, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        snapshot = db.reference(f'global_batches/{batch_id}/sales').get()
+        snapshot = await db_get(f'global_batches/{batch_id}/sales')
         return [{"id": k, **v} for k, v in snapshot.items()] if snapshot else []
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/batch-summary/{batch_id}")
+async def batch_summary_endpoint(batch_id: str, user: dict = Depends(verify_token)):
+    """Expense and sales totals of one batch from its aggregates node (one small read)."""
+    try:
+        agg = await db_get(f'batch_aggregates/{batch_id}')
+        if agg is None:
+            # Batch predates aggregates (or has no records yet): build them once
+            agg = (await reconcile_batch_aggregates(batch_id))["aggregates"]
+        return format_batch_summary(batch_id, agg)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/reconcile-aggregates")
+async def reconcile_aggregates(batch_id: Optional[str] = None, user: dict = Depends(verify_token)):
+    """Rebuilds aggregates from the raw records (one batch or all) and reports drift."""
+    try:
+        batch_ids = [batch_id] if batch_id else list(((await db_get('global_batches', shallow=True)) or {}).keys())
+        report = {}
+        for bid in batch_ids:
+            drift = (await reconcile_batch_aggregates(bid))["drift"]
+            if drift:
+                report[bid] = drift
+        if report or not batch_id:
+            await rebuild_vitamin_rollup()
+        return {"status": "success", "batches": len(batch_ids), "drifted": len(report), "drift": report}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # ---------------------------------------------------------
 # 9. FORECASTING & INVENTORY
 # ---------------------------------------------------------
 
 @app.get("/get-vitamin-forecast/{batch_id}")
-async def get_vitamin_forecast(batch_id: str, authorization: str = Header(None)):
+async def get_vitamin_forecast(batch_id: str, user: dict = Depends(verify_token)):
     """Get vitamin forecast for a specific batch based on historical data only"""
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        
-        batch_ref = db.reference(f'global_batches/{batch_id}')
-        batch_data = batch_ref.get()
+        batch_data = await db_get_fields(f'global_batches/{batch_id}', ["batchName", "startingPopulation"])
         
         if not batch_data:
             raise HTTPException(status_code=404, detail="Batch not found")
         
-        # Get historical vitamin usage from completed batches for trends
-        all_batches_ref = db.reference('global_batches')
-        all_batches = all_batches_ref.get()
-        
-        completed_batches = []
-        if all_batches:
-            for bid, bdata in all_batches.items():
-                if bdata.get('status') == 'completed':
-                    completed_batches.append(bdata)
-        
-        # Calculate trends (returns empty if no data)
-        trends = calculate_vitamin_trends(completed_batches)
+        # Trends over completed batches (cached until a completed batch changes)
+        trends = await get_vitamin_trends()
         
         # Return empty forecast if no historical data
         if not trends:
@@ -824,51 +2117,22 @@ async def get_vitamin_forecast(batch_id: str, authorization: str = Header(None))
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/get-vitamin-monthly-forecast")
-async def get_vitamin_monthly_forecast(months: int = 3, authorization: str = Header(None)):
-    """Get monthly vitamin consumption forecast based on historical trends"""
+async def get_vitamin_monthly_forecast(months: int = 3, model: TrendModel = "delta", user: dict = Depends(verify_token)):
+    """Get monthly vitamin consumption forecast based on historical trends.
+    model: 'delta' (first/last difference), 'linear' (least squares) or 'holt' (Holt smoothing)"""
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
+        # Monthly rollup only: cost does not grow with the number of batches
+        if not await db_get('vitamin_monthly_meta/built'):
+            await rebuild_vitamin_rollup()
+        rollup = await db_get('vitamin_monthly') or {}
         
-        # Get all batches
-        all_batches_ref = db.reference('global_batches')
-        all_batches = all_batches_ref.get()
-        
-        if not all_batches:
-            return {"forecast": [], "message": "No batch data available"}
-        
-        # Group batches by month
         monthly_usage = {}
-        
-        for bid, bdata in all_batches.items():
-            # Only consider completed or active batches with expenses
-            if bdata.get('status') in ['completed', 'active'] and bdata.get('expenses'):
-                date_created = bdata.get('dateCreated', '')
-                if date_created:
-                    # Extract year-month
-                    try:
-                        month_key = date_created[:7]  # YYYY-MM
-                        if month_key not in monthly_usage:
-                            monthly_usage[month_key] = {
-                                "month": month_key,
-                                "vitamins": {},
-                                "total_batches": 0
-                            }
-                        
-                        monthly_usage[month_key]["total_batches"] += 1
-                        
-                        # Aggregate vitamin usage
-                        for exp_id, exp in bdata.get('expenses').items():
-                            if exp.get('category') in ['Vitamins', 'Medications']:
-                                vit_name = exp.get('itemName', 'Others')
-                                quantity = float(exp.get('quantity', 0)) * float(exp.get('purchaseCount', 1))
-                                
-                                if vit_name not in monthly_usage[month_key]["vitamins"]:
-                                    monthly_usage[month_key]["vitamins"][vit_name] = 0
-                                
-                                monthly_usage[month_key]["vitamins"][vit_name] += quantity
-                    except:
-                        continue
+        for month_key, entry in rollup.items():
+            monthly_usage[month_key] = {
+                "month": month_key,
+                "vitamins": {decode_db_key(k): v for k, v in (entry.get("vitamins") or {}).items()},
+                "total_batches": len(entry.get("batches") or {})
+            }
         
         # If no monthly data, return empty
         if not monthly_usage:
@@ -915,12 +2179,9 @@ async def get_vitamin_monthly_forecast(months: int = 3, authorization: str = Hea
         growth_rate = 0
         
         if len(time_series) >= 2:
-            # Calculate average growth rate
-            first_total = time_series[0]["total"]
+            # Level to project from and growth per month
             last_total = time_series[-1]["total"]
-            
-            if first_total > 0:
-                growth_rate = (last_total - first_total) / len(time_series)
+            base_total, growth_rate = monthly_trend([t["total"] for t in time_series], model)
             
             # Only generate forecast if there's meaningful data
             if last_total > 0:
@@ -936,7 +2197,7 @@ async def get_vitamin_monthly_forecast(months: int = 3, authorization: str = Hea
                         next_year += 1
                     
                     next_month = f"{next_year}-{str(next_month_num).zfill(2)}"
-                    forecast_total = last_total + (growth_rate * i)
+                    forecast_total = base_total + (growth_rate * i)
                     
                     forecast.append({
                         "month": next_month,
@@ -959,15 +2220,14 @@ async def get_vitamin_monthly_forecast(months: int = 3, authorization: str = Hea
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/get-inventory-forecast/{batch_id}")
-async def get_inventory_forecast(batch_id: str, authorization: str = Header(None)):
+async def get_inventory_forecast(batch_id: str, user: dict = Depends(verify_token)):
     # Return vitamin forecast instead of empty list
-    return await get_vitamin_forecast(batch_id, authorization)
+    return await get_vitamin_forecast(batch_id, user)
 
 @app.get("/get-feed-forecast/{batch_id}")
 async def get_feed_forecast(batch_id: str, authorization: str = Header(None)):
     try:
-        batch_ref = db.reference(f'global_batches/{batch_id}')
-        batch_data = batch_ref.get()
+        batch_data = await db_get_fields(f'global_batches/{batch_id}', ["batchName", "startingPopulation", "averageChickWeight", "feedForecastHash"])
         if not batch_data: 
             raise HTTPException(status_code=404, detail="Batch not found")
         
@@ -976,14 +2236,12 @@ async def get_feed_forecast(batch_id: str, authorization: str = Header(None)):
         # UPDATED DEFAULT to 50.0
         start_weight = batch_data.get('averageChickWeight', 50.0) 
         
-        # 2. FORCE RECALCULATE (Ignore old saved data)
-        new_feed_forecast = generate_forecast_data(population)
+        # 2. FEED & WEIGHT FORECAST (memoized per population / weight / template version)
+        new_feed_forecast, new_weight_forecast, feed_hash = get_forecast(population, start_weight)
         
-        # 3. Calculate Weight Forecast
-        new_weight_forecast = generate_weight_forecast(start_weight, population, new_feed_forecast)
-        
-        # 4. OVERWRITE DATABASE WITH CORRECT DATA
-        batch_ref.child('feedForecast').set(new_feed_forecast)
+        # 3. REWRITE THE STORED FORECAST ONLY IF ITS INPUTS OR THE TEMPLATE CHANGED
+        if batch_data.get('feedForecastHash') != feed_hash:
+            await db_update(f'global_batches/{batch_id}', {"feedForecast": new_feed_forecast, "feedForecastHash": feed_hash})
         
         return {
             "batchName": batch_data.get('batchName'), 
@@ -993,116 +2251,1245 @@ async def get_feed_forecast(batch_id: str, authorization: str = Header(None)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# --- Weather: shared HTTP client + per-location TTL cache ---
+# Every open dashboard polls /get-temperature once a minute, but open-meteo only
+# refreshes its "current" values every 15 minutes. One pooled client (HTTP/2 when
+# the h2 package is installed) is reused for the app's lifetime; readings are
+# cached per (lat, lon) for WEATHER_TTL_SECONDS, then served stale while a single
+# background refresh runs. Concurrent misses share one upstream request, and
+# 'current_weather' is only rewritten when the reading actually changes.
+# WEATHER_API_URL can point at a local stub server for testing.
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None  # installed by httpx[http2]
+
+WEATHER_API_URL = os.environ.get("WEATHER_API_URL", "https://api.open-meteo.com/v1/forecast")
+WEATHER_TTL_SECONDS = 600
+WEATHER_STALE_SECONDS = 3 * 3600
+WEATHER_CACHE_MAX = 256
+WEATHER_FIELDS = ["temperature", "humidity", "weatherCode", "isDay", "unit"]
+
+http_client = None
+weather_cache = {}     # (lat, lon) -> (fetched at, payload)
+weather_inflight = {}  # (lat, lon) -> asyncio.Task
+weather_written = {"loaded": False, "payload": None}
+weather_stats = {"hits": 0, "stale": 0, "misses": 0, "upstream_calls": 0, "upstream_errors": 0, "db_writes": 0}
+
+def get_http_client():
+    global http_client
+    if http_client is None or http_client.is_closed:
+        import httpx
+        http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(5.0, connect=3.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+    return http_client
+
+@app.on_event("shutdown")
+async def close_http_client():
+    if http_client is not None:
+        await http_client.aclose()
+
+async def store_weather(payload: dict):
+    if not weather_written["loaded"]:
+        weather_written["payload"] = await db_get('current_weather')
+        weather_written["loaded"] = True
+    previous = weather_written["payload"] or {}
+    if any(previous.get(f) != payload.get(f) for f in WEATHER_FIELDS):
+        await db_set('current_weather', payload)
+        weather_written["payload"] = payload
+        weather_stats["db_writes"] += 1
+
+async def fetch_weather(key: tuple) -> dict:
+    lat, lon = key
+    weather_stats["upstream_calls"] += 1
+    response = await get_http_client().get(WEATHER_API_URL, params={
+        "latitude": lat,
+        "longitude": lon,
+        "current": "temperature_2m,relative_humidity_2m,weather_code,is_day"
+    })
+    response.raise_for_status()
+    current = response.json().get("current", {})
+    weather_payload = {
+        "temperature": current.get("temperature_2m"),
+        "humidity": current.get("relative_humidity_2m"),
+        "weatherCode": current.get("weather_code"),
+        "isDay": current.get("is_day"), 
+        "unit": "°C",
+        "last_updated": get_ph_time()
+    }
+    weather_cache.pop(key, None)
+    weather_cache[key] = (time.monotonic(), weather_payload)
+    while len(weather_cache) > WEATHER_CACHE_MAX:
+        weather_cache.pop(next(iter(weather_cache)))
+    await store_weather(weather_payload)
+    return weather_payload
+
+def weather_refresh_done(key: tuple, task: asyncio.Task):
+    weather_inflight.pop(key, None)
+    if not task.cancelled() and task.exception() is not None:
+        weather_stats["upstream_errors"] += 1
+        print(f"Weather refresh for {key} failed: {task.exception()!r}")
+
+def refresh_weather(key: tuple) -> asyncio.Task:
+    """Single-flight: every caller for the same location awaits the same upstream request."""
+    task = weather_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch_weather(key))
+        weather_inflight[key] = task
+        task.add_done_callback(lambda t: weather_refresh_done(key, t))
+    return task
+
+async def get_weather(lat: float, lon: float) -> dict:
+    key = (round(lat, 4), round(lon, 4))
+    cached = weather_cache.get(key)
+    age = time.monotonic() - cached[0] if cached else None
+    if cached and age < WEATHER_TTL_SECONDS:
+        weather_stats["hits"] += 1
+        return cached[1]
+    if cached and age < WEATHER_STALE_SECONDS:
+        weather_stats["stale"] += 1
+        refresh_weather(key)
+        return cached[1]
+    weather_stats["misses"] += 1
+    # shield: a client hanging up must not cancel the fetch other callers share
+    return await asyncio.shield(refresh_weather(key))
+
 @app.get("/get-temperature")
 async def get_temperature(lat: float = 10.6765, lon: float = 122.9509):
-    url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current=temperature_2m,relative_humidity_2m,weather_code,is_day"
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            current = response.json().get("current", {})
-            weather_payload = {
-                "temperature": current.get("temperature_2m"),
-                "humidity": current.get("relative_humidity_2m"),
-                "weatherCode": current.get("weather_code"),
-                "isDay": current.get("is_day"), 
-                "unit": "°C",
-                "last_updated": get_ph_time()
-            }
-            db.reference('current_weather').set(weather_payload)
-            return weather_payload
+    try:
+        return await get_weather(lat, lon)
     except Exception as e:
-        db_data = db.reference('current_weather').get()
+        db_data = await db_get('current_weather')
         return db_data if db_data else {"temperature": 0, "humidity": 0}
     
 # ---------------------------------------------------------
 # 10. ADMIN MASTER RECORDS
 # ---------------------------------------------------------
 
+# 'records_index/{recordId}' is the materialized master-records feed. Each entry
+# carries sortable keys ("<13-digit timestamp>_<recordId>", optionally prefixed
+# by type and/or batch) so one page is a single ordered, limited query.
+# Declared in the database rules as:
+#   "records_index": { ".indexOn": ["sortKey", "typeKey", "batchKey", "batchTypeKey"] }
+RTDB_INDEXES["records_index"] = ["sortKey", "typeKey", "batchKey", "batchTypeKey"]
+
+RECORD_INDEX_FIELDS = ["batchId", "sortKey", "typeKey", "batchKey", "batchTypeKey"]
+
+def feed_type_by_day(forecast) -> dict:
+    return {f.get('day'): f.get('feedType', 'Feed') for f in (forecast or []) if f}
+
+def day_number(start_date, date: str) -> Optional[int]:
+    try:
+        return (datetime.strptime(date, "%Y-%m-%d") - start_date).days + 1
+    except (TypeError, ValueError):
+        return None
+
+def log_day_value(kind: str, log: Optional[dict]) -> float:
+    """The day's figure of one log entry, as the records feed totals it."""
+    if not log:
+        return 0
+    if kind == 'mortality_logs':
+        return int(log.get('am') or 0) + int(log.get('pm') or 0)
+    if kind == 'feed_logs':
+        return round(float(log.get('am') or 0) + float(log.get('pm') or 0), 3)
+    if kind == 'daily_vitamin_logs':
+        doses = sum(float(v or 0) for v in (log.get('doses') or {}).values())
+        return round(float(log.get('am_amount') or 0) + float(log.get('pm_amount') or 0) + doses, 3)
+    return float(log.get('averageWeight') or 0)
+
+def build_log_record(kind: str, b_id: str, b_name: str, date: str, log: dict, start_date=None, feed_types=None) -> dict:
+    """Turns one daily log entry into a master-records row."""
+    if kind == 'mortality_logs':
+        total = int(log.get('am', 0)) + int(log.get('pm', 0))
+        record_id, rtype = f"mort-{b_id}-{date}", "Mortality"
+        subtitle = f"Mortality: {total} heads (AM: {log.get('am')}, PM: {log.get('pm')})"
+    elif kind == 'feed_logs':
+        feed_type = (feed_types or {}).get(day_number(start_date, date), "Feed")
+        record_id, rtype = f"feed-{b_id}-{date}", "Feed"
+        subtitle = f"{feed_type}: {float(log.get('am', 0)) + float(log.get('pm', 0))} kg"
+    elif kind == 'daily_vitamin_logs':
+        record_id, rtype = f"vit-{b_id}-{date}", "Vitamins"
+        subtitle = f"Supplement: {log_day_value(kind, log)} units"
+    else:
+        record_id, rtype = f"weight-{b_id}-{date}", "Weight"
+        subtitle = f"Average Weight: {log.get('averageWeight')} {log.get('unit', 'g')}"
+    return {
+        "id": record_id,
+        "type": rtype,
+        "date": date,
+        "timestamp": log.get('timestamp', 0),
+        "title": f"Batch: {b_name}",
+        "subtitle": subtitle,
+        "user": log.get('updaterName', 'System')
+    }
+
+LOG_KINDS = ['mortality_logs', 'feed_logs', 'daily_vitamin_logs', 'weight_logs']
+
+def build_batch_records(b_id: str, b_data: dict) -> list:
+    """All master-records rows of one batch (start date parsed once, feed type by dict lookup)."""
+    b_name = b_data.get('batchName', 'Unnamed Batch')
+    try:
+        start_date = datetime.strptime(b_data.get('dateCreated'), "%Y-%m-%d")
+    except (TypeError, ValueError):
+        start_date = None
+    feed_types = feed_type_by_day(b_data.get('feedForecast'))
+    records = []
+    for kind in LOG_KINDS:
+        for date, log in (b_data.get(kind) or {}).items():
+            records.append(build_log_record(kind, b_id, b_name, date, log, start_date, feed_types))
+    return records
+
+def record_index_entry(b_id: str, record: dict) -> dict:
+    sort_key = f"{int(record.get('timestamp') or 0):013d}_{record['id']}"
+    return {
+        **record,
+        "batchId": b_id,
+        "sortKey": sort_key,
+        "typeKey": f"{record['type']}|{sort_key}",
+        "batchKey": f"{b_id}|{sort_key}",
+        "batchTypeKey": f"{b_id}|{record['type']}|{sort_key}"
+    }
+
+async def get_batch_record_ids(b_id: str) -> list:
+    entries = await db_query('records_index', 'batchKey', start_at=f"{b_id}|", end_at=f"{b_id}|~")
+    return list(entries.keys())
+
+async def index_batch_records(b_id: str, b_data: Optional[dict] = None) -> int:
+    """Rebuilds the records_index entries of one batch. Returns the number of rows written."""
+    if b_data is None:
+        b_data = await db_get(f'global_batches/{b_id}')
+    records = build_batch_records(b_id, b_data) if b_data else []
+    updates = {f'records_index/{rid}': None for rid in await get_batch_record_ids(b_id)}
+    for record in records:
+        updates[f'records_index/{record["id"]}'] = record_index_entry(b_id, record)
+    if updates:
+        await db_update('/', updates)
+    return len(records)
+
+async def index_log_record(b_id: str, kind: str, date: str, log: Optional[dict]):
+    """Append-on-write hook: upserts (or removes, when log is None) one daily log's row."""
+    batch = await db_get_fields(f'global_batches/{b_id}', ['batchName', 'dateCreated'] + (['feedForecast'] if kind == 'feed_logs' else []))
+    try:
+        start_date = datetime.strptime(batch.get('dateCreated'), "%Y-%m-%d")
+    except (TypeError, ValueError):
+        start_date = None
+    record = build_log_record(kind, b_id, batch.get('batchName', 'Unnamed Batch'), date, log or {},
+                              start_date, feed_type_by_day(batch.get('feedForecast')))
+    await db_set(f'records_index/{record["id"]}', record_index_entry(b_id, record) if log else None)
+
+# Logs written straight to the RTDB (the mobile app) never pass through the
+# hook above. The reconcile worker rebuilds the active batches' rows (and their
+# batch_series, see 10.3) from their logs every RECONCILE_INTERVAL_SECONDS and writes only the rows that differ,
+# so new, edited and deleted logs all reach the feed without feed pages or
+# exports paying for the check. Older batches are covered by
+# /rebuild-records-index.
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("RECONCILE_INTERVAL_SECONDS", "60"))
+RECONCILE_FIELDS = ['batchName', 'dateCreated', 'feedForecast'] + LOG_KINDS
+
+reconcile_task = None
+
+async def reconcile_batch_records(b_id: str, b_data: Optional[dict] = None) -> int:
+    """Brings one batch's records_index rows in line with its logs. Returns the number of rows changed."""
+    if b_data is None:
+        b_data = await db_get_fields(f'global_batches/{b_id}', RECONCILE_FIELDS)
+    expected = {r["id"]: record_index_entry(b_id, r) for r in (build_batch_records(b_id, b_data) if b_data else [])}
+    current = await db_query('records_index', 'batchKey', start_at=f"{b_id}|", end_at=f"{b_id}|~")
+    updates = {f'records_index/{rid}': None for rid in current if rid not in expected}
+    updates.update({f'records_index/{rid}': entry for rid, entry in expected.items() if current.get(rid) != entry})
+    if updates:
+        await db_update('/', updates)
+    return len(updates)
+
+async def reconcile_active_batches() -> dict:
+    """One reconcile pass over the active batches; returns {batchId: rows changed} for those that moved."""
+    changed = {}
+    if not storage_ready():
+        return changed
+    index_built = await db_get('records_meta/built')
+    for b_id in await get_batches_by_status('active'):
+        b_data = await db_get_fields(f'global_batches/{b_id}', RECONCILE_FIELDS)
+        rows = await reconcile_batch_records(b_id, b_data) if index_built else 0
+        series = await reconcile_batch_series(b_id, b_data)
+        if rows or series:
+            changed[b_id] = {"records": rows, "series": series}
+    if changed:
+        print(f"Reconcile: {len(changed)} batch(es) changed outside the API")
+    return changed
+
+async def reconcile_worker():
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+        try:
+            await reconcile_active_batches()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Reconcile pass failed: {e}")
+
+async def start_reconcile_worker():
+    global reconcile_task
+    if RECONCILE_INTERVAL_SECONDS > 0:
+        reconcile_task = asyncio.create_task(reconcile_worker())
+
+@app.on_event("shutdown")
+async def stop_reconcile_worker():
+    if reconcile_task is not None:
+        reconcile_task.cancel()
+
+async def backfill_records_index() -> dict:
+    """Backfill job: builds records_index from the existing daily logs, one batch at a time."""
+    batch_ids = list(((await db_get('global_batches', shallow=True)) or {}).keys())
+    total = 0
+    for b_id in batch_ids:
+        total += await index_batch_records(b_id)
+    await db_update('records_meta', {"built": True, "records": total, "lastBackfill": get_ph_time()})
+    print(f"Records index backfilled: {total} records from {len(batch_ids)} batches")
+    return {"batches": len(batch_ids), "records": total}
+
+async def get_records_page(limit: int, cursor: Optional[str] = None, record_type: Optional[str] = None,
+                           batch_id: Optional[str] = None) -> dict:
+    """Newest-first page of master records. The cursor is the sortKey of the last row returned."""
+    if batch_id and record_type:
+        field, prefix = "batchTypeKey", f"{batch_id}|{record_type}|"
+    elif batch_id:
+        field, prefix = "batchKey", f"{batch_id}|"
+    elif record_type:
+        field, prefix = "typeKey", f"{record_type}|"
+    else:
+        field, prefix = "sortKey", ""
+    end = prefix + cursor if cursor else prefix + "~"
+    entries = await db_query('records_index', field, start_at=prefix, end_at=end,
+                             limit_to_last=limit + (2 if cursor else 1))
+    rows = sorted(entries.values(), key=lambda e: e.get(field, ''), reverse=True)
+    rows = [r for r in rows if r.get('sortKey') != cursor]
+    page = rows[:limit]
+    next_cursor = page[-1]['sortKey'] if len(rows) > limit else None
+    return {
+        "records": [{k: v for k, v in r.items() if k not in RECORD_INDEX_FIELDS} for r in page],
+        "nextCursor": next_cursor
+    }
+
+def page_records(records: list, limit: int, cursor: Optional[str] = None) -> dict:
+    """get_records_page over rows built in memory, with the same sortKey cursor."""
+    keyed = sorted(((record_index_entry('', r)['sortKey'], r) for r in records), key=lambda e: e[0], reverse=True)
+    if cursor:
+        keyed = [e for e in keyed if e[0] < cursor]
+    page = keyed[:limit]
+    return {"records": [r for _, r in page], "nextCursor": page[-1][0] if len(keyed) > limit else None}
+
 @app.get("/get-all-records")
-async def get_all_records(authorization: str = Header(None)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Unauthorized")
+async def get_all_records(request: Request, limit: Optional[int] = None, cursor: Optional[str] = None,
+                          type: Optional[str] = None, batch_id: Optional[str] = None, user: dict = Depends(verify_token)):
+    """Master records, newest first. With ?limit= returns {records, nextCursor} pages (from records_index once built)."""
     try:
-        batches = db.reference('global_batches').get()
+        index_built = await db_get('records_meta/built')
+        if limit is not None and index_built:
+            return etag_json(request, await get_records_page(max(1, min(limit, 500)), cursor, type, batch_id))
+
+        if index_built:
+            entries = await db_get('records_index') or {}
+            rows = [e for e in entries.values()
+                    if (not type or e.get('type') == type) and (not batch_id or e.get('batchId') == batch_id)]
+            rows.sort(key=lambda e: e.get('sortKey', ''), reverse=True)
+            return etag_json(request, [{k: v for k, v in r.items() if k not in RECORD_INDEX_FIELDS} for r in rows])
+
+        # Index not built yet: compute from the batches as before
+        batches = await db_get('global_batches')
         all_records = []
 
         if not batches:
-            return []
+            return etag_json(request, {"records": [], "nextCursor": None} if limit is not None else [])
 
         for b_id, b_data in batches.items():
-            b_name = b_data.get('batchName', 'Unnamed Batch')
-
-            # Mortality Logs
-            m_logs = b_data.get('mortality_logs', {})
-            if m_logs:
-                for date, log in m_logs.items():
-                    total = int(log.get('am', 0)) + int(log.get('pm', 0))
-                    all_records.append({
-                        "id": f"mort-{b_id}-{date}",
-                        "type": "Mortality",
-                        "date": date,
-                        "timestamp": log.get('timestamp', 0),
-                        "title": f"Batch: {b_name}",
-                        "subtitle": f"Mortality: {total} heads (AM: {log.get('am')}, PM: {log.get('pm')})",
-                        "user": log.get('updaterName', 'System')
-                    })
+            if batch_id and b_id != batch_id:
+                continue
+            all_records.extend(r for r in build_batch_records(b_id, b_data) if not type or r['type'] == type)
 
-            # Feed Logs
-            f_logs = b_data.get('feed_logs', {})
-            if f_logs:
-                forecast = b_data.get('feedForecast', [])
-                for date, log in f_logs.items():
-                    start_date = datetime.strptime(b_data.get('dateCreated'), "%Y-%m-%d")
-                    log_date = datetime.strptime(date, "%Y-%m-%d")
-                    day_num = (log_date - start_date).days + 1
-                    
-                    feed_type = "Feed"
-                    for f in forecast:
-                        if f.get('day') == day_num:
-                            feed_type = f.get('feedType', 'Feed')
-                            break
-
-                    all_records.append({
-                        "id": f"feed-{b_id}-{date}",
-                        "type": "Feed",
-                        "date": date,
-                        "timestamp": log.get('timestamp', 0),
-                        "title": f"Batch: {b_name}",
-                        "subtitle": f"{feed_type}: {float(log.get('am', 0)) + float(log.get('pm', 0))} kg",
-                        "user": log.get('updaterName', 'System')
-                    })
+        all_records.sort(key=lambda x: x['timestamp'], reverse=True)
+        if limit is not None:
+            return etag_json(request, page_records(all_records, max(1, min(limit, 500)), cursor))
+        return etag_json(request, all_records)
 
-            # Vitamin Logs
-            v_logs = b_data.get('daily_vitamin_logs', {})
-            if v_logs:
-                for date, log in v_logs.items():
-                    all_records.append({
-                        "id": f"vit-{b_id}-{date}",
-                        "type": "Vitamins",
-                        "date": date,
-                        "timestamp": log.get('timestamp', 0),
-                        "title": f"Batch: {b_name}",
-                        "subtitle": f"Supplement: {float(log.get('am_amount', 0)) + float(log.get('pm_amount', 0))} units",
-                        "user": log.get('updaterName', 'System')
-                    })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-            # Weight Logs
-            w_logs = b_data.get('weight_logs', {})
-            if w_logs:
-                for date, log in w_logs.items():
-                    all_records.append({
-                        "id": f"weight-{b_id}-{date}",
-                        "type": "Weight",
-                        "date": date,
-                        "timestamp": log.get('timestamp', 0),
-                        "title": f"Batch: {b_name}",
-                        "subtitle": f"Average Weight: {log.get('averageWeight')} {log.get('unit', 'g')}",
-                        "user": log.get('updaterName', 'System')
-                    })
+@app.post("/rebuild-records-index")
+async def rebuild_records_index(user: dict = Depends(verify_token)):
+    """Backfills the master-records feed from existing batch logs."""
+    try:
+        return {"status": "success", **(await backfill_records_index())}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        all_records.sort(key=lambda x: x['timestamp'], reverse=True)
-        return all_records
+# ---------------------------------------------------------
+# 10.1 STREAMING EXPORTS
+# ---------------------------------------------------------
+# Exports page through the database EXPORT_CHUNK_SIZE children at a time and
+# write rows as they arrive, so memory stays flat however long the history is.
+EXPORT_CHUNK_SIZE = 500
+EXPORT_FLUSH_ROWS = 200
+
+RECORD_COLUMNS = ["id", "type", "date", "timestamp", "title", "subtitle", "user"]
+EXPENSE_COLUMNS = ["id", "category", "feedType", "itemName", "description", "amount", "quantity",
+                   "purchaseCount", "remaining", "unit", "date", "timestamp"]
+SALE_COLUMNS = ["id", "buyerName", "address", "quantity", "pricePerChicken", "totalAmount",
+                "dateOfPurchase", "timestamp"]
+
+async def iter_child_pages(path: str, chunk: int = EXPORT_CHUNK_SIZE):
+    """Yields (key, value) children of a node in key order, reading one chunk per query."""
+    last_key = None
+    while True:
+        page = await db_query(path, '$key', start_at=last_key, limit_to_first=chunk + (1 if last_key else 0))
+        items = [(k, v) for k, v in page.items() if k != last_key]
+        for item in items:
+            yield item
+        if len(items) < chunk:
+            return
+        last_key = items[-1][0]
+
+async def iter_records(record_type: Optional[str] = None, batch_id: Optional[str] = None):
+    """Master records newest first from the index, or batch by batch if it is not built yet."""
+    if await db_get('records_meta/built'):
+        cursor = None
+        while True:
+            page = await get_records_page(EXPORT_CHUNK_SIZE, cursor, record_type, batch_id)
+            for record in page["records"]:
+                yield record
+            cursor = page["nextCursor"]
+            if not cursor:
+                return
+    batch_ids = [batch_id] if batch_id else list(((await db_get('global_batches', shallow=True)) or {}).keys())
+    for b_id in batch_ids:
+        b_data = await db_get(f'global_batches/{b_id}')
+        records = build_batch_records(b_id, b_data) if b_data else []
+        records.sort(key=lambda x: x['timestamp'], reverse=True)
+        for record in records:
+            if not record_type or record['type'] == record_type:
+                yield record
+
+async def iter_children_with_id(path: str):
+    async for key, val in iter_child_pages(path):
+        yield {"id": key, **val}
+
+async def stream_ndjson(rows):
+    buffer = []
+    async for row in rows:
+        buffer.append(dump_json(row).decode("utf-8"))
+        if len(buffer) >= EXPORT_FLUSH_ROWS:
+            yield "\n".join(buffer) + "\n"
+            buffer = []
+    if buffer:
+        yield "\n".join(buffer) + "\n"
+
+async def stream_csv(rows, columns: list):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    async for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % EXPORT_FLUSH_ROWS == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate(0)
+    yield out.getvalue()
+
+def export_response(rows, columns: list, fmt: str, filename: str):
+    if fmt == "csv":
+        return StreamingResponse(stream_csv(rows, columns), media_type="text/csv",
+                                 headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'})
+    if fmt == "ndjson":
+        return StreamingResponse(stream_ndjson(rows), media_type="application/x-ndjson")
+    raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+
+@app.get("/export-records")
+async def export_records(format: str = "ndjson", type: Optional[str] = None, batch_id: Optional[str] = None,
+                         user: dict = Depends(verify_token)):
+    return export_response(iter_records(type, batch_id), RECORD_COLUMNS, format, "records")
+
+@app.get("/export-expenses/{batch_id}")
+async def export_expenses(batch_id: str, format: str = "ndjson", user: dict = Depends(verify_token)):
+    return export_response(iter_children_with_id(f'global_batches/{batch_id}/expenses'), EXPENSE_COLUMNS, format, f"expenses-{batch_id}")
+
+@app.get("/export-sales/{batch_id}")
+async def export_sales(batch_id: str, format: str = "ndjson", user: dict = Depends(verify_token)):
+    return export_response(iter_children_with_id(f'global_batches/{batch_id}/sales'), SALE_COLUMNS, format, f"sales-{batch_id}")
+
+# ---------------------------------------------------------
+# 10.2 BULK IMPORT
+# ---------------------------------------------------------
+# Paper-record migrations and offline syncs post whole arrays here instead of
+# one request per row. Rows are validated with the regular schemas and written
+# as chunked multi-path updates. Expense and sale rows may carry their own
+# push ID in "id" (one is generated and returned otherwise); rows whose ID
+# already exists are reported as duplicates, so a retried import is a no-op
+# for the rows that made it. Daily logs are keyed by date and simply upserted.
+
+IMPORT_MAX_ROWS = 5000
+IMPORT_CHUNK_ROWS = 250
+INVALID_KEY_CHARS = set('.$#[]/')
+
+def import_row_id(row: dict) -> str:
+    row_id = row.get("id")
+    if row_id is None:
+        return generate_push_id()
+    row_id = str(row_id)
+    if not row_id or len(row_id) > 128 or any(c in INVALID_KEY_CHARS for c in row_id):
+        raise ValueError(f"invalid id '{row_id}'")
+    return row_id
+
+def check_import_size(rows: list):
+    if not rows:
+        raise HTTPException(status_code=400, detail="rows must not be empty")
+    if len(rows) > IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"at most {IMPORT_MAX_ROWS} rows per import")
+
+def import_summary(results: list) -> dict:
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    return {"status": "success", "rows": len(results), "counts": counts, "results": results}
+
+async def write_import_chunks(items: list, results: list, paths_of, ok_status: str) -> list:
+    """Writes items (row, ...) in chunks of one multi-path update; returns the items that were written."""
+    written = []
+    for start in range(0, len(items), IMPORT_CHUNK_ROWS):
+        chunk = items[start:start + IMPORT_CHUNK_ROWS]
+        paths = {}
+        for item in chunk:
+            paths.update(paths_of(item))
+        try:
+            await db_update('/', paths)
+        except Exception as e:
+            for item in chunk:
+                results[item[0]]["status"], results[item[0]]["detail"] = "error", str(e)
+            continue
+        for item in chunk:
+            results[item[0]]["status"] = ok_status
+        written.extend(chunk)
+    return written
+
+async def import_batch_children(rows: list, schema, collection: str, build, contribution) -> dict:
+    """Bulk insert of expenses or sales: validate, skip existing IDs, write, then one aggregate delta per batch."""
+    results = [{"row": i} for i in range(len(rows))]
+    pending = []
+    for i, row in enumerate(rows):
+        try:
+            data = schema(**{k: v for k, v in row.items() if k != "id"})
+            key = import_row_id(row)
+        except Exception as e:
+            results[i].update(status="error", detail=str(e))
+            continue
+        results[i].update(id=key, batchId=data.batchId)
+        pending.append((i, data.batchId, key, build(data)))
+
+    known = await get_batch_index()
+    batch_ids = {bid for _, bid, _, _ in pending if bid in known}
+    key_sets = await asyncio.gather(*(db_get(f'global_batches/{bid}/{collection}', shallow=True) for bid in batch_ids))
+    existing = {bid: set((keys or {}).keys()) for bid, keys in zip(batch_ids, key_sets)}
+
+    to_write = []
+    for item in pending:
+        i, bid, key, _ = item
+        if bid not in known:
+            results[i].update(status="error", detail="batch not found")
+        elif key in existing[bid]:
+            results[i]["status"] = "duplicate"
+        else:
+            existing[bid].add(key)
+            to_write.append(item)
+
+    written = await write_import_chunks(
+        to_write, results, lambda item: {f'global_batches/{item[1]}/{collection}/{item[2]}': item[3]}, "created")
+    deltas = {}
+    for _, bid, _, record in written:
+        deltas[bid] = merge_deltas(deltas.get(bid, {}), contribution(record))
+    for bid, batch_deltas in deltas.items():
+        await apply_aggregate_deltas(bid, batch_deltas)
+    return import_summary(results)
+
+def build_imported_expense(data: ExpenseSchema) -> dict:
+    return {**data.dict(exclude={"batchId"}), "timestamp": get_ph_time()}
+
+def build_imported_sale(data: SalesRecordSchema) -> dict:
+    return {
+        **data.dict(exclude={"batchId"}),
+        "totalAmount": data.quantity * data.pricePerChicken,
+        "timestamp": get_ph_time()
+    }
+
+def parse_daily_log(row: dict):
+    """Validates one daily log row; returns (batchId, kind, date, log)."""
+    kind = row.get("kind")
+    if kind not in LOG_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(LOG_KINDS)}")
+    if kind == 'weight_logs':
+        data = WeightLogSchema(**row)
+        log = data.dict(exclude={"batchId", "date"})
+    else:
+        data = DailyLogSchema(**row)
+        log = data.dict(exclude={"batchId", "kind", "date"}, exclude_none=True)
+        if kind == 'mortality_logs':
+            if any(k in ('am', 'pm') and v != int(v) for k, v in log.items()):
+                raise ValueError("mortality am/pm must be whole numbers")
+            log = {k: int(v) if k in ('am', 'pm') else v for k, v in log.items()}
+    datetime.strptime(data.date, "%Y-%m-%d")
+    log["timestamp"] = get_ph_time()
+    return data.batchId, kind, data.date, log
+
+async def import_daily_logs(rows: list) -> dict:
+    """Bulk upsert of daily logs: one merge per (batch, kind, day), then chunked records_index rows and series."""
+    results = [{"row": i} for i in range(len(rows))]
+    pending = []
+    for i, row in enumerate(rows):
+        try:
+            bid, kind, date, log = parse_daily_log(row)
+        except Exception as e:
+            results[i].update(status="error", detail=str(e))
+            continue
+        results[i].update(batchId=bid, kind=kind, date=date)
+        pending.append((i, bid, kind, date, log))
+
+    known = await get_batch_index()
+    batch_ids = sorted({p[1] for p in pending if p[1] in known})
+    with_feed = {p[1] for p in pending if p[2] == 'feed_logs'}
+    metas = await asyncio.gather(*(
+        db_get_fields(f'global_batches/{bid}', ['batchName', 'dateCreated'] + (['feedForecast'] if bid in with_feed else []))
+        for bid in batch_ids))
+    batches = {}
+    for bid, meta in zip(batch_ids, metas):
+        try:
+            start_date = datetime.strptime(meta.get('dateCreated'), "%Y-%m-%d")
+        except (TypeError, ValueError):
+            start_date = None
+        batches[bid] = (meta.get('batchName', 'Unnamed Batch'), start_date, feed_type_by_day(meta.get('feedForecast')))
+
+    to_write = []
+    for item in pending:
+        if item[1] not in batches:
+            results[item[0]].update(status="error", detail="batch not found")
+            continue
+        try:
+            results[item[0]]["day"] = series_day(batches[item[1]][1], item[3])
+        except ValueError as e:
+            results[item[0]].update(status="error", detail=str(e))
+            continue
+        to_write.append(item)
+
+    # Rows for the same day (say an AM row and a PM row) are folded together
+    # first, then merged into the stored entry by the same field-level upsert
+    # /add-daily-log uses, so neither another row nor an earlier write is lost.
+    groups = {}
+    for i, bid, kind, date, log in to_write:
+        if kind == 'weight_logs':
+            log["day"] = results[i]["day"]
+        group = groups.setdefault((bid, kind, date), {"rows": [], "fields": {}})
+        group["rows"].append(i)
+        group["fields"] = merge_log(group["fields"], log)
+
+    async def merge_group(key, group):
+        bid, kind, date = key
+        try:
+            log = await db_transaction(f'global_batches/{bid}/{kind}/{date}',
+                                       lambda current: merge_log(current, group["fields"]))
+        except Exception as e:
+            for i in group["rows"]:
+                results[i].update(status="error", detail=str(e))
+            return None
+        for i in group["rows"]:
+            results[i]["status"] = "written"
+        return key, log
+
+    merged = [m for m in await asyncio.gather(*(merge_group(k, g) for k, g in groups.items())) if m]
+
+    index_rows, changes = [], {}
+    for (bid, kind, date), log in merged:
+        b_name, start_date, feed_types = batches[bid]
+        record = build_log_record(kind, bid, b_name, date, log, start_date, feed_types)
+        index_rows.append((f'records_index/{record["id"]}', record_index_entry(bid, record)))
+        changes.setdefault(bid, []).append((kind, series_day(start_date, date), log_day_value(kind, log)))
+    for start in range(0, len(index_rows), IMPORT_CHUNK_ROWS):
+        try:
+            await db_update('/', dict(index_rows[start:start + IMPORT_CHUNK_ROWS]))
+        except Exception as e:
+            # The logs are stored; the reconcile pass or /rebuild-records-index catches the feed up
+            print(f"Bulk import: records index update failed ({e})")
+    for bid, batch_changes in changes.items():
+        await update_batch_series(bid, batches[bid][1], batch_changes)
+    return import_summary(results)
+
+@app.post("/bulk-add-expenses")
+async def bulk_add_expenses(data: BulkImportSchema, user: dict = Depends(verify_token)):
+    check_import_size(data.rows)
+    try:
+        return await import_batch_children(data.rows, ExpenseSchema, 'expenses', build_imported_expense, expense_contribution)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/bulk-add-sales")
+async def bulk_add_sales(data: BulkImportSchema, user: dict = Depends(verify_token)):
+    check_import_size(data.rows)
+    try:
+        return await import_batch_children(data.rows, SalesRecordSchema, 'sales', build_imported_sale, sale_contribution)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/bulk-add-daily-logs")
+async def bulk_add_daily_logs(data: BulkImportSchema, user: dict = Depends(verify_token)):
+    check_import_size(data.rows)
+    try:
+        return await import_daily_logs(data.rows)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ---------------------------------------------------------
+# 10.3 DAILY LOGS
+# ---------------------------------------------------------
+# Daily logs keep their date-keyed home under global_batches/{id}/{kind}/{date},
+# where the dashboard and the records feed read them. Every write through
+# these endpoints (and /bulk-add-daily-logs) also folds the day into
+# 'batch_series/{batchId}': one array per metric, element i being day i + 1,
+# plus the running totals, so charts read one compact node instead of
+# scanning four date-keyed dicts:
+#   mortality, feedKg, vitamins, weight (0 = not weighed that day),
+#   cumMortality, cumFeedKg, totalMortality, totalFeedKg, latestWeight, latestWeightDay
+# Logs written straight to the RTDB are folded in by the reconcile pass
+# (section 10), which rebuilds an active batch's series from its logs and
+# rewrites it when the two disagree.
+SERIES_MAX_DAYS = 400
+SERIES_COLUMNS = {
+    "mortality_logs": "mortality",
+    "feed_logs": "feedKg",
+    "daily_vitamin_logs": "vitamins",
+    "weight_logs": "weight",
+}
+
+def series_day(start_date, date: str) -> int:
+    day = day_number(start_date, date)
+    if day is None:
+        raise ValueError("batch has no valid dateCreated")
+    if not 1 <= day <= SERIES_MAX_DAYS:
+        raise ValueError(f"{date} is day {day} of the batch (expected 1-{SERIES_MAX_DAYS})")
+    return day
+
+def series_column(value, days: int) -> list:
+    """RTDB returns arrays as lists (or dicts when sparse); normalise to a zero-padded list."""
+    column = [0] * days
+    items = value.items() if isinstance(value, dict) else enumerate(value or [])
+    for i, v in items:
+        if int(i) < days:
+            column[int(i)] = v or 0
+    return column
+
+def apply_series_changes(current: Optional[dict], start_date, changes: list) -> dict:
+    """changes: [(kind, day, value)]. Returns the new series node with the running totals recomputed."""
+    series = dict(current or {})
+    series.pop('snapshot', None)  # packed copy of a completed batch (10.4), stale from here on
+    days = max([int(series.get('days') or 0)] + [day for _, day, _ in changes])
+    columns = {col: series_column(series.get(col), days) for col in SERIES_COLUMNS.values()}
+    for kind, day, value in changes:
+        columns[SERIES_COLUMNS[kind]][day - 1] = value
+    cum_mortality = np.cumsum(columns["mortality"], dtype=np.int64).tolist()
+    cum_feed = np.round(np.cumsum(columns["feedKg"], dtype=np.float64), 3).tolist()
+    weighed = [i for i, w in enumerate(columns["weight"]) if w]
+    series.update(columns)
+    series.update({
+        "startDate": start_date.strftime("%Y-%m-%d"),
+        "days": days,
+        "cumMortality": cum_mortality,
+        "cumFeedKg": cum_feed,
+        "totalMortality": cum_mortality[-1] if days else 0,
+        "totalFeedKg": cum_feed[-1] if days else 0,
+        "latestWeight": columns["weight"][weighed[-1]] if weighed else 0,
+        "latestWeightDay": weighed[-1] + 1 if weighed else 0,
+        "updated": get_ph_time()
+    })
+    return series
+
+async def update_batch_series(b_id: str, start_date, changes: list):
+    if changes:
+        node = await db_transaction(f'batch_series/{b_id}', lambda current: apply_series_changes(current, start_date, changes))
+        series_cache.pop(b_id, None)
+        refresh_batch_variance(b_id, node)
+
+def build_batch_series(b_data: dict) -> Optional[dict]:
+    """Series of one batch computed from its date-keyed logs (backfill for logs written before the series existed)."""
+    try:
+        start_date = datetime.strptime(b_data.get('dateCreated'), "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+    changes = []
+    for kind in LOG_KINDS:
+        for date, log in (b_data.get(kind) or {}).items():
+            day = day_number(start_date, date)
+            if day is not None and 1 <= day <= SERIES_MAX_DAYS:
+                changes.append((kind, day, log_day_value(kind, log)))
+    return apply_series_changes(None, start_date, changes)
+
+def merge_log(current: Optional[dict], fields: dict) -> dict:
+    """Field-level upsert of one day's entry; nested maps (vitamin doses) merge one level deep."""
+    merged = dict(current or {})
+    for key, value in fields.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = {**merged[key], **value}
+        else:
+            merged[key] = value
+    return merged
+
+async def get_log_batch_start(b_id: str):
+    created = await db_get(f'global_batches/{b_id}/dateCreated')
+    if created is None:
+        raise ValueError("Batch not found")
+    try:
+        return datetime.strptime(created, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise ValueError("batch has no valid dateCreated")
+
+async def write_daily_log(b_id: str, kind: str, date: str, fields: Optional[dict], start_date=None) -> dict:
+    """Upserts (fields merged into the day's entry) or deletes (fields None) one log, then its record and series day."""
+    start_date = start_date or await get_log_batch_start(b_id)
+    path = f'global_batches/{b_id}/{kind}/{date}'
+    if fields is None:
+        # Legacy logs can sit outside the series window; they are deleted without touching it
+        day = day_number(start_date, date)
+        changes = [(kind, day, 0)] if day is not None and 1 <= day <= SERIES_MAX_DAYS else []
+        await db_delete(path)
+        log = None
+    else:
+        day = series_day(start_date, date)
+        log = await db_transaction(path, lambda current: merge_log(current, fields))
+        changes = [(kind, day, log_day_value(kind, log))]
+    await asyncio.gather(
+        index_log_record(b_id, kind, date, log),
+        update_batch_series(b_id, start_date, changes)
+    )
+    return {"status": "success", "batchId": b_id, "kind": kind, "date": date, "day": day, "log": log}
+
+@app.post("/add-daily-log")
+async def add_daily_log(data: DailyLogSchema, user: dict = Depends(verify_token)):
+    """Mortality, feed or vitamin entry; AM and PM can be sent separately, fields merge into the day."""
+    try:
+        if data.kind == 'weight_logs':
+            raise ValueError("use /add-weight-log for weight entries")
+        b_id, kind, date, log = parse_daily_log(data.dict())
+        return await write_daily_log(b_id, kind, date, log)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/add-weight-log")
+async def add_weight_log(data: WeightLogSchema, user: dict = Depends(verify_token)):
+    try:
+        b_id, kind, date, log = parse_daily_log({**data.dict(), "kind": "weight_logs"})
+        start_date = await get_log_batch_start(b_id)
+        log["day"] = series_day(start_date, date)
+        return await write_daily_log(b_id, kind, date, log, start_date)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/delete-weight-log")
+async def delete_weight_log(data: DeleteWeightLogSchema, user: dict = Depends(verify_token)):
+    try:
+        return await write_daily_log(data.batchId, 'weight_logs', data.date, None)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/add-vitamin-log")
+async def add_vitamin_log(data: VitaminLogSchema, user: dict = Depends(verify_token)):
+    """Actual dose of one vitamin on a batch day; stored under daily_vitamin_logs/{date}/doses."""
+    try:
+        start_date = await get_log_batch_start(data.batchId)
+        date = (start_date + timedelta(days=data.day - 1)).strftime("%Y-%m-%d")
+        fields = {"doses": {data.vitaminName: data.actualAmount}, "timestamp": get_ph_time()}
+        return await write_daily_log(data.batchId, 'daily_vitamin_logs', date, fields, start_date)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def same_series(a: Optional[dict], b: Optional[dict]) -> bool:
+    """True when two series nodes hold the same start date and daily columns."""
+    a, b = a or {}, b or {}
+    days = max(int(a.get('days') or 0), int(b.get('days') or 0))
+    return a.get('startDate') == b.get('startDate') and all(
+        series_column(a.get(col), days) == series_column(b.get(col), days) for col in SERIES_COLUMNS.values())
+
+async def reconcile_batch_series(b_id: str, b_data: dict) -> bool:
+    """Rebuilds batch_series from the logs in b_data if it has drifted; True when it was rewritten."""
+    rebuilt = build_batch_series(b_data)
+    if rebuilt is None:
+        return False
+    result = {"rewritten": False}
+
+    def replace(current):
+        result["rewritten"] = not same_series(current, rebuilt)
+        return rebuilt if result["rewritten"] else current
+
+    node = await db_transaction(f'batch_series/{b_id}', replace)
+    if result["rewritten"]:
+        series_cache.pop(b_id, None)
+        refresh_batch_variance(b_id, node)
+    return result["rewritten"]
+
+async def get_series_node(b_id: str) -> dict:
+    """The batch_series node, built from the batch's logs on first read."""
+    series = await db_get(f'batch_series/{b_id}')
+    if series is None:
+        b_data = await db_get(f'global_batches/{b_id}')
+        if not b_data:
+            raise ValueError("Batch not found")
+        series = build_batch_series(b_data)
+        if series is None:
+            raise ValueError("batch has no valid dateCreated")
+        await db_set(f'batch_series/{b_id}', series)
+    return series
+
+# ---------------------------------------------------------
+# 10.4 COLUMNAR SERIES (ANALYTICS READS)
+# ---------------------------------------------------------
+# Analytics read batches as series_store.BatchSeries arrays. Completed batches
+# no longer change, so their first read packs the series into
+# 'batch_series/{id}/snapshot' (a few hundred bytes; any later write to the
+# series drops it) and keeps it in an in-process LRU. Active batches are read
+# from the array node each time.
+SERIES_CACHE_MAX = 5000
+series_cache = OrderedDict()  # batch id -> BatchSeries of a completed batch
+
+def add_series_snapshot(current):
+    if not current:
+        return current
+    return {**current, "snapshot": BatchSeries.from_node("", current).pack()}
+
+async def load_batch_series(b_id: str, completed: bool = False) -> BatchSeries:
+    series = series_cache.get(b_id)
+    if series is not None:
+        series_cache.move_to_end(b_id)
+        return series
+    if not completed:
+        return BatchSeries.from_node(b_id, await get_series_node(b_id))
+
+    blob = await db_get(f'batch_series/{b_id}/snapshot')
+    if blob:
+        series = BatchSeries.unpack(b_id, blob)
+    else:
+        await get_series_node(b_id)
+        series = BatchSeries.from_node(b_id, await db_transaction(f'batch_series/{b_id}', add_series_snapshot))
+    series_cache[b_id] = series
+    if len(series_cache) > SERIES_CACHE_MAX:
+        series_cache.popitem(last=False)
+    return series
+
+async def load_series_many(batch_ids: list, index: Optional[dict] = None) -> list:
+    """BatchSeries of several batches (status from batch_index decides snapshot use), concurrently."""
+    if index is None:
+        index = await get_batch_index()
+    return list(await asyncio.gather(*(
+        load_batch_series(bid, (index.get(bid) or {}).get('status') == 'completed') for bid in batch_ids)))
+
+def nan_to_none(values) -> list:
+    return [None if math.isnan(v) else round(v, 3) for v in np.asarray(values, dtype=np.float64).tolist()]
+
+@app.get("/batch-series/{batch_id}")
+async def get_batch_series(batch_id: str, from_day: Optional[int] = None, to_day: Optional[int] = None,
+                           every: Optional[int] = None, user: dict = Depends(verify_token)):
+    """Day-indexed arrays and running totals of one batch; from_day/to_day/every return a window of the daily arrays."""
+    try:
+        if from_day is None and to_day is None and every is None:
+            series = await get_series_node(batch_id)
+            return {"id": batch_id, **{k: v for k, v in series.items() if k != 'snapshot'}}
+        status = await db_get(f'batch_index/{batch_id}/status')
+        series = await load_batch_series(batch_id, status == 'completed')
+        return {"id": batch_id, **series.range(from_day or 1, to_day).to_dict(every or 1)}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/series-align/{metric}")
+async def get_series_align(metric: str, batch_ids: Optional[str] = None, status: Optional[str] = None,
+                           from_day: int = 1, to_day: Optional[int] = None, every: int = 1,
+                           cumulative: bool = False, user: dict = Depends(verify_token)):
+    """One metric of many batches side by side by batch day (e.g. ?status=completed&every=7)."""
+    try:
+        index = await get_batch_index()
+        if batch_ids:
+            ids = [bid for bid in batch_ids.split(',') if bid in index]
+        else:
+            ids = [bid for bid, summary in index.items() if not status or summary.get('status') == status]
+        series = await load_series_many(ids, index)
+        matrix = align(series, metric, from_day, to_day, every, cumulative)
+        return {
+            "metric": metric,
+            "firstDay": from_day,
+            "every": every,
+            "cumulative": cumulative,
+            "batches": [
+                {"id": bid, "batchName": index[bid].get('batchName'), "values": nan_to_none(row)}
+                for bid, row in zip(ids, matrix)
+            ]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ---------------------------------------------------------
+# 10.5 ACTUAL VS FORECAST VARIANCE
+# ---------------------------------------------------------
+# Joins the plan (forecast_batches: targetKilos and avgWeight per day) with the
+# logged series, for all requested batches in one pass over (batches x days)
+# arrays. Per day:
+#   feedVarianceKg   logged feed - targetKilos (days without a feed log are skipped)
+#   weightVarianceG  weighed average - forecast avgWeight
+#   fcr / fcrPlan    feed per live bird over weight gain since the previous
+#                    weigh-in, against the same period of the plan (i.e. the
+#                    get_estimated_fcr steps weighted by planned feed)
+# Results are kept per batch; a log landing through 10.3 recomputes just that
+# batch from the series node its transaction returned, and so does a series
+# the reconcile pass rewrote after a write that bypassed the API. Entries
+# older than VARIANCE_TTL_SECONDS are recomputed from the stored series on
+# read, which picks up batch setting and growth model changes.
+VARIANCE_TTL_SECONDS = int(os.getenv("VARIANCE_TTL_SECONDS", "300"))
+variance_cache = {}  # batch id -> {"summary", "result", "expires"}
+VARIANCE_DAY_FIELDS = ("day", "date", "feedKg", "targetKilos", "feedVarianceKg",
+                       "avgWeight", "forecastWeight", "weightVarianceG", "fcr", "fcrPlan")
+
+def compute_variance(summaries: list, series: list) -> list:
+    """Variance of N batches: summaries are batch_index entries, series their BatchSeries (same order)."""
+    if not series:
+        return []
+    cycle_days = max([DEFAULT_CYCLE_DAYS] + [s.last_day for s in series])
+    starts = np.array([[float(b.get('averageChickWeight') or 50.0)] for b in summaries])
+    plan = forecast_batches([int(b.get('startingPopulation') or 1000) for b in summaries], starts[:, 0], cycle_days,
+                            model=active_growth_model())
+    pops = plan["population"][:, None]
+    day_index = np.arange(cycle_days)
+
+    feed = align(series, "feedKg", 1, cycle_days)
+    feed[feed == 0] = np.nan
+    weight = align(series, "weight", 1, cycle_days)
+    alive = pops - np.nan_to_num(align(series, "mortality", 1, cycle_days, cumulative=True))
+    alive = np.maximum(alive, 1)
+
+    # Feed per live bird (g), cumulative, and its planned counterpart
+    cum_grams = np.cumsum(np.nan_to_num(feed) * 1000.0 / alive, axis=1)
+    plan_cum_grams = np.cumsum(plan["tables"]["grams"])[None, :].repeat(len(series), axis=0)
+
+    # Previous weigh-in of every day (-1 = the chicks' start weight on day 0)
+    weighed = ~np.isnan(weight)
+    last = np.maximum.accumulate(np.where(weighed, day_index, -1), axis=1)
+    prev = np.hstack([np.full((len(series), 1), -1), last[:, :-1]])
+    safe_prev = np.maximum(prev, 0)
+
+    def at_prev(matrix, day_zero):
+        return np.where(prev >= 0, np.take_along_axis(matrix, safe_prev, axis=1), day_zero)
+
+    weight_prev = at_prev(np.nan_to_num(weight), starts)
+    plan_weight_prev = at_prev(plan["avgWeight"], starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain = weight - weight_prev
+        fcr = np.where(weighed & (gain > 0), (cum_grams - at_prev(cum_grams, 0.0)) / gain, np.nan)
+        fcr_plan = np.where(weighed, (plan_cum_grams - at_prev(plan_cum_grams, 0.0)) / (plan["avgWeight"] - plan_weight_prev), np.nan)
+
+    feed_var = feed - plan["targetKilos"]
+    weight_var = weight - plan["avgWeight"]
+    results = []
+    for i, (summary, s) in enumerate(zip(summaries, series)):
+        n = s.last_day
+        logged = ~np.isnan(feed[i, :n])
+        w_days = np.flatnonzero(weighed[i, :n])
+        feed_actual = float(feed[i, :n][logged].sum())
+        feed_plan = float(plan["targetKilos"][i, :n][logged].sum())
+        latest = int(w_days[-1]) if w_days.size else None
+        results.append({
+            "batchId": s.batch_id,
+            "batchName": summary.get('batchName'),
+            "status": summary.get('status'),
+            "day": n,
+            "summary": {
+                "feedKg": round(feed_actual, 2),
+                "targetKilos": round(feed_plan, 2),
+                "feedVarianceKg": round(feed_actual - feed_plan, 2),
+                "feedVariancePct": round((feed_actual - feed_plan) / feed_plan * 100, 1) if feed_plan else None,
+                "avgWeight": round(float(weight[i, latest]), 1) if latest is not None else None,
+                "forecastWeight": round(float(plan["avgWeight"][i, latest]), 1) if latest is not None else None,
+                "weightVarianceG": round(float(weight_var[i, latest]), 1) if latest is not None else None,
+                "weightDay": latest + 1 if latest is not None else None,
+                "fcr": round(float(fcr[i, latest]), 3) if latest is not None and not np.isnan(fcr[i, latest]) else None,
+                "fcrPlan": round(float(fcr_plan[i, latest]), 3) if latest is not None else None,
+                "estimatedFcr": get_estimated_fcr(latest + 1) if latest is not None else None
+            },
+            "days": [dict(zip(VARIANCE_DAY_FIELDS, row)) for row in zip(
+                range(1, n + 1), [s.date_of(d) for d in range(1, n + 1)],
+                nan_to_none(feed[i, :n]), nan_to_none(plan["targetKilos"][i, :n]), nan_to_none(feed_var[i, :n]),
+                nan_to_none(weight[i, :n]), nan_to_none(plan["avgWeight"][i, :n]), nan_to_none(weight_var[i, :n]),
+                nan_to_none(fcr[i, :n]), nan_to_none(fcr_plan[i, :n]))]
+        })
+    return results
+
+def store_variance(summary: dict, result: dict):
+    variance_cache[result["batchId"]] = {"summary": summary, "result": result, "expires": time.time() + VARIANCE_TTL_SECONDS}
+
+def refresh_batch_variance(b_id: str, node: Optional[dict]):
+    """Incremental update after a log write: recompute the one batch from its new series node."""
+    entry = variance_cache.pop(b_id, None)
+    if entry and node:
+        store_variance(entry["summary"], compute_variance([entry["summary"]], [BatchSeries.from_node(b_id, node)])[0])
+
+async def get_variance(batch_ids: list, index: dict) -> list:
+    """Cached results where fresh; the rest are loaded and computed together."""
+    now = time.time()
+    stale = [bid for bid in batch_ids if variance_cache.get(bid, {}).get("expires", 0) <= now]
+    if stale:
+        series = await load_series_many(stale, index)
+        for bid, result in zip(stale, compute_variance([index[bid] for bid in stale], series)):
+            store_variance(index[bid], result)
+    return [variance_cache[bid]["result"] for bid in batch_ids]
+
+@app.get("/batch-variance/{batch_id}")
+async def get_batch_variance(batch_id: str, user: dict = Depends(verify_token)):
+    """Daily actual-vs-forecast feed, weight and FCR of one batch."""
+    try:
+        summary = await db_get(f'batch_index/{batch_id}')
+        if not summary:
+            raise ValueError("Batch not found")
+        return (await get_variance([batch_id], {batch_id: summary}))[0]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/variance/active")
+async def get_active_variance(days: bool = False, user: dict = Depends(verify_token)):
+    """Variance summaries of every active batch (?days=true includes the daily rows)."""
+    try:
+        index = await get_batches_by_status('active')
+        results = await get_variance(list(index.keys()), index)
+        if not days:
+            results = [{k: v for k, v in r.items() if k != "days"} for r in results]
+        return {"batches": results, "generated": get_ph_time()}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+# ---------------------------------------------------------
+# 10.6 GROWTH MODEL CALIBRATION
+# ---------------------------------------------------------
+# Fits the farm's own growth curve and per-day FCR from its completed batches
+# (growth_fit.fit_growth_model) and swaps them into the forecast engine (5)
+# in place of get_estimated_fcr. The fit runs in a one-worker process pool,
+# in the background: at start-up and whenever a batch enters or leaves
+# 'completed'. The result is stored per farm and template version under
+# 'growth_models/{FARM_ID}/{template version}', so a restart reuses it, and
+# editing FEED_LOGIC_TEMPLATE falls back to the template until the next fit.
+# Fewer than GROWTH_MIN_BATCHES usable batches (two or more weigh-ins) keeps
+# the template.
+FARM_ID = os.getenv("FARM_ID", "default")
+GROWTH_MIN_BATCHES = int(os.getenv("GROWTH_MIN_BATCHES", "3"))
+
+growth_state = {"model": None, "task": None, "pending": False, "lastRun": None, "lastError": None}
+growth_pool = None
+
+def active_growth_model() -> Optional[dict]:
+    return growth_state["model"]
+
+def get_growth_pool() -> ProcessPoolExecutor:
+    # spawn: the worker starts clean instead of forking the threads of this process
+    global growth_pool
+    if growth_pool is None:
+        growth_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return growth_pool
+
+def growth_fit_input(summary: dict, series: BatchSeries) -> Optional[dict]:
+    start_weight = float(summary.get('averageChickWeight') or 50.0)
+    weights = series.metric('weight')
+    if np.count_nonzero(weights > start_weight) < 2:
+        return None
+    alive = np.maximum(int(summary.get('startingPopulation') or 1000) - np.cumsum(series.metric('mortality')), 1)
+    return {"startWeight": start_weight, "feedGrams": series.metric('feedKg') * 1000.0 / alive, "weights": weights}
+
+async def refit_growth_model(force: bool = False) -> Optional[dict]:
+    """Fits from the current completed batches unless the stored model already covers exactly those."""
+    index = await get_batches_by_status('completed')
+    batch_ids = sorted(index)
+    source = content_hash({"farm": FARM_ID, "template": FORECAST_TEMPLATE_VERSION, "batches": batch_ids})
+    current = growth_state["model"]
+    if current and current.get("source") == source and not force:
+        return current
+
+    series = await load_series_many(batch_ids, index)
+    inputs = [x for x in (growth_fit_input(index[bid], s) for bid, s in zip(batch_ids, series)) if x]
+    if len(inputs) < GROWTH_MIN_BATCHES:
+        print(f"Growth model: {len(inputs)} usable completed batches (need {GROWTH_MIN_BATCHES}), keeping the template")
+        return current
+
+    cycle_days = max([DEFAULT_CYCLE_DAYS] + [s.last_day for s in series])
+    template_grams = get_forecast_tables(cycle_days)["grams"]
+    loop = asyncio.get_running_loop()
+    fit = await loop.run_in_executor(get_growth_pool(), fit_growth_model, inputs, template_grams)
+    model = {
+        **fit,
+        "farm": FARM_ID,
+        "templateVersion": FORECAST_TEMPLATE_VERSION,
+        "version": content_hash({"template": FORECAST_TEMPLATE_VERSION, "fcr": fit["fcr"]}),
+        "source": source,
+        "fitted": get_ph_time()
+    }
+    await db_set(f'growth_models/{FARM_ID}/{FORECAST_TEMPLATE_VERSION}', model)
+    growth_state["model"] = model
+    variance_cache.clear()
+    print(f"Growth model fitted from {model['batches']} batches ({model['observations']} weigh-ins), "
+          f"rmse {model['gompertz']['rmse']:.3f}")
+    return model
+
+async def run_growth_refits():
+    try:
+        while True:
+            growth_state["pending"] = False
+            try:
+                await refit_growth_model()
+                growth_state["lastError"] = None
+            except Exception as e:
+                growth_state["lastError"] = str(e)
+                print(f"Growth model refit failed: {e}")
+            growth_state["lastRun"] = get_ph_time()
+            if not growth_state["pending"]:
+                break
+    finally:
+        growth_state["task"] = None
+
+def schedule_growth_refit():
+    """Starts a background refit, or queues one more if a refit is already running."""
+    if growth_state["task"] is not None:
+        growth_state["pending"] = True
+        return
+    growth_state["task"] = asyncio.create_task(run_growth_refits())
+
+async def warm_growth_model():
+    if not storage_ready():
+        return
+    try:
+        stored = await db_get(f'growth_models/{FARM_ID}/{FORECAST_TEMPLATE_VERSION}')
+    except Exception as e:
+        print(f"Could not load the growth model: {e}")
+        stored = None
+    if stored and stored.get("fcr"):
+        growth_state["model"] = stored
+    schedule_growth_refit()
+
+@app.on_event("shutdown")
+def stop_growth_pool():
+    if growth_pool is not None:
+        growth_pool.shutdown(wait=False, cancel_futures=True)
+
+@app.get("/growth-model")
+async def get_growth_model(user: dict = Depends(verify_token)):
+    model = growth_state["model"]
+    return {
+        "active": model is not None,
+        "model": model,
+        "refitting": growth_state["task"] is not None,
+        "lastRun": growth_state["lastRun"],
+        "lastError": growth_state["lastError"]
+    }
+
+@app.post("/refit-growth-model")
+async def refit_growth_model_now(user: dict = Depends(verify_token)):
+    """Refits now, even if the completed batches have not changed (e.g. after correcting their logs)."""
+    try:
+        model = await refit_growth_model(force=True)
+        return {"status": "success" if model else "insufficient_data", "model": model}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -1111,13 +3498,9 @@ async def get_all_records(authorization: str = Header(None)):
 # ---------------------------------------------------------
 
 @app.post("/add-personnel")
-async def add_personnel(data: PersonnelSchema, authorization: str = Header(None)):
+async def add_personnel(data: PersonnelSchema, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        ref_personnel = db.reference('personnel')
-        new_ref = ref_personnel.push()
-        new_ref.set({
+        new_id = await db_push('personnel', {
             "firstName": data.firstName,
             "lastName": data.lastName,
             "fullName": f"{data.firstName} {data.lastName}",
@@ -1127,28 +3510,21 @@ async def add_personnel(data: PersonnelSchema, authorization: str = Header(None)
             "photoUrl": data.photoUrl,
             "dateAdded": get_ph_time()
         })
-        return {"status": "success", "id": new_ref.key}
+        return {"status": "success", "id": new_id}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/get-personnel")
-async def get_personnel(authorization: str = Header(None)):
+async def get_personnel(request: Request, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        snapshot = db.reference('personnel').get()
-        if snapshot:
-            return [{"id": k, **v} for k, v in snapshot.items()]
-        return []
+        snapshot = await db_get('personnel')
+        return etag_json(request, [{"id": k, **v} for k, v in (snapshot or {}).items()])
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.put("/edit-personnel")
-async def edit_personnel(data: EditPersonnelSchema, authorization: str = Header(None)):
+async def edit_personnel(data: EditPersonnelSchema, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        ref_p = db.reference(f'personnel/{data.personnelId}')
         update_data = {
             "firstName": data.firstName,
             "lastName": data.lastName,
@@ -1160,21 +3536,342 @@ async def edit_personnel(data: EditPersonnelSchema, authorization: str = Header(
         if data.photoUrl:
             update_data["photoUrl"] = data.photoUrl
             
-        ref_p.update(update_data)
+        await db_update(f'personnel/{data.personnelId}', update_data)
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/delete-personnel/{personnel_id}")
-async def delete_personnel(personnel_id: str, authorization: str = Header(None)):
+async def delete_personnel(personnel_id: str, user: dict = Depends(verify_token)):
     try:
-        token = authorization.split("Bearer ")[1]
-        auth.verify_id_token(token)
-        db.reference(f'personnel/{personnel_id}').delete()
+        await db_delete(f'personnel/{personnel_id}')
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# ---------------------------------------------------------
+# 12. LIVE UPDATES (SERVER-SENT EVENTS)
+# ---------------------------------------------------------
+# GET /live?topics=batches,expenses:<batchId>,chats:<uid> streams Firebase deltas
+# instead of having every dashboard re-poll the GET endpoints. The server holds
+# ONE Firebase listener per topic and fans each event out to every connected
+# client's queue; the listener is closed when its last client disconnects.
+# Clients load the initial state with the regular GET endpoints, then apply
+# the {type: put|patch, path, data} events relative to the topic's node.
+# A client whose queue fills up (slow consumer) gets a final "dropped" event
+# and is disconnected rather than holding memory for everyone else.
+
+LIVE_QUEUE_SIZE = 256
+LIVE_KEEPALIVE_SECONDS = 15
+LIVE_DROPPED = object()
+
+live_topics = {}   # topic -> {"path", "listener", "queues": set(), "primed"}
+live_lock = asyncio.Lock()
+live_stats = {"events": 0, "delivered": 0, "dropped_clients": 0}
+
+def live_topic_path(topic: str) -> str:
+    name, _, arg = topic.partition(':')
+    if name in ('batches', 'records') and not arg:
+        return 'batch_index' if name == 'batches' else 'records_index'
+    if name in ('expenses', 'sales') and arg:
+        return f'global_batches/{arg}/{name}'
+    if name == 'chats' and arg:
+        return f'chats/{arg}'
+    raise HTTPException(status_code=400, detail=f"unknown topic '{topic}'")
+
+def live_fan_out(topic: str, message: str):
+    """Runs on the event loop: queues one event for every subscriber, dropping the ones that can't keep up."""
+    entry = live_topics.get(topic)
+    if not entry:
+        return
+    live_stats["events"] += 1
+    for queue in list(entry["queues"]):
+        try:
+            queue.put_nowait(message)
+            live_stats["delivered"] += 1
+        except asyncio.QueueFull:
+            for other in live_topics.values():
+                other["queues"].discard(queue)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(LIVE_DROPPED)
+            live_stats["dropped_clients"] += 1
+
+def live_listener(topic: str, loop):
+    def on_event(event):
+        # Called on the Firebase listener thread
+        entry = live_topics.get(topic)
+        if entry is None:
+            return
+        if not entry["primed"]:
+            # The first event is the full snapshot of the node; clients already have it
+            entry["primed"] = True
+            return
+        data = dump_json({'type': event.event_type, 'path': event.path, 'data': event.data}).decode("utf-8")
+        message = f"event: {topic}\ndata: {data}\n\n"
+        loop.call_soon_threadsafe(live_fan_out, topic, message)
+    return on_event
+
+def close_live_listener(entry: dict):
+    try:
+        entry["listener"].close()
+        print(f"Live: closed listener on {entry['path']}")
+    except Exception as e:
+        print(f"Live: closing listener on {entry['path']} failed: {e}")
+
+async def live_subscribe(topics: list, queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    async with live_lock:
+        for topic in topics:
+            entry = live_topics.get(topic)
+            if entry is None:
+                entry = {"path": live_topic_path(topic), "listener": None, "queues": set(), "primed": False}
+                live_topics[topic] = entry
+                try:
+                    entry["listener"] = await run_db("listen", lambda: db_ref(entry["path"]).listen(live_listener(topic, loop)))
+                except Exception:
+                    live_topics.pop(topic, None)
+                    raise
+                print(f"Live: listening on {entry['path']}")
+            entry["queues"].add(queue)
+
+def live_unsubscribe(topics: list, queue: asyncio.Queue):
+    """Synchronous so it also completes when the stream is cancelled by a client disconnect."""
+    for topic in topics:
+        entry = live_topics.get(topic)
+        if entry is None:
+            continue
+        entry["queues"].discard(queue)
+        if not entry["queues"] and entry["listener"] is not None:
+            del live_topics[topic]
+            db_executor.submit(close_live_listener, entry)
+
+async def live_stream(topics: list, queue: asyncio.Queue):
+    try:
+        yield f"event: ready\ndata: {json.dumps({'topics': topics})}\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), LIVE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if message is LIVE_DROPPED:
+                yield "event: dropped\ndata: {}\n\n"
+                return
+            yield message
+    finally:
+        live_unsubscribe(topics, queue)
+
+@app.get("/live")
+async def live_updates(topics: str, token: Optional[str] = None, authorization: str = Header(None)):
+    """SSE stream of live changes. EventSource can't send headers, so the ID token may come as ?token=."""
+    user = await verify_token(authorization or (f"Bearer {token}" if token else None))
+    topic_list = list(dict.fromkeys(t.strip() for t in topics.split(',') if t.strip()))
+    if not topic_list:
+        raise HTTPException(status_code=400, detail="no topics")
+    for topic in topic_list:
+        live_topic_path(topic)
+        if topic.startswith('chats:'):
+            await require_chat_access(user, topic.partition(':')[2])
+    queue = asyncio.Queue(maxsize=LIVE_QUEUE_SIZE)
+    try:
+        await live_subscribe(topic_list, queue)
+    except Exception as e:
+        live_unsubscribe(topic_list, queue)
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(live_stream(topic_list, queue), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def get_live_metrics() -> dict:
+    return {
+        **live_stats,
+        "topics": {topic: len(entry["queues"]) for topic, entry in live_topics.items()}
+    }
+
+@app.on_event("shutdown")
+def close_live_listeners():
+    for entry in live_topics.values():
+        if entry["listener"] is not None:
+            close_live_listener(entry)
+    live_topics.clear()
+
+# ---------------------------------------------------------
+# 13. DIAGNOSTICS
+# ---------------------------------------------------------
+
+# Warm-up runs in the background after startup so the process is live at once;
+# /ready turns 200 when the required steps have succeeded. Each step runs on
+# its own, so one failure (say Firebase credentials on a sqlite deployment) is
+# recorded under "errors" without skipping the rest. Optional steps only save
+# time on the first requests, which otherwise initialise lazily.
+warm_up_state = {"ready": False, "started": None, "finished_ms": None, "steps": {}, "errors": {}}
+warm_up_task = None
+
+async def init_firebase():
+    await run_db("firebase.init", get_firebase)
+
+WARM_UP_STEPS = [
+    ("firebase", init_firebase),
+    ("token_certs", warm_token_certs),
+    ("storage", start_sync_worker),
+    ("batch_index", warm_batch_index),
+    ("growth_model", warm_growth_model),
+    ("presence", start_presence_listener),
+    ("reconcile", start_reconcile_worker),
+]
+# The data lives in SQLite on a sqlite deployment; Firebase is then only needed for auth
+WARM_UP_OPTIONAL = {"token_certs", "growth_model", "presence", "reconcile"} | ({"firebase"} if STORAGE_BACKEND == "sqlite" else set())
+
+async def warm_up():
+    started = time.perf_counter()
+    warm_up_state["started"] = get_ph_time()
+    for name, step in WARM_UP_STEPS:
+        step_start = time.perf_counter()
+        try:
+            await step()
+            warm_up_state["steps"][name] = round((time.perf_counter() - step_start) * 1000, 1)
+        except Exception as e:
+            warm_up_state["errors"][name] = str(e)
+            print(f"Warm-up step {name} failed: {e}")
+    warm_up_state["ready"] = all(name in warm_up_state["steps"] for name, _ in WARM_UP_STEPS if name not in WARM_UP_OPTIONAL)
+    warm_up_state["finished_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"Warm-up finished in {warm_up_state['finished_ms']} ms (ready={warm_up_state['ready']})")
+
+@app.on_event("startup")
+async def start_warm_up():
+    global warm_up_task
+    warm_up_task = asyncio.create_task(warm_up())
+
+@app.get("/health")
+async def health():
+    """Liveness: the process is up and serving."""
+    return {"status": "alive"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 503 until the warm-up's required steps have succeeded."""
+    return JSONResponse(status_code=200 if warm_up_state["ready"] else 503,
+                        content={"status": "ready" if warm_up_state["ready"] else "warming_up", **warm_up_state})
+
+# --- Request metrics (Prometheus text format on /metrics) ---
+# Every request gets a latency histogram entry under its route template plus
+# the number of Firebase reads/writes and bytes it caused. Requests slower than
+# SLOW_REQUEST_MS (0 disables) are printed with the RTDB paths they touched.
+# Scrapers authenticate with "Authorization: Bearer $METRICS_TOKEN" (ID tokens
+# expire hourly); /metrics is closed while METRICS_TOKEN is unset.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+route_metrics = {}  # (method, route) -> histogram, status counts and Firebase totals
+
+def record_request(method: str, route: str, status: int, elapsed: float, stats: dict):
+    entry = route_metrics.get((method, route))
+    if entry is None:
+        entry = route_metrics[(method, route)] = {
+            "buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0, "statuses": {},
+            "reads": 0, "writes": 0, "bytes_read": 0, "bytes_written": 0
+        }
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if elapsed <= bound:
+            entry["buckets"][i] += 1
+    entry["sum"] += elapsed
+    entry["count"] += 1
+    entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+    for key in ("reads", "writes", "bytes_read", "bytes_written"):
+        entry[key] += stats[key]
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    stats = {"reads": 0, "writes": 0, "bytes_read": 0, "bytes_written": 0, "paths": {}}
+    token = request_db_stats.set(stats)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        request_db_stats.reset(token)
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        record_request(request.method, route, status, elapsed, stats)
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            paths = ", ".join(f"{p} x{n}" if n > 1 else p for p, n in list(stats["paths"].items())[:20])
+            print(f"Slow request: {request.method} {request.url.path} {elapsed * 1000:.0f} ms, "
+                  f"{stats['reads']} reads ({stats['bytes_read']} B), {stats['writes']} writes ({stats['bytes_written']} B); "
+                  f"paths: {paths or '-'}")
+
+def prom_escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def prom_labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{prom_escape(v)}"' for k, v in labels.items()) + "}"
+
+def render_prometheus() -> str:
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples: list):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            lines.append(f"{name}{suffix}{prom_labels(**labels) if labels else ''} {value}")
+
+    routes = sorted(route_metrics.items())
+    histogram = []
+    for (method, route), entry in routes:
+        for bound, count in zip(LATENCY_BUCKETS, entry["buckets"]):
+            histogram.append(("_bucket", {"method": method, "route": route, "le": bound}, count))
+        histogram.append(("_bucket", {"method": method, "route": route, "le": "+Inf"}, entry["count"]))
+        histogram.append(("_sum", {"method": method, "route": route}, round(entry["sum"], 6)))
+        histogram.append(("_count", {"method": method, "route": route}, entry["count"]))
+    metric("http_request_duration_seconds", "histogram", "Request latency by route.", histogram)
+    metric("http_requests_total", "counter", "Requests by route and status.",
+           [("", {"method": m, "route": r, "status": code}, n)
+            for (m, r), entry in routes for code, n in sorted(entry["statuses"].items())])
+    for key, help_text in (("reads", "Firebase reads"), ("writes", "Firebase writes"),
+                           ("bytes_read", "Bytes read from Firebase"), ("bytes_written", "Bytes written to Firebase")):
+        metric(f"http_request_firebase_{key}_total", "counter", f"{help_text} while serving each route.",
+               [("", {"method": m, "route": r}, entry[key]) for (m, r), entry in routes])
+
+    db = get_db_metrics()
+    metric("firebase_operations_total", "counter", "Firebase calls by operation.",
+           [("", {"op": op}, stats["count"]) for op, stats in sorted(db["ops"].items())])
+    metric("firebase_operation_errors_total", "counter", "Failed Firebase calls by operation.",
+           [("", {"op": op}, stats["errors"]) for op, stats in sorted(db["ops"].items())])
+    metric("firebase_operation_seconds_total", "counter", "Time spent in Firebase calls by operation.",
+           [("", {"op": op}, round(stats["total_ms"] / 1000, 6)) for op, stats in sorted(db["ops"].items())])
+    metric("firebase_bytes_total", "counter", "Payload bytes transferred to and from Firebase (sampled estimate).",
+           [("", {"direction": d}, n) for d, n in sorted(db["bytes"].items())])
+    metric("firebase_pool_queued", "gauge", "Calls waiting for a DB worker thread.", [("", None, db["queued"])])
+    metric("firebase_pool_in_flight", "gauge", "Calls running on DB worker threads.", [("", None, db["in_flight"])])
+
+    tokens = get_token_cache_metrics()
+    metric("token_cache_entries", "gauge", "Verified ID tokens in the cache.", [("", None, tokens["size"])])
+    metric("token_cache_lookups_total", "counter", "ID token cache lookups by result.",
+           [("", {"result": "hit"}, tokens["hits"]), ("", {"result": "miss"}, tokens["misses"])])
+    metric("live_subscribers", "gauge", "Connected live-update clients per topic.",
+           [("", {"topic": t}, n) for t, n in sorted(get_live_metrics()["topics"].items())])
+    return "\n".join(lines) + "\n"
+
+async def require_admin(user: dict = Depends(verify_token)) -> dict:
+    if await user_field(user.get('uid'), 'role') != 'admin':
+        raise HTTPException(status_code=403, detail="Admins only")
+    return user
+
+async def require_metrics_token(authorization: str = Header(None)):
+    if not METRICS_TOKEN or not hmac.compare_digest((authorization or "").encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
+
+@app.get("/metrics")
+async def metrics(_: None = Depends(require_metrics_token)):
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/db-metrics")
+async def db_metrics_endpoint(user: dict = Depends(require_admin)):
+    """Per-operation Firebase latency and thread pool queue depth."""
+    return {**get_db_metrics(), "token_cache": get_token_cache_metrics(), "live": get_live_metrics(), "weather": weather_stats, "storage": get_sync_metrics()}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
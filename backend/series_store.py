@@ -0,0 +1,172 @@
+"""
+Columnar per-batch daily metrics for the analytics in main.py.
+
+A BatchSeries holds the daily figures of one batch as a (metrics x days)
+float64 array over dense day indices: column d is day first_day + d. It is
+built from the 'batch_series/{id}' node that the daily log endpoints keep, so
+nothing re-parses the date-keyed log dicts, and it packs into a compact
+binary snapshot (zlib-compressed little-endian float64, base64 text so it can
+live in the RTDB) that completed batches keep instead of being re-read.
+
+Query API:
+  series.range(first_day, last_day)   day window (a view, no copy)
+  series.downsample(every)            bucket sums (mean of weighed days for weight)
+  series.cumulative(metric)           running total of a flow metric
+  align(series_list, metric, ...)     batches x days matrix aligned on day 1
+"""
+import base64
+import struct
+import zlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+
+METRICS = ("mortality", "feedKg", "vitamins", "weight")
+FLOW_METRICS = ("mortality", "feedKg", "vitamins")  # summed over time; weight is a level
+
+SNAPSHOT_MAGIC = b"BSR1"
+SNAPSHOT_HEADER = struct.Struct("<4sHIiI")  # magic, metrics, days, start date ordinal (0 = none), first day
+
+
+def metric_row(metric: str) -> int:
+    try:
+        return METRICS.index(metric)
+    except ValueError:
+        raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+
+
+def node_column(value, days: int) -> np.ndarray:
+    """An RTDB array (list, or dict when sparse) as a zero-padded float64 column."""
+    column = np.zeros(days)
+    if isinstance(value, dict):
+        for key, v in value.items():
+            if int(key) < days:
+                column[int(key)] = v or 0
+    elif value:
+        values = np.asarray([v or 0 for v in value[:days]], dtype=np.float64)
+        column[:len(values)] = values
+    return column
+
+
+class BatchSeries:
+    __slots__ = ("batch_id", "start_date", "first_day", "values")
+
+    def __init__(self, batch_id: str, start_date: Optional[datetime], values: np.ndarray, first_day: int = 1):
+        self.batch_id = batch_id
+        self.start_date = start_date
+        self.first_day = first_day
+        self.values = values
+
+    @classmethod
+    def from_node(cls, batch_id: str, node: Optional[dict]) -> "BatchSeries":
+        node = node or {}
+        days = int(node.get("days") or 0)
+        try:
+            start_date = datetime.strptime(node.get("startDate"), "%Y-%m-%d")
+        except (TypeError, ValueError):
+            start_date = None
+        values = np.vstack([node_column(node.get(m), days) for m in METRICS]) if days else np.zeros((len(METRICS), 0))
+        return cls(batch_id, start_date, values)
+
+    @property
+    def days(self) -> int:
+        return self.values.shape[1]
+
+    @property
+    def last_day(self) -> int:
+        return self.first_day + self.days - 1
+
+    def metric(self, metric: str) -> np.ndarray:
+        return self.values[metric_row(metric)]
+
+    def cumulative(self, metric: str) -> np.ndarray:
+        if metric not in FLOW_METRICS:
+            raise ValueError(f"{metric} is not a cumulative metric")
+        return np.cumsum(self.metric(metric))
+
+    def date_of(self, day: int) -> Optional[str]:
+        if self.start_date is None:
+            return None
+        return (self.start_date + timedelta(days=day - 1)).strftime("%Y-%m-%d")
+
+    def range(self, first_day: int = 1, last_day: Optional[int] = None) -> "BatchSeries":
+        """Days first_day..last_day (inclusive, clipped to the data)."""
+        lo = max(first_day, self.first_day) - self.first_day
+        hi = (self.last_day if last_day is None else min(last_day, self.last_day)) - self.first_day + 1
+        hi = max(hi, lo)
+        return BatchSeries(self.batch_id, self.start_date, self.values[:, lo:hi], self.first_day + lo)
+
+    def downsample(self, every: int) -> np.ndarray:
+        """(metrics x buckets) of `every` days: flow metrics summed, weight averaged over weighed days."""
+        if every < 1:
+            raise ValueError("every must be at least 1")
+        if self.days == 0:
+            return np.zeros((len(METRICS), 0))
+        starts = np.arange(0, self.days, every)
+        sums = np.add.reduceat(self.values, starts, axis=1)
+        row = metric_row("weight")
+        weighed = np.add.reduceat((self.values[row] > 0).astype(np.float64), starts)
+        sums[row] = np.divide(sums[row], weighed, out=np.zeros_like(weighed), where=weighed > 0)
+        return sums
+
+    def to_dict(self, every: int = 1) -> dict:
+        values = self.values if every == 1 else self.downsample(every)
+        return {
+            "batchId": self.batch_id,
+            "startDate": self.start_date.strftime("%Y-%m-%d") if self.start_date else None,
+            "firstDay": self.first_day,
+            "every": every,
+            **{m: np.round(values[i], 3).tolist() for i, m in enumerate(METRICS)}
+        }
+
+    def pack(self) -> str:
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(METRICS), self.days,
+                                      self.start_date.toordinal() if self.start_date else 0, self.first_day)
+        body = np.ascontiguousarray(self.values, dtype="<f8").tobytes()
+        return base64.b64encode(zlib.compress(header + body)).decode("ascii")
+
+    @classmethod
+    def unpack(cls, batch_id: str, blob: str) -> "BatchSeries":
+        raw = zlib.decompress(base64.b64decode(blob))
+        magic, metrics, days, ordinal, first_day = SNAPSHOT_HEADER.unpack_from(raw)
+        if magic != SNAPSHOT_MAGIC or metrics != len(METRICS):
+            raise ValueError("unsupported series snapshot")
+        values = np.frombuffer(raw, dtype="<f8", offset=SNAPSHOT_HEADER.size).reshape(metrics, days)
+        return cls(batch_id, datetime.fromordinal(ordinal) if ordinal else None, values, first_day)
+
+
+def align(series_list: list, metric: str, first_day: int = 1, last_day: Optional[int] = None,
+          every: int = 1, cumulative: bool = False) -> np.ndarray:
+    """(batches x days) matrix of one metric aligned on batch day.
+
+    Cells past a batch's data (and unweighed days, for weight) are NaN. With
+    every > 1 the days are bucketed like BatchSeries.downsample; cumulative
+    buckets take their last value."""
+    if every < 1:
+        raise ValueError("every must be at least 1")
+    if last_day is None:
+        last_day = max((s.last_day for s in series_list), default=first_day - 1)
+    width = max(last_day - first_day + 1, 0)
+    matrix = np.full((len(series_list), width), np.nan)
+    for i, series in enumerate(series_list):
+        values = series.cumulative(metric) if cumulative else series.metric(metric)
+        window = BatchSeries(series.batch_id, series.start_date, values[None, :], series.first_day).range(first_day, last_day)
+        offset = window.first_day - first_day
+        matrix[i, offset:offset + window.days] = window.values[0]
+    if metric == "weight":
+        matrix[matrix == 0] = np.nan
+    if every == 1 or width == 0:
+        return matrix
+
+    starts = np.arange(0, width, every)
+    valid = ~np.isnan(matrix)
+    counts = np.add.reduceat(valid.astype(np.float64), starts, axis=1)
+    if cumulative:
+        buckets = np.fmax.reduceat(matrix, starts, axis=1)  # running totals never decrease
+    else:
+        buckets = np.add.reduceat(np.where(valid, matrix, 0), starts, axis=1)
+        if metric == "weight":
+            buckets = np.divide(buckets, counts, out=np.zeros_like(buckets), where=counts > 0)
+    buckets[counts == 0] = np.nan
+    return buckets
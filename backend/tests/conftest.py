@@ -0,0 +1,54 @@
+"""
+Test setup: the app runs on the SQLite store (STORAGE_BACKEND=sqlite) in a
+temporary file, so no Firebase project or credentials are needed.
+
+main.py reads its settings at import time, so the environment is set before
+the module is imported. The app's thread pool is shut down with the app, so
+one TestClient is shared by the whole session; tests that need their own data
+create their own batches.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+DATA_DIR = tempfile.mkdtemp(prefix="cnalon-tests-")
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(DATA_DIR, "test.sqlite3")
+os.environ.setdefault("SLOW_REQUEST_MS", "0")
+os.environ.setdefault("RECONCILE_INTERVAL_SECONDS", "0")  # tests run reconcile passes themselves
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+TEST_UID = "test-admin"
+AUTH = {"Authorization": "Bearer test-token"}
+batch_numbers = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    main.app.dependency_overrides[main.verify_token] = lambda: {"uid": TEST_UID, "exp": 9999999999}
+    with TestClient(main.app) as c:
+        main.db_ref(f"users/{TEST_UID}").set({"role": "admin", "status": "online", "fullName": "Test Admin"})
+        yield c
+    main.app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def make_batch(client):
+    """Creates a batch through the API and returns its id."""
+    def create(name=None, date_created="2026-01-01", population=1000, end="2026-02-15"):
+        name = name or f"Batch {next(batch_numbers)}"
+        response = client.post("/create-batch", headers=AUTH, json={
+            "batchName": name, "dateCreated": date_created,
+            "expectedCompleteDate": end, "startingPopulation": population
+        })
+        assert response.status_code == 200, response.text
+        matches = [b for b in client.get("/get-batches", headers=AUTH).json() if b.get("batchName") == name]
+        return matches[-1]["id"]
+
+    return create
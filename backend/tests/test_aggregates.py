@@ -0,0 +1,71 @@
+import main
+from conftest import AUTH
+
+
+def expense(batch_id, category, item, amount, quantity=1, purchase_count=1):
+    return {"batchId": batch_id, "category": category, "itemName": item, "amount": amount, "quantity": quantity,
+            "purchaseCount": purchase_count, "unit": "pc", "date": "2026-01-05"}
+
+
+def sale(batch_id, quantity, price):
+    return {"batchId": batch_id, "buyerName": "Ana", "address": "Town", "quantity": quantity,
+            "pricePerChicken": price, "dateOfPurchase": "2026-02-10"}
+
+
+def stored_children(bid, kind):
+    return main.db_ref(f"global_batches/{bid}/{kind}").get() or {}
+
+
+def seed(client, bid):
+    for row in (expense(bid, "Feed", "Starter", 1200, 2), expense(bid, "Vitamins", "Biotin/Niacin", 300, 4, 2),
+                expense(bid, "Medications", "Amprolium", 150, 1), expense(bid, "Feed", "Grower", 800)):
+        assert client.post("/add-expense", headers=AUTH, json=row).status_code == 200
+    for quantity, price in ((10, 180), (5, 175.5)):
+        assert client.post("/add-sale", headers=AUTH, json=sale(bid, quantity, price)).status_code == 200
+
+
+def test_incremental_totals_match_a_full_recompute(client, make_batch):
+    bid = make_batch()
+    seed(client, bid)
+    expenses, sales = stored_children(bid, "expenses"), stored_children(bid, "sales")
+    grower = next(k for k, e in expenses.items() if e["itemName"] == "Grower")
+    medication = next(k for k, e in expenses.items() if e["itemName"] == "Amprolium")
+    client.delete(f"/delete-expense/{bid}/{grower}", headers=AUTH)
+    client.delete(f"/delete-sale/{bid}/{next(iter(sales))}", headers=AUTH)
+    assert client.patch("/update-expense-category", headers=AUTH, json={
+        "batchId": bid, "expenseId": medication, "category": "Vitamins", "feedType": ""}).status_code == 200
+
+    stored = main.db_ref(f"batch_aggregates/{bid}").get()
+    rebuilt = main.compute_batch_aggregates(stored_children(bid, "expenses"), stored_children(bid, "sales"))
+    assert main.aggregate_drift(stored, rebuilt) == {}
+    assert stored["expenseCount"] == 3 and stored["salesCount"] == 1
+
+    summary = client.get(f"/batch-summary/{bid}", headers=AUTH).json()
+    assert summary == main.format_batch_summary(bid, rebuilt)
+    assert summary["expenseTotal"] == 1650 and summary["purchaseTotal"] == 1200 + 600 + 150
+    assert summary["spendByCategory"] == {"Feed": 1200, "Vitamins": 450}
+    assert summary["vitaminQuantity"] == {"Biotin/Niacin": 8, "Amprolium": 1}
+    assert summary["netProfit"] == round(summary["salesRevenue"] - 1650, 2)
+
+
+def test_reconcile_finds_and_repairs_drift(client, make_batch):
+    bid = make_batch()
+    seed(client, bid)
+    actual = main.db_ref(f"batch_aggregates/{bid}").get()
+    main.db_ref(f"batch_aggregates/{bid}/expenseTotal").set(1)
+    main.db_ref(f"batch_aggregates/{bid}/spendByCategory/Feed").delete()
+
+    report = client.post(f"/reconcile-aggregates?batch_id={bid}", headers=AUTH).json()
+    assert report["drifted"] == 1
+    assert report["drift"][bid] == {"expenseTotal": {"stored": 1, "actual": actual["expenseTotal"]},
+                                    "spendByCategory/Feed": {"stored": 0, "actual": 2000}}
+    assert main.aggregate_drift(main.db_ref(f"batch_aggregates/{bid}").get(), actual) == {}
+    assert client.post(f"/reconcile-aggregates?batch_id={bid}", headers=AUTH).json()["drifted"] == 0
+
+
+def test_summary_builds_missing_aggregates(client, make_batch):
+    bid = make_batch()
+    seed(client, bid)
+    main.db_ref(f"batch_aggregates/{bid}").delete()
+    assert client.get(f"/batch-summary/{bid}", headers=AUTH).json()["expenseCount"] == 4
+    assert main.db_ref(f"batch_aggregates/{bid}/expenseCount").get() == 4
@@ -0,0 +1,114 @@
+import asyncio
+
+import main
+from conftest import AUTH
+
+
+def batch_index():
+    return main.db_ref("batch_index").get() or {}
+
+
+def test_index_mirrors_summary_fields(client, make_batch):
+    bid = make_batch(population=750)
+    batch = main.db_ref(f"global_batches/{bid}").get()
+    summary = batch_index()[bid]
+    assert summary == main.batch_summary(batch)
+    assert "feedForecast" not in summary and "weightForecast" not in summary
+
+
+def test_projected_batch_list_comes_from_the_index(client, make_batch):
+    bid = make_batch(name="Projected")
+    rows = client.get("/get-batches?fields=batchName,status", headers=AUTH).json()
+    row = next(r for r in rows if r["id"] == bid)
+    assert set(row) == {"id", "batchName", "status"}
+    assert row["batchName"] == "Projected"
+
+    # fields outside the index are projected per batch
+    rows = client.get("/get-batches?fields=batchName,feedForecast", headers=AUTH).json()
+    assert next(r for r in rows if r["id"] == bid)["feedForecast"]
+
+
+def test_status_query_uses_the_index(client, make_batch):
+    make_batch()
+    active = asyncio.run(main.get_batches_by_status("active"))
+    assert len(active) == 1
+    assert all(s["status"] == "active" for s in active.values())
+
+
+def test_lifecycle_keeps_one_active_batch(client, make_batch):
+    first = make_batch()
+    oldest = make_batch(date_created="2020-01-01")
+    assert client.put(f"/update-batch/{first}", headers=AUTH, json={"status": "active"}).status_code == 200
+    index = batch_index()
+    assert index[first]["status"] == "active"
+    assert [b for b, s in index.items() if s["status"] == "active"] == [first]
+
+    assert client.put(f"/update-batch/{first}", headers=AUTH, json={"status": "completed"}).status_code == 200
+    index = batch_index()
+    assert index[first]["status"] == "completed"
+    assert index[oldest]["status"] == "active"
+    assert main.db_ref(f"global_batches/{oldest}/status").get() == "active"
+    assert main.db_ref("batch_meta/active_batch/id").get() == oldest
+
+    assert client.delete(f"/delete-batch/{oldest}", headers=AUTH).status_code == 200
+    assert oldest not in batch_index()
+    assert main.db_ref(f"global_batches/{oldest}").get() is None
+    assert main.db_ref("batch_meta/active_batch/id").get() != oldest
+
+
+def test_backfill_indexes_batches_written_directly(client):
+    bid = main.generate_push_id()
+    main.db_ref(f"global_batches/{bid}").set({"batchName": "Direct", "status": "inactive",
+                                              "dateCreated": "2026-03-01", "feed_logs": {"2026-03-01": {"am": 1}}})
+    asyncio.run(main.ensure_batch_index())
+    assert batch_index()[bid] == {"batchName": "Direct", "status": "inactive", "dateCreated": "2026-03-01"}
+
+    main.db_ref(f"global_batches/{bid}").delete()
+    asyncio.run(main.ensure_batch_index())
+    assert bid not in batch_index()
+
+
+def test_pointer_initialisation_races_with_transitions(client, make_batch):
+    for _ in range(3):
+        make_batch()
+    main.db_ref("batch_meta").delete()
+    created = [main.generate_push_id() for _ in range(8)]
+    for bid in created:
+        # as /create-batch leaves them just before their transition
+        batch = {"batchName": f"Race {bid}", "dateCreated": "2026-06-01", "startingPopulation": 1000}
+        main.db_ref(f"global_batches/{bid}").set(batch)
+        main.db_ref(f"batch_index/{bid}").set(main.batch_summary(batch))
+
+    async def scenario():
+        await asyncio.gather(main.ensure_batch_meta(),
+                             *(main.transition_batch(bid, 'auto', "2026-06-01") for bid in created))
+
+    client.portal.call(scenario)
+    meta = main.db_ref("batch_meta").get()
+    rotation = [meta["active_batch"]["id"], *meta["inactive_queue"]]
+    index = batch_index()
+    assert meta["initialized"] is True
+    assert sorted(rotation) == sorted(b for b, s in index.items() if s.get("status") in ("active", "inactive"))
+    assert set(created) <= set(rotation)
+    assert [b for b, s in index.items() if s.get("status") == "active"] == [meta["active_batch"]["id"]]
+
+    # a second run leaves an initialised pointer alone
+    client.portal.call(main.ensure_batch_meta)
+    assert main.db_ref("batch_meta").get() == meta
+
+
+def test_backfill_keeps_a_batch_created_mid_run(client, monkeypatch):
+    bid = main.generate_push_id()
+    batch = {"batchName": "Mid-run", "status": "completed", "dateCreated": "2026-04-01"}
+    read = main.db_get
+
+    async def create_after_first_listing(path, shallow=False):
+        value = await read(path, shallow)
+        if shallow and main.db_ref(f"global_batches/{bid}").get() is None:
+            # /create-batch writes both nodes in one update
+            main.db_ref("/").update({f"global_batches/{bid}": batch, f"batch_index/{bid}": main.batch_summary(batch)})
+        return value
+
+    monkeypatch.setattr(main, "db_get", create_after_first_listing)
+    client.portal.call(main.ensure_batch_index)
+    assert batch_index()[bid] == main.batch_summary(batch)
@@ -0,0 +1,100 @@
+import main
+from conftest import AUTH
+
+
+def expense(batch_id, amount, **extra):
+    return {"batchId": batch_id, "category": "Feed", "itemName": "Starter", "amount": amount,
+            "quantity": 1, "unit": "sack", "date": "2026-01-02", **extra}
+
+
+def test_bulk_expenses_report_per_row_results(client, make_batch):
+    bid = make_batch()
+    rows = [expense(bid, 100, id="exp-a"), expense(bid, 50), {"batchId": bid, "amount": "x"},
+            expense("no-such-batch", 10), expense(bid, 25, id="bad/id")]
+    body = client.post("/bulk-add-expenses", headers=AUTH, json={"rows": rows}).json()
+    assert [r["status"] for r in body["results"]] == ["created", "created", "error", "error", "error"]
+    assert body["results"][0]["id"] == "exp-a"
+    assert body["results"][3]["detail"] == "batch not found"
+    assert body["counts"] == {"created": 2, "error": 3}
+
+    stored = main.db_ref(f"global_batches/{bid}/expenses").get()
+    assert set(stored) == {"exp-a", body["results"][1]["id"]}
+    summary = client.get(f"/batch-summary/{bid}", headers=AUTH).json()
+    assert (summary["expenseTotal"], summary["expenseCount"]) == (150, 2)
+
+
+def test_retried_import_is_idempotent(client, make_batch):
+    bid = make_batch()
+    rows = [expense(bid, 10 * i, id=f"retry-{i}") for i in range(5)]
+    assert client.post("/bulk-add-expenses", headers=AUTH, json={"rows": rows[:3]}).json()["counts"] == {"created": 3}
+    body = client.post("/bulk-add-expenses", headers=AUTH, json={"rows": rows}).json()
+    assert body["counts"] == {"duplicate": 3, "created": 2}
+    summary = client.get(f"/batch-summary/{bid}", headers=AUTH).json()
+    assert (summary["expenseTotal"], summary["expenseCount"]) == (100, 5)
+
+
+def test_bulk_sales_compute_totals(client, make_batch):
+    bid = make_batch()
+    rows = [{"batchId": bid, "buyerName": "Ana", "address": "Town", "quantity": 10,
+             "pricePerChicken": 180, "dateOfPurchase": "2026-02-10"}] * 2
+    assert client.post("/bulk-add-sales", headers=AUTH, json={"rows": rows}).json()["counts"] == {"created": 2}
+    sales = main.db_ref(f"global_batches/{bid}/sales").get()
+    assert [s["totalAmount"] for s in sales.values()] == [1800, 1800]
+    assert client.get(f"/batch-summary/{bid}", headers=AUTH).json()["salesRevenue"] == 3600
+
+
+def test_import_is_chunked(client, make_batch, monkeypatch):
+    monkeypatch.setattr(main, "IMPORT_CHUNK_ROWS", 7)
+    bid = make_batch()
+    updates_before = main.db_metrics["ops"].get("update", {}).get("count", 0)
+    body = client.post("/bulk-add-expenses", headers=AUTH, json={"rows": [expense(bid, 1) for _ in range(30)]}).json()
+    assert body["counts"] == {"created": 30}
+    assert len(main.db_ref(f"global_batches/{bid}/expenses").get(shallow=True)) == 30
+    assert main.db_metrics["ops"]["update"]["count"] - updates_before >= 5
+
+
+def test_empty_and_oversized_imports_are_rejected(client, monkeypatch):
+    assert client.post("/bulk-add-expenses", headers=AUTH, json={"rows": []}).status_code == 400
+    monkeypatch.setattr(main, "IMPORT_MAX_ROWS", 2)
+    response = client.post("/bulk-add-sales", headers=AUTH, json={"rows": [{}] * 3})
+    assert (response.status_code, response.json()["detail"]) == (400, "at most 2 rows per import")
+
+
+def test_bulk_daily_logs_upsert_and_index(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    rows = [
+        {"batchId": bid, "kind": "feed_logs", "date": "2026-01-03", "am": 5, "pm": 4.5},
+        {"batchId": bid, "kind": "mortality_logs", "date": "2026-01-03", "am": 2, "pm": 1},
+        {"batchId": bid, "kind": "weight_logs", "date": "2026-01-04", "day": 4, "averageWeight": 110},
+        {"batchId": bid, "kind": "eggs", "date": "2026-01-03"},
+        {"batchId": bid, "kind": "feed_logs", "date": "03/01/2026", "am": 1},
+    ]
+    body = client.post("/bulk-add-daily-logs", headers=AUTH, json={"rows": rows}).json()
+    assert [r["status"] for r in body["results"]] == ["written", "written", "written", "error", "error"]
+    assert body["results"][0]["day"] == 3
+
+    assert main.db_ref(f"global_batches/{bid}/feed_logs/2026-01-03/am").get() == 5
+    series = client.get(f"/batch-series/{bid}", headers=AUTH).json()
+    assert series["feedKg"][2] == 9.5 and series["mortality"][2] == 3
+    records = client.get(f"/get-all-records?batch_id={bid}", headers=AUTH).json()
+    assert {r["type"] for r in records} == {"Feed", "Mortality", "Weight"}
+
+
+def test_bulk_rows_merge_into_the_day(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    client.post("/add-daily-log", headers=AUTH, json={"batchId": bid, "kind": "feed_logs", "date": "2026-01-02", "am": 4})
+    rows = [
+        {"batchId": bid, "kind": "mortality_logs", "date": "2026-01-03", "am": 2},
+        {"batchId": bid, "kind": "mortality_logs", "date": "2026-01-03", "pm": 1},
+        {"batchId": bid, "kind": "feed_logs", "date": "2026-01-02", "pm": 3.5},
+        {"batchId": bid, "kind": "weight_logs", "date": "2026-01-05", "day": 40, "averageWeight": 150},
+    ]
+    body = client.post("/bulk-add-daily-logs", headers=AUTH, json={"rows": rows}).json()
+    assert body["counts"] == {"written": 4}
+
+    logs = main.db_ref(f"global_batches/{bid}").get()
+    assert (logs["mortality_logs"]["2026-01-03"]["am"], logs["mortality_logs"]["2026-01-03"]["pm"]) == (2, 1)
+    assert (logs["feed_logs"]["2026-01-02"]["am"], logs["feed_logs"]["2026-01-02"]["pm"]) == (4, 3.5)
+    assert logs["weight_logs"]["2026-01-05"]["day"] == 5
+    series = client.get(f"/batch-series/{bid}", headers=AUTH).json()
+    assert series["mortality"][2] == 3 and series["feedKg"][1] == 7.5 and series["latestWeightDay"] == 5
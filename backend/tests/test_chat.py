@@ -0,0 +1,23 @@
+import main
+from conftest import AUTH
+
+
+def test_broadcast_reads_users_once_when_presence_is_cold(client, monkeypatch):
+    main.db_ref("users/bc-online").set({"role": "user", "status": "online"})
+    main.db_ref("users/bc-offline").set({"role": "user", "status": "offline"})
+    monkeypatch.setitem(main.presence_state, "primed", False)
+    reads, read = [], main.db_get
+
+    async def counting_get(path, shallow=False):
+        reads.append(path)
+        return await read(path, shallow)
+
+    monkeypatch.setattr(main, "db_get", counting_get)
+    response = client.post("/admin-broadcast-message", headers=AUTH,
+                           json={"text": "Vaccination at 8", "recipientUids": ["bc-online", "bc-offline"]})
+    assert response.json() == {"status": "success", "recipients": 2}
+    assert [p for p in reads if p.startswith("users")] == ["users/test-admin/role", "users"]
+
+    statuses = {uid: [m["status"] for m in (main.db_ref(f"chats/{uid}").get() or {}).values()]
+                for uid in ("bc-online", "bc-offline")}
+    assert statuses == {"bc-online": ["delivered"], "bc-offline": ["sent"]}
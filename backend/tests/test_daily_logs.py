@@ -0,0 +1,106 @@
+import main
+from conftest import AUTH
+
+
+def post(client, path, **body):
+    return client.post(path, headers=AUTH, json=body)
+
+
+def test_am_and_pm_merge_into_one_day(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    assert post(client, "/add-daily-log", batchId=bid, kind="feed_logs", date="2026-01-03", am=2.5).json()["day"] == 3
+    log = post(client, "/add-daily-log", batchId=bid, kind="feed_logs", date="2026-01-03", pm=1.5).json()["log"]
+    assert (log["am"], log["pm"]) == (2.5, 1.5)
+
+    series = client.get(f"/batch-series/{bid}", headers=AUTH).json()
+    assert series["feedKg"] == [0, 0, 4.0]
+    assert series["cumFeedKg"][-1] == 4.0
+
+
+def test_series_totals_follow_writes_and_deletes(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    post(client, "/add-daily-log", batchId=bid, kind="mortality_logs", date="2026-01-01", am=2, pm=1)
+    post(client, "/add-daily-log", batchId=bid, kind="mortality_logs", date="2026-01-04", am=1)
+    post(client, "/add-weight-log", batchId=bid, date="2026-01-05", day=5, averageWeight=120)
+    post(client, "/add-weight-log", batchId=bid, date="2026-01-08", day=8, averageWeight=200)
+    node = main.db_ref(f"batch_series/{bid}").get()
+    assert (node["totalMortality"], node["latestWeight"], node["latestWeightDay"]) == (4, 200, 8)
+
+    assert post(client, "/delete-weight-log", batchId=bid, date="2026-01-08").status_code == 200
+    node = main.db_ref(f"batch_series/{bid}").get()
+    assert (node["latestWeight"], node["latestWeightDay"]) == (120, 5)
+    assert main.db_ref(f"global_batches/{bid}/weight_logs/2026-01-08").get() is None
+
+
+def test_vitamin_doses_count_towards_the_day(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    body = post(client, "/add-vitamin-log", batchId=bid, day=2, vitaminName="VitC", actualAmount=3).json()
+    assert body["log"]["doses"] == {"VitC": 3}
+    assert client.get(f"/batch-series/{bid}", headers=AUTH).json()["vitamins"][1] == 3
+
+
+def test_dates_outside_the_batch_are_rejected(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    response = post(client, "/add-daily-log", batchId=bid, kind="feed_logs", date="2025-12-31", am=1)
+    assert response.status_code == 400
+    assert main.db_ref(f"global_batches/{bid}/feed_logs").get() is None
+
+
+def test_records_feed_follows_log_writes(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    post(client, "/add-daily-log", batchId=bid, kind="feed_logs", date="2026-01-02", am=3, pm=2)
+    records = client.get(f"/get-all-records?batch_id={bid}", headers=AUTH).json()
+    assert [(r["type"], r["date"]) for r in records] == [("Feed", "2026-01-02")]
+    assert records[0]["subtitle"].endswith("5.0 kg")
+
+
+def test_legacy_log_outside_the_series_can_be_deleted(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    post(client, "/add-weight-log", batchId=bid, date="2026-01-05", day=5, averageWeight=120)
+    # written before the series existed, dated before the batch started
+    main.db_ref(f"global_batches/{bid}/weight_logs/2025-12-20").set({"averageWeight": 90, "day": -11})
+
+    assert post(client, "/delete-weight-log", batchId=bid, date="2025-12-20").status_code == 200
+    assert main.db_ref(f"global_batches/{bid}/weight_logs/2025-12-20").get() is None
+    assert main.db_ref(f"batch_series/{bid}/latestWeight").get() == 120
+
+
+def test_fractional_mortality_is_rejected(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    response = post(client, "/add-daily-log", batchId=bid, kind="mortality_logs", date="2026-01-02", am=1.5)
+    assert response.status_code == 400
+    assert post(client, "/add-daily-log", batchId=bid, kind="mortality_logs", date="2026-01-02", am=2.0).json()["log"]["am"] == 2
+
+
+def test_direct_log_edit_reaches_the_feed_after_a_reconcile_pass(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    client.put(f"/update-batch/{bid}", headers=AUTH, json={"status": "active"})
+    post(client, "/add-weight-log", batchId=bid, date="2026-01-03", day=3, averageWeight=3.0)
+    assert client.post("/rebuild-records-index", headers=AUTH).status_code == 200
+
+    # the mobile app edits the entry in place: the log count does not move
+    main.db_ref(f"global_batches/{bid}/weight_logs/2026-01-03/averageWeight").set(99)
+    shallow_reads = main.db_metrics["ops"].get("get_shallow", {}).get("count", 0)
+    page = client.get(f"/get-all-records?batch_id={bid}&limit=10", headers=AUTH).json()
+    assert main.db_metrics["ops"].get("get_shallow", {}).get("count", 0) == shallow_reads
+    assert [r["subtitle"] for r in page["records"] if r["type"] == "Weight"] == ["Average Weight: 3.0 g"]
+
+    assert bid in client.portal.call(main.reconcile_active_batches)
+    page = client.get(f"/get-all-records?batch_id={bid}&limit=10", headers=AUTH).json()
+    assert [r["subtitle"] for r in page["records"] if r["type"] == "Weight"] == ["Average Weight: 99 g"]
+    assert client.portal.call(main.reconcile_active_batches) == {}
+
+
+def test_direct_log_write_reaches_the_series(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    client.put(f"/update-batch/{bid}", headers=AUTH, json={"status": "active"})
+    main.db_ref(f"batch_series/{bid}").delete()
+    post(client, "/add-daily-log", batchId=bid, kind="feed_logs", date="2026-01-01", am=10)
+    main.db_ref(f"global_batches/{bid}/feed_logs/2026-01-02").set({"am": 6, "pm": 2, "timestamp": 1})
+    main.db_ref(f"global_batches/{bid}/feed_logs/2026-01-01/am").set(12)
+    assert client.get(f"/batch-series/{bid}", headers=AUTH).json()["feedKg"] == [10]
+
+    assert client.portal.call(main.reconcile_active_batches)[bid]["series"] is True
+    series = client.get(f"/batch-series/{bid}", headers=AUTH).json()
+    assert series["feedKg"][:2] == [12, 8] and series["totalFeedKg"] == 20
+    assert bid not in client.portal.call(main.reconcile_active_batches)
@@ -0,0 +1,79 @@
+import asyncio
+import itertools
+import time
+
+import main
+from conftest import AUTH
+
+
+def test_blocking_call_does_not_stall_the_loop(client):
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await main.run_db("test.sleep", time.sleep, 0.2)
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(scenario()) >= 10
+
+
+def test_concurrent_calls_overlap_on_the_pool(client):
+    async def scenario():
+        start = time.perf_counter()
+        await asyncio.gather(*(main.run_db("test.sleep", time.sleep, 0.1) for _ in range(8)))
+        return time.perf_counter() - start
+
+    assert asyncio.run(scenario()) < 0.5
+
+
+def test_calls_are_recorded_per_operation(client):
+    async def failing():
+        try:
+            await main.run_db("test.fail", lambda: 1 / 0)
+        except ZeroDivisionError:
+            pass
+
+    asyncio.run(failing())
+    assert client.get("/get-batches", headers=AUTH).status_code == 200
+
+    metrics = client.get("/db-metrics", headers=AUTH).json()
+    assert metrics["ops"]["get"]["count"] >= 1
+    assert metrics["ops"]["test.fail"]["errors"] >= 1
+    assert metrics["queued"] == 0 and metrics["in_flight"] == 0
+    assert "max_queue_depth" in metrics
+
+
+def test_request_metrics_count_db_reads(client, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "scrape-secret")
+    client.get("/get-batches", headers=AUTH)
+    text = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"}).text
+    assert 'http_request_firebase_reads_total{method="GET",route="/get-batches"}' in text
+    assert "firebase_pool_queued" in text
+
+
+def test_metrics_need_the_scrape_token(client, monkeypatch):
+    assert client.get("/metrics", headers=AUTH).status_code == 403
+    monkeypatch.setattr(main, "METRICS_TOKEN", "scrape-secret")
+    assert client.get("/metrics", headers=AUTH).status_code == 403
+    assert client.get("/metrics", headers={"Authorization": "Bearer scrape-secrets"}).status_code == 403
+
+
+def test_db_metrics_are_admin_only(client, monkeypatch):
+    main.db_ref("users/plain-user").set({"role": "user", "status": "offline"})
+    monkeypatch.setitem(main.app.dependency_overrides, main.verify_token, lambda: {"uid": "plain-user"})
+    assert client.get("/db-metrics", headers=AUTH).status_code == 403
+
+
+def test_payload_sizes_are_sampled(monkeypatch):
+    monkeypatch.setattr(main, "PAYLOAD_SIZE_SAMPLE_EVERY", 4)
+    monkeypatch.setattr(main, "payload_calls", itertools.count())
+    value = {"am": 1.5, "pm": 2}
+    sizes = [main.payload_size(value) for _ in range(8)]
+    assert sizes.count(0) == 6 and sum(sizes) == 8 * len(main.dump_json(value))
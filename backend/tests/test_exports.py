@@ -0,0 +1,60 @@
+import csv
+import io
+import json
+
+import main
+from conftest import AUTH
+
+
+def seed_expenses(batch_id: str, count: int) -> list:
+    ids = [f"exp-{i:05d}" for i in range(count)]
+    main.db_ref(f"global_batches/{batch_id}/expenses").set({
+        eid: {"category": "Feed", "itemName": f"Sack {i}", "amount": float(i), "quantity": 1.0,
+              "unit": "sack", "date": "2026-01-02", "timestamp": i}
+        for i, eid in enumerate(ids)
+    })
+    return ids
+
+
+def test_ndjson_export_pages_through_every_row(client, make_batch, monkeypatch):
+    monkeypatch.setattr(main, "EXPORT_CHUNK_SIZE", 100)
+    bid = make_batch()
+    ids = seed_expenses(bid, 345)
+    response = client.get(f"/export-expenses/{bid}?format=ndjson", headers=AUTH)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["id"] for r in rows] == ids
+    assert rows[7]["itemName"] == "Sack 7"
+
+
+def test_csv_export_has_fixed_columns(client, make_batch):
+    bid = make_batch()
+    seed_expenses(bid, 3)
+    response = client.get(f"/export-expenses/{bid}?format=csv", headers=AUTH)
+    assert response.headers["content-disposition"] == f'attachment; filename="expenses-{bid}.csv"'
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert list(rows[0]) == main.EXPENSE_COLUMNS
+    assert [r["id"] for r in rows] == ["exp-00000", "exp-00001", "exp-00002"]
+
+
+def test_empty_export(client, make_batch):
+    bid = make_batch()
+    assert client.get(f"/export-sales/{bid}", headers=AUTH).text == ""
+    assert client.get(f"/export-sales/{bid}?format=csv", headers=AUTH).text.strip() == ",".join(main.SALE_COLUMNS)
+
+
+def test_records_export_matches_the_feed(client, make_batch):
+    bid = make_batch()
+    for day in range(1, 4):
+        client.post("/add-daily-log", headers=AUTH, json={"batchId": bid, "kind": "feed_logs",
+                                                          "date": f"2026-01-0{day}", "am": day})
+    feed = client.get(f"/get-all-records?batch_id={bid}", headers=AUTH).json()
+    exported = client.get(f"/export-records?batch_id={bid}", headers=AUTH).text.splitlines()
+    assert [json.loads(line)["id"] for line in exported] == [r["id"] for r in feed]
+    assert len(feed) == 3
+
+
+def test_unknown_format_is_rejected(client, make_batch):
+    bid = make_batch()
+    assert client.get(f"/export-expenses/{bid}?format=xml", headers=AUTH).status_code == 400
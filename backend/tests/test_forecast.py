@@ -0,0 +1,148 @@
+import random
+
+import numpy as np
+import pytest
+
+import main
+from conftest import AUTH
+
+
+@pytest.mark.parametrize("population,start_weight", [(1, 50.0), (1000, 50.0), (2500, 42.5), (12345, 61.3)])
+def test_vectorised_forecast_matches_the_scalar_loop(population, start_weight):
+    feed = main.generate_forecast_data(population)
+    weight = main.generate_weight_forecast(start_weight, population, feed)
+    assert main.compute_forecast(population, start_weight) == (feed, weight)
+
+
+def test_batched_call_matches_one_call_per_batch():
+    rng = random.Random(3)
+    populations = [rng.randint(100, 20000) for _ in range(200)]
+    start_weights = [rng.uniform(35, 60) for _ in range(200)]
+    forecast = main.forecast_batches(populations, start_weights)
+    assert forecast["avgWeight"].shape == (200, main.DEFAULT_CYCLE_DAYS)
+    for i in (0, 57, 199):
+        feed = main.generate_forecast_data(populations[i])
+        assert main.forecast_rows(forecast, i) == (feed, main.generate_weight_forecast(start_weights[i], populations[i], feed))
+
+
+def test_longer_cycle_repeats_the_last_stage():
+    feed, weight = main.compute_forecast(1000, cycle_days=45)
+    assert len(feed) == 45
+    assert feed[:30] == main.generate_forecast_data(1000)
+    assert {row["feedType"] for row in feed[30:]} == {"Finisher"}
+    assert {row["gramsPerBird"] for row in feed[30:]} == {170.0}
+    assert weight[-1]["day"] == "Day 45"
+
+
+def test_shorter_cycle_truncates():
+    feed, weight = main.compute_forecast(1000, cycle_days=20)
+    assert feed == main.generate_forecast_data(1000)[:20]
+    assert weight == main.generate_weight_forecast(50.0, 1000, main.generate_forecast_data(1000))[:7]
+
+
+def test_weights_grow_monotonically():
+    forecast = main.forecast_batches([1000, 2000], [50.0, 45.0], cycle_days=60)
+    assert np.all(np.diff(forecast["avgWeight"], axis=1) > 0)
+
+
+def test_stale_trend_reader_does_not_recache(client, make_batch, monkeypatch):
+    bid = make_batch()
+    client.portal.call(main.get_vitamin_trends)
+    read = main.db_get
+
+    async def invalidated_mid_read(path, shallow=False):
+        value = await read(path, shallow)
+        if path == 'vitamin_usage':
+            await main.refresh_vitamin_usage(bid)
+        return value
+
+    main.db_ref('vitamin_trends').delete()
+    monkeypatch.setattr(main, "db_get", invalidated_mid_read)
+    client.portal.call(main.get_vitamin_trends)
+    assert "json" not in main.db_ref('vitamin_trends').get()
+
+    monkeypatch.setattr(main, "db_get", read)
+    client.portal.call(main.get_vitamin_trends)
+    assert "json" in main.db_ref('vitamin_trends').get()
+
+
+def test_unknown_trend_model_is_rejected(client):
+    assert client.get("/get-vitamin-monthly-forecast?model=holt", headers=AUTH).status_code == 200
+    assert client.get("/get-vitamin-monthly-forecast?model=holt-winters", headers=AUTH).status_code == 422
+    with pytest.raises(ValueError):
+        main.monthly_trend([1.0, 2.0, 3.0], "quadratic")
+
+
+def test_monthly_rollup_matches_a_direct_sum(client, make_batch):
+    client.get("/get-vitamin-monthly-forecast", headers=AUTH)  # builds the rollup once
+    january = [make_batch(date_created="2031-01-30"), make_batch(date_created="2031-01-31")]
+    february = make_batch(date_created="2031-02-01")
+    doses = {january[0]: [("Biotin", 3, 2), ("Vit.C", 1.5, 1)], january[1]: [("Biotin", 2, 1)],
+             february: [("Vit.C", 4, 3), ("Biotin", 1, 1)]}
+    for bid, items in doses.items():
+        client.put(f"/update-batch/{bid}", headers=AUTH, json={"status": "completed"})
+        for item, quantity, count in items:
+            client.post("/add-expense", headers=AUTH, json={
+                "batchId": bid, "category": "Vitamins", "itemName": item, "amount": 100, "quantity": quantity,
+                "purchaseCount": count, "unit": "pack", "date": "2031-02-02"})
+        client.post("/add-expense", headers=AUTH, json={
+            "batchId": bid, "category": "Feed", "itemName": "Starter", "amount": 900, "quantity": 1, "unit": "sack",
+            "date": "2031-02-02"})
+    # one batch moves across the month boundary
+    client.put(f"/update-batch/{january[1]}", headers=AUTH, json={"dateCreated": "2031-02-03"})
+
+    def direct_sum(month):
+        totals = {}
+        for bid, summary in main.db_ref("batch_index").get().items():
+            if main.rollup_month(summary) != month:
+                continue
+            for e in (main.db_ref(f"global_batches/{bid}/expenses").get() or {}).values():
+                if e["category"] in main.VITAMIN_CATEGORIES:
+                    totals[e["itemName"]] = totals.get(e["itemName"], 0) + e["quantity"] * e.get("purchaseCount", 1)
+        return totals
+
+    rollup = main.db_ref("vitamin_monthly").get()
+    for month, batches in (("2031-01", {january[0]}), ("2031-02", {february, january[1]})):
+        vitamins = {main.decode_db_key(k): v for k, v in rollup[month]["vitamins"].items()}
+        assert vitamins == pytest.approx(direct_sum(month))
+        assert set(rollup[month]["batches"]) == batches
+    assert direct_sum("2031-01") == {"Biotin": 6, "Vit.C": 1.5}
+
+    client.portal.call(main.rebuild_vitamin_rollup)
+    rebuilt = main.db_ref("vitamin_monthly").get()
+    assert {m: rebuilt[m] for m in ("2031-01", "2031-02")} == {m: rollup[m] for m in ("2031-01", "2031-02")}
+
+
+def test_cached_feed_forecast_is_not_recomputed_or_rewritten(client, make_batch, monkeypatch):
+    bid = make_batch(population=4321)
+    first = client.get(f"/get-feed-forecast/{bid}", headers=AUTH)
+    assert first.status_code == 200
+    assert main.db_ref(f'global_batches/{bid}/feedForecastHash').get()
+
+    computed, writes = [], []
+    compute = main.compute_forecast
+    monkeypatch.setattr(main, "compute_forecast", lambda *args, **kwargs: computed.append(args) or compute(*args, **kwargs))
+    for name in ("db_set", "db_update", "db_push", "db_delete", "db_transaction"):
+        def spy(path, *args, _write=getattr(main, name), _name=name):
+            if bid in path:
+                writes.append((_name, path))
+            return _write(path, *args)
+        monkeypatch.setattr(main, name, spy)
+
+    second = client.get(f"/get-feed-forecast/{bid}", headers=AUTH)
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert computed == []
+    # Background warm-up may touch shared nodes; only this batch's writes count
+    assert writes == []
+
+
+def test_forecast_tables_follow_template_edits():
+    template = [(range(1, 11), 20, "Starter"), (range(11, 31), 80, "Grower")]
+    first = main.get_forecast_tables(template=template)
+    assert main.get_forecast_tables(template=list(template)) is first
+
+    template[0] = (range(1, 11), 25, "Starter")
+    edited = main.get_forecast_tables(template=template)
+    assert edited["grams"][0] == 25 and first["grams"][0] == 20
+    assert main.get_forecast_tables()["grams"].tolist() == main.get_forecast_tables(template=main.FEED_LOGIC_TEMPLATE)["grams"].tolist()
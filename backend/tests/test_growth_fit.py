@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+import main
+from growth_fit import FCR_BOUNDS, fit_gompertz, fit_growth_model, gompertz_weight
+from series_store import BatchSeries
+
+CURVE = {"rate": 0.06, "scale": 3.5}
+
+
+def weigh_ins(start_weight, days, noise=0.0, seed=0):
+    weights = gompertz_weight(CURVE, start_weight, days.astype(np.float64))
+    return weights * np.random.default_rng(seed).normal(1.0, noise, days.size) if noise else weights
+
+
+def test_gompertz_recovers_a_known_curve():
+    days = np.tile(np.arange(3, 31, 3), 4)
+    fit = fit_gompertz(days, weigh_ins(45.0, days, noise=0.01) / 45.0)
+    assert fit["rate"] == pytest.approx(CURVE["rate"], rel=0.03)
+    assert fit["scale"] == pytest.approx(CURVE["scale"], rel=0.03)
+    assert fit["rmse"] < 0.02
+
+
+def test_fcr_is_clipped_to_its_bounds():
+    days = np.arange(1, 31)
+    weights = weigh_ins(45.0, days)
+    batch = {"startWeight": 45.0, "weights": weights, "feedGrams": np.zeros(30)}
+    template = np.full(30, 50.0)
+
+    gorged = fit_growth_model([{**batch, "feedGrams": np.full(30, 5000.0)}], template)
+    assert gorged["fcr"] == [FCR_BOUNDS[1]] * 30
+    starved = fit_growth_model([{**batch, "feedGrams": np.full(30, 0.01)}], template)
+    assert starved["fcr"] == [FCR_BOUNDS[0]] * 30
+
+    # Unlogged days fall back to the template's grams, then go through the same clip
+    model = fit_growth_model([batch], template)
+    assert model["intakeGrams"] == [50.0] * 30
+    assert all(FCR_BOUNDS[0] <= fcr <= FCR_BOUNDS[1] for fcr in model["fcr"])
+
+
+def completed_batches(count):
+    """`count` completed batches with weigh-ins every third day and a steady feed log."""
+    index, series = {}, {}
+    for i in range(count):
+        bid = f"growth-{i}"
+        days = np.arange(1, 31)
+        weights = np.where(days % 3 == 0, weigh_ins(45.0, days, noise=0.01, seed=i), 0)
+        index[bid] = {"status": "completed", "startingPopulation": 1000, "averageChickWeight": 45.0}
+        series[bid] = BatchSeries.from_node(bid, {"days": 30, "startDate": "2026-01-01", "weight": weights.tolist(),
+                                                  "feedKg": (days * 4.0).tolist()})
+    return index, series
+
+
+@pytest.fixture
+def growth_sandbox(client, monkeypatch):
+    """Runs refits over synthetic completed batches in-process, restoring the model afterwards."""
+    fits = []
+
+    def install(count):
+        index, series = completed_batches(count)
+
+        async def by_status(status):
+            assert status == 'completed'
+            return index
+
+        async def load_many(batch_ids, index=None):
+            return [series[bid] for bid in batch_ids]
+
+        def fit(*args):
+            fits.append(args)
+            return fit_growth_model(*args)
+
+        monkeypatch.setattr(main, "get_batches_by_status", by_status)
+        monkeypatch.setattr(main, "load_series_many", load_many)
+        monkeypatch.setattr(main, "fit_growth_model", fit)
+        monkeypatch.setattr(main, "get_growth_pool", lambda: None)
+
+    monkeypatch.setitem(main.growth_state, "model", None)
+    monkeypatch.setattr(main, "FARM_ID", "growth-test")
+    return install, fits
+
+
+def test_too_few_batches_keep_the_template(client, growth_sandbox):
+    install, fits = growth_sandbox
+    install(main.GROWTH_MIN_BATCHES - 1)
+    template = main.get_forecast(1000, 45.0)
+
+    assert client.portal.call(main.refit_growth_model) is None
+    assert fits == []
+    assert main.active_growth_model() is None
+    assert main.get_forecast(1000, 45.0) == template
+
+
+def test_enough_batches_swap_the_forecast_tables(client, growth_sandbox):
+    install, fits = growth_sandbox
+    install(main.GROWTH_MIN_BATCHES)
+    template_fcr = main.get_forecast_tables()["fcr"].tolist()
+    template_hash = main.get_forecast(1000, 45.0)[2]
+
+    model = client.portal.call(main.refit_growth_model)
+    assert len(fits) == 1 and model["batches"] == main.GROWTH_MIN_BATCHES
+    assert main.active_growth_model() is model
+    assert model["gompertz"]["rate"] == pytest.approx(CURVE["rate"], rel=0.05)
+
+    tables = main.get_forecast_tables(model=model)
+    assert tables["fcr"].tolist() == model["fcr"][:main.DEFAULT_CYCLE_DAYS]
+    assert tables["fcr"].tolist() != template_fcr
+    assert main.get_forecast(1000, 45.0)[2] != template_hash
+    assert main.db_ref(f'growth_models/growth-test/{main.FORECAST_TEMPLATE_VERSION}/version').get() == model["version"]
+
+    # The same completed batches don't refit again
+    assert client.portal.call(main.refit_growth_model) is model
+    assert len(fits) == 1
@@ -0,0 +1,59 @@
+import asyncio
+
+import main
+
+
+async def drain(queue, count, timeout=2.0):
+    """Waits for `count` messages on the queue and returns them."""
+    return [await asyncio.wait_for(queue.get(), timeout) for _ in range(count)]
+
+
+def test_one_event_reaches_every_subscriber(client, make_batch):
+    bid = make_batch()
+    topic = f"sales:{bid}"
+
+    async def scenario():
+        queues = [asyncio.Queue(maxsize=main.LIVE_QUEUE_SIZE) for _ in range(3)]
+        for queue in queues:
+            await main.live_subscribe([topic], queue)
+        try:
+            assert len(main.live_topics[topic]["queues"]) == 3
+            await main.db_set(f'global_batches/{bid}/sales/live-1', {"amount": 10})
+            return [await drain(queue, 1) for queue in queues]
+        finally:
+            for queue in queues:
+                main.live_unsubscribe([topic], queue)
+
+    received = client.portal.call(scenario)
+    assert all(messages == received[0] for messages in received)
+    assert received[0][0].startswith(f"event: {topic}\n")
+    assert '"/live-1"' in received[0][0]
+    assert topic not in main.live_topics
+
+
+def test_full_subscriber_is_dropped_without_blocking_the_others(client, make_batch):
+    bid = make_batch()
+    topic = f"sales:{bid}"
+
+    async def scenario():
+        slow = asyncio.Queue(maxsize=1)
+        fast = [asyncio.Queue(maxsize=main.LIVE_QUEUE_SIZE) for _ in range(2)]
+        for queue in [slow, *fast]:
+            await main.live_subscribe([topic], queue)
+        try:
+            dropped = main.live_stats["dropped_clients"]
+            slow.put_nowait("backlog")
+            await main.db_set(f'global_batches/{bid}/sales/live-1', {"amount": 10})
+            await main.db_set(f'global_batches/{bid}/sales/live-2', {"amount": 20})
+            delivered = [await drain(queue, 2) for queue in fast]
+            return dropped, slow, delivered
+        finally:
+            for queue in [slow, *fast]:
+                main.live_unsubscribe([topic], queue)
+
+    dropped, slow, delivered = client.portal.call(scenario)
+    assert main.live_stats["dropped_clients"] == dropped + 1
+    # The slow client's backlog is discarded and replaced by the final "dropped" marker
+    assert slow.qsize() == 1 and slow.get_nowait() is main.LIVE_DROPPED
+    for messages in delivered:
+        assert '"/live-1"' in messages[0] and '"/live-2"' in messages[1]
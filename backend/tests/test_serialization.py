@@ -0,0 +1,45 @@
+import json
+from datetime import datetime
+
+import numpy as np
+
+import main
+from conftest import AUTH
+
+
+def test_fast_response_matches_the_stdlib_encoding():
+    payload = {"batches": [{"id": "b1", "batchName": "Ñ Batch", "startingPopulation": 1000, "ratio": 0.1}],
+               "nested": {"logs": {"2026-01-01": {"am": 1.5, "pm": None}}}, "flags": [True, False]}
+    assert json.loads(main.FastJSONResponse(payload).body) == json.loads(json.dumps(payload))
+
+
+def test_fast_response_encodes_numpy_models_and_int_keys():
+    expense = main.ExpenseSchema(batchId="b1", category="Feed", itemName="Starter", amount=10, quantity=1,
+                                 unit="sack", date="2026-01-02")
+    body = json.loads(main.FastJSONResponse({
+        "series": np.array([1.5, 2.0]), "total": np.float64(3.5), 7: "day",
+        "expense": expense, "at": datetime(2026, 1, 2, 3, 4, 5)
+    }).body)
+    assert body["series"] == [1.5, 2.0] and body["total"] == 3.5 and body["7"] == "day"
+    assert body["expense"]["itemName"] == "Starter"
+    assert body["at"].startswith("2026-01-02")
+
+
+def test_app_responds_with_the_fast_class(client):
+    assert main.app.router.default_response_class is main.FastJSONResponse
+    response = client.get("/get-batches", headers=AUTH)
+    assert response.headers["content-type"] == "application/json"
+    assert isinstance(response.json(), list)
+
+
+def test_etag_follows_writes_that_bypass_the_api(client, make_batch):
+    bid = make_batch()
+    first = client.get("/get-batches", headers=AUTH)
+    etag = first.headers["etag"]
+    assert client.get("/get-batches", headers={**AUTH, "If-None-Match": etag}).status_code == 304
+
+    # e.g. the dashboard writing straight to Firebase
+    main.db_ref(f"global_batches/{bid}/batchName").set("Renamed outside the API")
+    second = client.get("/get-batches", headers={**AUTH, "If-None-Match": etag})
+    assert second.status_code == 200 and second.headers["etag"] != etag
+    assert any(b["batchName"] == "Renamed outside the API" for b in second.json())
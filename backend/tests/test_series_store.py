@@ -0,0 +1,82 @@
+import base64
+import zlib
+
+import numpy as np
+import pytest
+
+from series_store import BatchSeries, align, metric_row
+
+
+def make_series(batch_id, start_date, **columns):
+    days = max(len(column) for column in columns.values())
+    return BatchSeries.from_node(batch_id, {"days": days, "startDate": start_date, **columns})
+
+
+@pytest.fixture
+def long_series():
+    # 5 days: two of the weighings share a bucket at every=2
+    return make_series("a", "2026-01-01", mortality=[1, 2, 3, 4, 5], feedKg=[10, 10, 10, 10, 10],
+                       weight=[50, 100, 0, 300, 400])
+
+
+@pytest.fixture
+def short_series():
+    return make_series("b", "2026-03-01", mortality=[7, 8, 9], weight=[200, 0, 250])
+
+
+def test_pack_round_trip(long_series):
+    restored = BatchSeries.unpack("a", long_series.pack())
+    assert restored.start_date == long_series.start_date
+    assert restored.first_day == 1
+    assert np.array_equal(restored.values, long_series.values)
+
+    window = BatchSeries.unpack("a", long_series.range(3, 4).pack())
+    assert window.first_day == 3 and window.date_of(3) == "2026-01-03"
+    assert window.metric("mortality").tolist() == [3, 4]
+
+    undated = BatchSeries.unpack("c", make_series("c", None, feedKg=[1.25]).pack())
+    assert undated.start_date is None and undated.metric("feedKg").tolist() == [1.25]
+
+
+def test_unpack_rejects_a_foreign_blob():
+    blob = base64.b64encode(zlib.compress(b"XXXX" + bytes(14))).decode("ascii")
+    with pytest.raises(ValueError):
+        BatchSeries.unpack("a", blob)
+
+
+def test_downsample_sums_flows_and_averages_weighed_days(long_series):
+    buckets = long_series.downsample(2)
+    assert buckets[metric_row("mortality")].tolist() == [1 + 2, 3 + 4, 5]
+    assert buckets[metric_row("feedKg")].tolist() == [20, 20, 10]
+    assert buckets[metric_row("vitamins")].tolist() == [0, 0, 0]
+    # Day 3 was not weighed, so the middle bucket is day 4 alone
+    assert buckets[metric_row("weight")].tolist() == [(50 + 100) / 2, 300, 400]
+    assert np.array_equal(long_series.downsample(1), long_series.values)
+
+
+def test_align_pads_shorter_batches(long_series, short_series):
+    mortality = align([long_series, short_series], "mortality")
+    assert mortality.shape == (2, 5)
+    assert mortality[0].tolist() == [1, 2, 3, 4, 5]
+    assert mortality[1, :3].tolist() == [7, 8, 9] and np.isnan(mortality[1, 3:]).all()
+
+    weight = align([long_series, short_series], "weight")
+    assert np.isnan(weight[0, 2]) and np.isnan(weight[1, 1])
+
+    window = align([long_series, short_series], "mortality", first_day=2, last_day=4)
+    assert window[0].tolist() == [2, 3, 4]
+    assert window[1, :2].tolist() == [8, 9] and np.isnan(window[1, 2])
+
+
+def test_align_buckets_like_downsample(long_series, short_series):
+    sums = align([long_series, short_series], "mortality", every=2)
+    assert sums[0].tolist() == [3, 7, 5]
+    assert sums[1, :2].tolist() == [7 + 8, 9] and np.isnan(sums[1, 2])
+
+    totals = align([long_series, short_series], "mortality", every=2, cumulative=True)
+    assert totals[0].tolist() == [3, 10, 15]
+    assert totals[1, :2].tolist() == [15, 24] and np.isnan(totals[1, 2])
+
+    weight = align([long_series, short_series], "weight", every=2)
+    assert weight[0].tolist() == [75, 300, 400]
+    assert weight[1, :2].tolist() == [200, 250] and np.isnan(weight[1, 2])
@@ -0,0 +1,81 @@
+"""
+Cold-start budget: import main plus the first request, in a fresh interpreter.
+
+STARTUP_BUDGET_MS (default 2000) is checked against the best of three runs so
+one slow run on a busy machine does not fail the suite. The warm-up tests
+check that /ready follows the required steps only.
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import main
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "2000"))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+lazy = {m: m in sys.modules for m in ("firebase_admin", "httpx")}
+from starlette.testclient import TestClient  # pulls in httpx itself
+client = TestClient(main.app)
+ready = time.perf_counter()
+status = client.get("/health").status_code
+done = time.perf_counter()
+print(json.dumps({"importMs": (imported - start) * 1000, "firstRequestMs": (done - ready) * 1000,
+                  "status": status, "loaded": lazy}))
+"""
+
+
+def measure(tmp_path) -> dict:
+    env = {**os.environ, "STORAGE_BACKEND": "sqlite", "SQLITE_PATH": str(tmp_path / "startup.sqlite3"),
+           "FIREBASE_CREDENTIALS": str(tmp_path / "missing.json")}
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", PROBE], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def test_import_does_not_load_firebase_or_httpx(tmp_path):
+    result = measure(tmp_path)
+    assert result["status"] == 200
+    assert result["loaded"] == {"firebase_admin": False, "httpx": False}
+
+
+def test_cold_start_budget(tmp_path):
+    runs = [measure(tmp_path) for _ in range(3)]
+    best = min(r["importMs"] + r["firstRequestMs"] for r in runs)
+    assert best < STARTUP_BUDGET_MS, f"import + first request took {best:.0f} ms (budget {STARTUP_BUDGET_MS:.0f} ms)"
+
+
+def test_ready_without_firebase_on_sqlite(client):
+    client.portal.call(asyncio.wait_for, main.warm_up_task, 30)
+    body = client.get("/ready").json()
+    assert body["status"] == "ready"
+    assert "firebase" in body["errors"] and "batch_index" in body["steps"]
+
+
+def test_a_failing_step_does_not_stop_the_others(client, monkeypatch):
+    ran = []
+
+    async def fails():
+        raise RuntimeError("no credentials")
+
+    async def works():
+        ran.append("works")
+
+    monkeypatch.setattr(main, "WARM_UP_STEPS", [("required", fails), ("optional", fails), ("after", works)])
+    monkeypatch.setattr(main, "WARM_UP_OPTIONAL", {"optional"})
+    monkeypatch.setattr(main, "warm_up_state", {"ready": False, "started": None, "finished_ms": None, "steps": {}, "errors": {}})
+    client.portal.call(main.warm_up)
+    assert ran == ["works"]
+    assert main.warm_up_state["errors"] == {"required": "no credentials", "optional": "no credentials"}
+    assert client.get("/ready").status_code == 503
+
+    monkeypatch.setattr(main, "WARM_UP_STEPS", [("optional", fails), ("after", works)])
+    client.portal.call(main.warm_up)
+    assert client.get("/ready").status_code == 200
@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+import main
+
+
+def test_coalesce_nests_writes_under_an_earlier_ancestor():
+    rows = [(1, "global_batches/b1", {"batchName": "B1"}), (2, "global_batches/b1/status", "active"),
+            (3, "users/u1/status", "online"), (4, "users/u1/status", None)]
+    assert main.coalesce_outbox(rows) == {"global_batches/b1": {"batchName": "B1", "status": "active"},
+                                          "users/u1/status": None}
+
+
+def test_coalesce_keeps_list_ancestors_as_index_keyed_nodes():
+    rows = [(1, "batch_series/b1", {"feedKg": [1.5, 2.0, None, 4.0]}), (2, "batch_series/b1/feedKg/2", 3.0)]
+    assert main.coalesce_outbox(rows) == {"batch_series/b1": {"feedKg": {"0": 1.5, "1": 2.0, "2": 3.0, "3": 4.0}}}
+
+    rows = [(1, "batch_series/b2/weight", [10, 20]), (2, "batch_series/b2/weight/1", 25)]
+    assert main.coalesce_outbox(rows) == {"batch_series/b2/weight": {"0": 10, "1": 25}}
+
+
+def test_remote_events_are_applied_locally(client):
+    main.apply_remote_event(["sync_test"], SimpleNamespace(event_type="put", path="/",
+                                                           data={"a": {"x": 1}, "b": {"x": 2}}))
+    main.apply_remote_event(["sync_test"], SimpleNamespace(event_type="patch", path="/a",
+                                                           data={"x": 5, "y/z": "new"}))
+    main.apply_remote_event([], SimpleNamespace(event_type="put", path="/sync_test/b", data=None))
+    assert main.db_ref("sync_test").get() == {"a": {"x": 5, "y": {"z": "new"}}}
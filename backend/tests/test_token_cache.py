@@ -0,0 +1,103 @@
+import asyncio
+import base64
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+class CountingAuth:
+    """Stands in for firebase_admin.auth: token "<uid>:<seconds to expiry>"."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def verify_id_token(self, token):
+        self.calls += 1
+        uid, _, ttl = token.partition(":")
+        if uid == "bad":
+            raise ValueError("Invalid ID token")
+        return {"uid": uid, "exp": time.time() + float(ttl or 3600)}
+
+
+@pytest.fixture
+def auth(client, monkeypatch):
+    fake = CountingAuth()
+    monkeypatch.setattr(main, "get_firebase", lambda: SimpleNamespace(auth=fake))
+    monkeypatch.setattr(main, "token_cache", main.OrderedDict())
+    monkeypatch.setattr(main, "token_cache_stats", {"hits": 0, "misses": 0, "evictions": 0, "revoked": 0})
+    return fake
+
+
+def verify(token):
+    return asyncio.run(main.verify_token(f"Bearer {token}"))
+
+
+def test_token_is_verified_once(auth):
+    for _ in range(5):
+        assert verify("alice")["uid"] == "alice"
+    assert auth.calls == 1
+    assert main.get_token_cache_metrics()["hits"] == 4
+    assert main.get_token_cache_metrics()["misses"] == 1
+
+
+def test_cache_is_keyed_by_hash(auth):
+    verify("alice")
+    assert "alice" not in main.token_cache
+    assert main.token_hash("alice") in main.token_cache
+
+
+def test_expired_token_is_verified_again(auth):
+    verify("bob:0.05")
+    time.sleep(0.1)
+    verify("bob:0.05")
+    assert auth.calls == 2
+    assert main.get_token_cache_metrics()["evictions"] == 1
+
+
+def test_lru_cap(auth, monkeypatch):
+    monkeypatch.setattr(main, "TOKEN_CACHE_MAX", 2)
+    for uid in ("a", "b", "a", "c"):
+        verify(uid)
+    assert set(main.token_cache) == {main.token_hash("a"), main.token_hash("c")}
+
+
+def test_revocation_hooks(auth):
+    verify("carol")
+    verify("carol:7200")
+    main.revoke_cached_token("carol")
+    verify("carol")
+    assert auth.calls == 3
+    main.revoke_cached_tokens_for_uid("carol")
+    assert len(main.token_cache) == 0
+
+
+def test_invalid_and_missing_tokens_are_401(auth):
+    with pytest.raises(HTTPException) as err:
+        verify("bad")
+    assert err.value.status_code == 401
+    with pytest.raises(HTTPException):
+        asyncio.run(main.verify_token(None))
+    assert len(main.token_cache) == 0
+
+
+def test_cert_preload_goes_through_the_public_verifier(monkeypatch):
+    from firebase_admin import auth as firebase_auth
+    seen = []
+
+    def verify_id_token(token):
+        seen.append(token)
+        raise firebase_auth.InvalidIdTokenError("unknown kid", cause=None)
+
+    fake = SimpleNamespace(verify_id_token=verify_id_token, InvalidIdTokenError=firebase_auth.InvalidIdTokenError)
+    monkeypatch.setattr(main, "get_firebase", lambda: SimpleNamespace(auth=fake, app=SimpleNamespace(project_id="farm")))
+    main.preload_token_certs()
+
+    header, payload = [json.loads(base64.urlsafe_b64decode(part + "=" * (-len(part) % 4)))
+                       for part in seen[0].split(".")[:2]]
+    assert header["alg"] == "RS256" and header["kid"]
+    assert payload == {"aud": "farm", "iss": "https://securetoken.google.com/farm", "sub": "preload"}
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+import main
+from conftest import AUTH
+
+
+@pytest.fixture(autouse=True)
+def template_plan(monkeypatch):
+    # Compare against the feed template, not a growth model fitted by other tests' batches
+    monkeypatch.setattr(main, "active_growth_model", lambda: None)
+    main.variance_cache.clear()
+
+
+def reference_plan(population=1000, start_weight=50.0):
+    feed = main.generate_forecast_data(population)
+    weights, current = [], start_weight
+    for row in feed:
+        current += row["gramsPerBird"] / main.get_estimated_fcr(row["day"])
+        weights.append(current)
+    return [row["targetKilos"] for row in feed], weights
+
+
+def log(client, bid, kind, date, **fields):
+    response = client.post("/add-daily-log", headers=AUTH, json={"batchId": bid, "kind": kind, "date": date, **fields})
+    assert response.status_code == 200, response.text
+
+
+def test_daily_variance_against_the_scalar_plan(client, make_batch):
+    bid = make_batch(date_created="2026-01-01", population=1000)
+    targets, weights = reference_plan()
+    log(client, bid, "feed_logs", "2026-01-01", am=targets[0])
+    log(client, bid, "feed_logs", "2026-01-02", am=targets[1] + 5)
+    client.post("/add-weight-log", headers=AUTH, json={"batchId": bid, "date": "2026-01-03", "day": 3,
+                                                       "averageWeight": round(weights[2]) + 10})
+
+    result = client.get(f"/batch-variance/{bid}", headers=AUTH).json()
+    days = result["days"]
+    assert result["day"] == 3 and [d["date"] for d in days] == ["2026-01-01", "2026-01-02", "2026-01-03"]
+    assert days[0]["feedVarianceKg"] == pytest.approx(0)
+    assert days[1]["feedVarianceKg"] == pytest.approx(5)
+    assert days[2]["feedKg"] is None and days[2]["feedVarianceKg"] is None
+    assert days[2]["forecastWeight"] == pytest.approx(weights[2], abs=1e-3)
+    assert days[2]["weightVarianceG"] == pytest.approx(round(weights[2]) + 10 - weights[2], abs=1e-3)
+
+    summary = result["summary"]
+    assert summary["feedVarianceKg"] == pytest.approx(5)
+    assert summary["weightDay"] == 3 and summary["estimatedFcr"] == main.get_estimated_fcr(3)
+    # population 1000: planned kg per flock == planned g per bird
+    assert summary["fcrPlan"] == pytest.approx(sum(targets[:3]) / (weights[2] - 50.0), abs=1e-3)
+
+
+def test_variance_updates_as_each_log_lands(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    log(client, bid, "feed_logs", "2026-01-01", am=30)
+    first = client.get(f"/batch-variance/{bid}", headers=AUTH).json()
+    assert bid in main.variance_cache
+
+    log(client, bid, "feed_logs", "2026-01-02", am=40)
+    second = client.get(f"/batch-variance/{bid}", headers=AUTH).json()
+    assert first["day"] == 1 and second["day"] == 2
+    assert second["summary"]["feedKg"] == 70
+
+
+def test_batched_pass_matches_one_batch_at_a_time(client, make_batch):
+    ids = [make_batch(date_created="2026-01-01", population=p) for p in (900, 1500)]
+    for i, bid in enumerate(ids):
+        for day in range(1, 6):
+            log(client, bid, "feed_logs", f"2026-01-0{day}", am=20 + day * (i + 1))
+            log(client, bid, "mortality_logs", f"2026-01-0{day}", am=i)
+    index = {bid: main.db_ref(f"batch_index/{bid}").get() for bid in ids}
+    series = [main.BatchSeries.from_node(bid, main.db_ref(f"batch_series/{bid}").get()) for bid in ids]
+
+    together = main.compute_variance([index[b] for b in ids], series)
+    for i, bid in enumerate(ids):
+        assert together[i] == main.compute_variance([index[bid]], [series[i]])[0]
+    assert np.isclose(together[1]["summary"]["feedKg"], sum(20 + 2 * d for d in range(1, 6)))
+
+
+def test_active_variance_lists_only_active_batches(client, make_batch):
+    make_batch()
+    body = client.get("/variance/active", headers=AUTH).json()
+    active = main.db_ref("batch_index").order_by_child("status").equal_to("active").get()
+    assert [b["batchId"] for b in body["batches"]] == list(active)
+    assert all("days" not in b for b in body["batches"])
+    assert all("days" in b for b in client.get("/variance/active?days=true", headers=AUTH).json()["batches"])
+
+
+def test_unknown_batch(client):
+    assert client.get("/batch-variance/no-such-batch", headers=AUTH).status_code == 400
+
+
+def test_direct_write_reaches_variance_after_a_reconcile_pass(client, make_batch):
+    bid = make_batch(date_created="2026-01-01")
+    client.put(f"/update-batch/{bid}", headers=AUTH, json={"status": "active"})
+    main.db_ref(f"batch_series/{bid}").delete()
+    for kind in main.LOG_KINDS:
+        main.db_ref(f"global_batches/{bid}/{kind}").delete()
+    log(client, bid, "feed_logs", "2026-01-01", am=30)
+    assert client.get(f"/batch-variance/{bid}", headers=AUTH).json()["day"] == 1
+
+    main.db_ref(f"global_batches/{bid}/feed_logs/2026-01-02").set({"am": 25, "pm": 15, "timestamp": 1})
+    client.portal.call(main.reconcile_active_batches)
+    result = client.get(f"/batch-variance/{bid}", headers=AUTH).json()
+    assert result["day"] == 2 and result["summary"]["feedKg"] == 70
+    assert result["days"][1]["feedKg"] == 40
@@ -0,0 +1,129 @@
+"""/get-temperature against a local stand-in for open-meteo (no network)."""
+import asyncio
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import main
+from conftest import AUTH
+
+
+class StubWeather(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.requests = []
+        self.temperature = 30.0
+        self.delay = 0.1
+        self.status = 200
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1/forecast"
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        time.sleep(self.server.delay)
+        body = json.dumps({"current": {"temperature_2m": self.server.temperature, "relative_humidity_2m": 70,
+                                       "weather_code": 1, "is_day": 1}}).encode("utf-8")
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream(client, monkeypatch):
+    server = StubWeather()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(main, "WEATHER_API_URL", server.url)
+    main.weather_cache.clear()
+    main.weather_written.update(loaded=False, payload=None)
+    for key in main.weather_stats:
+        main.weather_stats[key] = 0
+    main.db_ref("current_weather").delete()
+    main.http_client = None
+    yield server
+    server.shutdown()
+    server.server_close()
+    main.http_client = None
+
+
+def run(coro_fn):
+    """Runs one scenario on a fresh loop; the pooled client is closed on the loop that opened it."""
+    async def scenario():
+        try:
+            return await coro_fn()
+        finally:
+            await main.close_http_client()
+    return asyncio.run(scenario())
+
+
+def expire(seconds: float):
+    for key, (fetched, payload) in list(main.weather_cache.items()):
+        main.weather_cache[key] = (fetched - seconds, payload)
+
+
+def test_concurrent_misses_share_one_upstream_call(upstream):
+    async def scenario():
+        results = await asyncio.gather(*(main.get_weather(10.5, 122.9) for _ in range(25)))
+        again = await main.get_weather(10.5, 122.9)
+        return results, again
+
+    results, again = run(scenario)
+    assert len(upstream.requests) == 1
+    assert {r["temperature"] for r in results} == {30.0} and again is results[0]
+    assert main.weather_stats["misses"] == 25 and main.weather_stats["hits"] == 1
+    assert "latitude=10.5" in upstream.requests[0]
+
+
+def test_locations_are_cached_separately(upstream):
+    run(lambda: asyncio.gather(main.get_weather(10.5, 122.9), main.get_weather(14.6, 121.0)))
+    assert len(upstream.requests) == 2
+    assert set(main.weather_cache) == {(10.5, 122.9), (14.6, 121.0)}
+
+
+def test_stale_value_is_served_while_revalidating(upstream):
+    async def scenario():
+        await main.get_weather(10.5, 122.9)
+        upstream.temperature = 31.5
+        expire(main.WEATHER_TTL_SECONDS + 1)
+        stale = await main.get_weather(10.5, 122.9)
+        await asyncio.sleep(upstream.delay * 3)
+        return stale, await main.get_weather(10.5, 122.9)
+
+    stale, fresh = run(scenario)
+    assert stale["temperature"] == 30.0 and fresh["temperature"] == 31.5
+    assert len(upstream.requests) == 2 and main.weather_stats["stale"] == 1
+
+
+def test_database_is_written_only_when_the_reading_changes(upstream):
+    async def scenario():
+        for temperature in (30.0, 30.0, 32.0):
+            upstream.temperature = temperature
+            main.weather_cache.clear()
+            await main.get_weather(10.5, 122.9)
+
+    run(scenario)
+    assert len(upstream.requests) == 3
+    assert main.weather_stats["db_writes"] == 2
+    assert main.db_ref("current_weather/temperature").get() == 32.0
+
+
+def test_upstream_failure_falls_back_to_the_stored_reading(client, upstream):
+    main.db_ref("current_weather").set({"temperature": 27.0, "humidity": 80})
+    upstream.status = 503
+    body = client.get("/get-temperature?lat=1&lon=2", headers=AUTH).json()
+    client.portal.call(main.close_http_client)
+    assert body == {"temperature": 27.0, "humidity": 80}
+    assert main.weather_stats["upstream_errors"] == 1
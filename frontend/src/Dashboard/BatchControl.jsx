@@ -118,7 +118,7 @@ const BatchControl = () => {
       const user = auth.currentUser;
       if (!user) return;
       const token = await user.getIdToken();
-      const response = await fetch(`${backendUrl}/get-batches`, { headers: { "Authorization": `Bearer ${token}` } });
+      const response = await fetch(`${backendUrl}/get-batches?fields=batchName,dateCreated,expectedCompleteDate,startingPopulation,status`, { headers: { "Authorization": `Bearer ${token}` } });
       if (response.ok) {
         let data = await response.json();
         setBatches(data);
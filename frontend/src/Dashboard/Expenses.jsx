@@ -98,7 +98,7 @@ const Expenses = () => {
       if (!user) return;
       const token = await user.getIdToken();
       fetchStaffData(token);
-      const batchRes = await fetch(`${backendUrl}/get-batches`, { headers: { "Authorization": `Bearer ${token}` }});
+      const batchRes = await fetch(`${backendUrl}/get-batches?fields=status`, { headers: { "Authorization": `Bearer ${token}` }});
       if (batchRes.ok) {
         const batches = await batchRes.json();
         const active = batches.find(b => b.status === 'active');
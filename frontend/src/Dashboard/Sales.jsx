@@ -70,7 +70,7 @@ const Sales = () => {
       if (!user) return;
       const token = await user.getIdToken();
 
-      const batchRes = await fetch(`${backendUrl}/get-batches`, {
+      const batchRes = await fetch(`${backendUrl}/get-batches?fields=status`, {
         headers: { "Authorization": `Bearer ${token}` }
       });
       